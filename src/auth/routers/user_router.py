@@ -12,6 +12,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from database import db_helper
 from auth.service import UserService, get_user_service
 from auth.schemas import UserOut
+from redis_cache import RedisCache, get_redis_helper
 
 
 from auth.validation import (
@@ -79,8 +80,10 @@ async def delete_user_account(
     user_service: Annotated[UserService, Depends(get_user_service)],
     session: Annotated[AsyncSession, Depends(db_helper.session_getter)],
     user: Annotated[UserOut, Depends(get_current_active_auth_user)],
+    redis_helper: Annotated[RedisCache, Depends(get_redis_helper)],
 ) -> None:
     return await user_service.delete_user_account(
         session=session,
-        user=user
+        user=user,
+        redis_helper=redis_helper
     )
\ No newline at end of file
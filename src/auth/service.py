@@ -7,8 +7,12 @@ from auth.repository import (
 from sqlalchemy.ext.asyncio import AsyncSession
 from auth.schemas import UserIn, UserOut
 from auth.custom_exceptions import UserCreateException
+from music.cache_dependencies import user_ref
+from music.constants import ALBUMS, SONGS
+from music.list_cache import generation_key
 from music.service.album_service import AlbumService, get_album_service
 from music.tasks import send_email_message_after_register_or_login
+from redis_cache import RedisCache
 
 
 class AbstractUserService(ABC):
@@ -123,16 +127,26 @@ class UserService(AbstractUserService):
     async def delete_user_account(
         session: AsyncSession,
         user: UserOut,
+        redis_helper: RedisCache,
         user_repository: UserRepository = get_user_repository(),
         album_service: AlbumService = get_album_service()
     ) -> None:
+        # Файлы альбомов удаляются из хранилища фоновой задачей, запрос ждет только БД
         for album in user.albums:
             await album_service.delete_album(
                 session=session, 
                 album_id=album.id,
+                redis_helper=redis_helper,
                 user=user
             )
         await user_repository.delete_user_account(session=session, user=user)
+        # Исполнитель есть в ответах своих песен и альбомов, в том числе в чужих альбомах
+        await redis_helper.invalidate([user_ref(user.id)])
+        await redis_helper.bump_generations({
+            generation_key(SONGS), 
+            generation_key(ALBUMS), 
+            generation_key('artist', user.id),
+        })
 
 
 # Зависимость для получения сервиса
@@ -0,0 +1,74 @@
+"""
+Размер значения в кэше и время его превращения в ответ для разных кодеков.
+
+Без Redis и БД: на типичной песне сравнивается старый путь (словарь в orjson
+или msgpack, затем валидация SongOut и сериализация ответа) с кэшированием
+готового JSON-тела (ResponseCodec).
+
+    cd src
+    python -m benchmarks.cache_codecs --iterations 20000
+"""
+import argparse
+import time
+from datetime import datetime, timezone
+
+from cache_codec import CODECS, ResponseCodec, decode, encode, msgpack
+from config import settings
+from auth.schemas import UserBase
+from music.schemas import AlbumBase, SongOut
+from music.streaming import cached_entity
+
+
+def sample_song() -> SongOut:
+    now = datetime.now(timezone.utc)
+    return SongOut(
+        id=1,
+        name='Song name',
+        genre='rock',
+        artist_id=1,
+        album_id=1,
+        file_url='songs/music/ab/ab12cd34ef56ab12cd34ef56ab12cd34ef56ab12cd34ef56ab12cd34ef56ab12.mp3',
+        photo_url='songs/images/cd/cd12ab34ef56ab12cd34ef56ab12cd34ef56ab12cd34ef56ab12cd34ef56ab12.jpeg',
+        duration=215,
+        bitrate=320,
+        artist=UserBase(username='artist', email='artist@example.com', password_hash='x' * 60),
+        album=AlbumBase(name='Album name', artist_id=1),
+        created_at=now,
+        updated_at=now,
+    )
+
+
+def measure(name: str, data: bytes, to_response, iterations: int) -> None:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        to_response(decode(data))
+    elapsed = time.perf_counter() - started
+    print(f"{name:>10}: {len(data):5d} bytes, {elapsed / iterations * 1_000_000:7.2f} us per response")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    song = sample_song()
+    threshold = settings.redis.compress_threshold
+
+    def revalidate(value: dict) -> bytes:
+        # Так работал get_song: словарь из кэша снова проходил через SongOut
+        return SongOut.model_validate(value).model_dump_json().encode()
+
+    codecs = ['orjson'] + (['msgpack'] if msgpack is not None else [])
+    for name in codecs:
+        value = song.model_dump(mode='json')
+        measure(name, encode(value, CODECS[name](), threshold), revalidate, args.iterations)
+    measure(
+        'response',
+        encode(cached_entity(song), ResponseCodec(), threshold),
+        lambda cached: cached.body,
+        args.iterations
+    )
+
+
+if __name__ == '__main__':
+    main()
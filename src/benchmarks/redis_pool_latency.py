@@ -0,0 +1,82 @@
+"""
+Задержка GET /music/{id}/ с общим пулом Redis и с соединением на каждый запрос.
+
+Старое поведение get_redis_helper - новый клиент, from_url и disconnect на
+каждый запрос - подставляется через dependency_overrides. Запросы идут
+в приложение в том же процессе (ASGITransport), Redis и БД - из настроек (.env).
+Песня song_id должна существовать.
+
+    cd src
+    python -m benchmarks.redis_pool_latency --song-id 1 --requests 2000 --concurrency 32
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from httpx import ASGITransport, AsyncClient
+
+from config import settings
+from main import app
+from redis_cache import RedisCache, get_redis_helper, redis_helper
+
+
+async def per_request_redis_helper():
+    # Так работал get_redis_helper до общего пула
+    helper = RedisCache(
+        redis_url=f"redis://{settings.redis.host}:{settings.redis.port}/{settings.redis.second_db}"
+    )
+    await helper.connect()
+    try:
+        yield helper
+    finally:
+        await helper.disconnect()
+
+
+async def run(mode: str, client: AsyncClient, song_id: int, requests: int, concurrency: int) -> None:
+    latencies: list[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def request() -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.get(f'/music/{song_id}/')
+            latencies.append(time.perf_counter() - started)
+            response.raise_for_status()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(request() for _ in range(requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies_ms = sorted(latency * 1000 for latency in latencies)
+    print(
+        f'{mode:>11}: {requests / elapsed:7.0f} req/s | '
+        f'latency mean {statistics.mean(latencies_ms):6.2f} ms, '
+        f'p50 {latencies_ms[len(latencies_ms) // 2]:6.2f} ms, '
+        f'p99 {latencies_ms[int(len(latencies_ms) * 0.99)]:6.2f} ms'
+    )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--song-id', type=int, default=1)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    args = parser.parse_args()
+
+    await redis_helper.connect()
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url='http://benchmark') as client:
+            # Прогрев: соединения с БД и Redis уже открыты в обоих режимах
+            await client.get(f'/music/{args.song_id}/')
+
+            app.dependency_overrides[get_redis_helper] = per_request_redis_helper
+            await run('per-request', client, args.song_id, args.requests, args.concurrency)
+            app.dependency_overrides.pop(get_redis_helper)
+            await run('pooled', client, args.song_id, args.requests, args.concurrency)
+    finally:
+        await redis_helper.disconnect()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,96 @@
+"""
+Задержка event loop при параллельных загрузках в S3.
+
+Сравнивает старое поведение (блокирующий вызов boto3 прямо в корутине) с
+общим клиентом s3_helper, который выполняет вызовы в пуле потоков.
+Работает с бакетом из настроек (.env), загруженные объекты удаляются.
+
+    cd src
+    python -m benchmarks.s3_event_loop_lag --uploads 32 --size-kb 512
+"""
+import argparse
+import asyncio
+import io
+import statistics
+import time
+from uuid import uuid4
+
+from fastapi import UploadFile
+
+from config import settings
+from music.constants import KB, MUSIC, SUPPORTED_FILE_TYPES
+from storage.s3 import S3Client
+
+
+# Замер касается именно клиента S3, независимо от STORAGE__BACKEND
+s3_helper = S3Client(
+    bucket_name=settings.aws.bucket_name,
+    max_pool_connections=settings.aws.max_pool_connections,
+    max_workers=settings.aws.max_workers,
+    endpoint_url=settings.aws.endpoint_url,
+)
+
+
+TICK = 0.01
+
+
+async def monitor_lag(lags: list[float], stop: asyncio.Event) -> None:
+    # Насколько позже запланированного просыпается корутина - это и есть задержка loop
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - started - TICK)
+
+
+async def blocking_upload(key: str, payload: bytes) -> None:
+    # Так работал S3Client до общего клиента: put_object прямо в event loop
+    s3_helper.client.put_object(Bucket=s3_helper.AWS_BUCKET_NAME, Key=key, Body=payload)
+
+
+async def pooled_upload(key: str, payload: bytes) -> None:
+    file = UploadFile(file=io.BytesIO(payload), filename=f'{key}.mp3', size=len(payload))
+    await s3_helper.upload_file(file=file, key=key, SUPPORTED_FILE_TYPES=SUPPORTED_FILE_TYPES[MUSIC])
+
+
+async def run(mode: str, upload, uploads: int, payload: bytes) -> list[str]:
+    keys = [f'benchmarks/{uuid4()}' for _ in range(uploads)]
+    lags: list[float] = []
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(monitor_lag(lags, stop))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(upload(key, payload) for key in keys))
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await monitor
+    lags_ms = sorted(lag * 1000 for lag in lags) or [0.0]
+    print(
+        f'{mode:>9}: wall {elapsed:6.2f} s | '
+        f'loop lag mean {statistics.mean(lags_ms):7.1f} ms, '
+        f'p99 {lags_ms[int(len(lags_ms) * 0.99)]:7.1f} ms, '
+        f'max {lags_ms[-1]:7.1f} ms'
+    )
+    return keys
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--uploads', type=int, default=32)
+    parser.add_argument('--size-kb', type=int, default=512)
+    args = parser.parse_args()
+
+    # Загрузка проверяет первые байты: заголовок ID3 выдает нули за MP3
+    payload = b'ID3' + b'\0' * (args.size_kb * KB - 3)
+    s3_helper.connect()
+    keys = []
+    try:
+        keys += await run('blocking', blocking_upload, args.uploads, payload)
+        keys += await run('pooled', pooled_upload, args.uploads, payload)
+    finally:
+        await s3_helper.delete_files(keys)
+        s3_helper.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
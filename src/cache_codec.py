@@ -0,0 +1,133 @@
+import struct
+import zlib
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Any
+
+import orjson
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+# флаги во втором байте заголовка: данные сжаты zlib; перед данными - мягкий срок жизни
+COMPRESSED = 0x01
+SOFT_TTL = 0x02
+# время (unix), до которого значение свежее; после него - устаревшее, но еще отдается
+_FRESH_UNTIL = struct.Struct('>d')
+# быстрее уровня по умолчанию, а на JSON выигрыш по размеру почти тот же
+COMPRESSION_LEVEL = 1
+
+
+class CodecError(ValueError):
+    pass
+
+
+class Codec(ABC):
+    """
+    Сериализация значений кэша.
+
+    Значение в Redis: байт codec.tag, байт флагов, [fresh_until], данные. Читатель выбирает
+    кодек по тегу, поэтому смена кодека не ломает уже записанные ключи.
+    """
+    tag: bytes
+
+    @abstractmethod
+    def dumps(self, value: Any) -> bytes:
+        raise NotImplementedError
+
+    @abstractmethod
+    def loads(self, data: bytes) -> Any:
+        raise NotImplementedError
+
+
+class OrjsonCodec(Codec):
+    tag = b'j'
+
+    def dumps(self, value: Any) -> bytes:
+        return orjson.dumps(value)
+
+    def loads(self, data: bytes) -> Any:
+        return orjson.loads(data)
+
+
+class MsgpackCodec(Codec):
+    tag = b'm'
+
+    def __init__(self):
+        if msgpack is None:
+            raise RuntimeError('msgpack is not installed')
+
+    def dumps(self, value: Any) -> bytes:
+        return msgpack.packb(value)
+
+    def loads(self, data: bytes) -> Any:
+        return msgpack.unpackb(data)
+
+
+@dataclass
+class CachedResponse:
+    """Тело JSON-ответа, сериализованное один раз при записи, и его ETag."""
+    body: bytes
+    etag: str
+
+
+class ResponseCodec(Codec):
+    # ETag и тело через перевод строки: в ETag его быть не может
+    tag = b'r'
+
+    def dumps(self, value: CachedResponse) -> bytes:
+        return value.etag.encode() + b'\n' + value.body
+
+    def loads(self, data: bytes) -> CachedResponse:
+        etag, body = data.split(b'\n', 1)
+        return CachedResponse(body=body, etag=etag.decode())
+
+
+CODECS: dict[str, type[Codec]] = {
+    'orjson': OrjsonCodec,
+    'msgpack': MsgpackCodec,
+}
+_CODECS_BY_TAG: dict[bytes, type[Codec]] = {
+    codec.tag: codec for codec in (*CODECS.values(), ResponseCodec)
+}
+
+
+def encode(
+    value: Any, 
+    codec: Codec, 
+    compress_threshold: int = 0, 
+    fresh_until: float | None = None,
+) -> bytes:
+    data = codec.dumps(value)
+    flags = 0
+    if compress_threshold and len(data) >= compress_threshold:
+        data = zlib.compress(data, COMPRESSION_LEVEL)
+        flags |= COMPRESSED
+    if fresh_until is not None:
+        flags |= SOFT_TTL
+        data = _FRESH_UNTIL.pack(fresh_until) + data
+    return codec.tag + bytes([flags]) + data
+
+
+def decode_entry(data: bytes) -> tuple[Any, float | None]:
+    """Значение и время, до которого оно свежее (None - без мягкого срока жизни)."""
+    codec = _CODECS_BY_TAG.get(data[:1])
+    if codec is None or len(data) < 2:
+        raise CodecError(f'Unknown cache value format {data[:2]!r}')
+    flags, payload, fresh_until = data[1], data[2:], None
+    try:
+        if flags & SOFT_TTL:
+            (fresh_until,), payload = _FRESH_UNTIL.unpack_from(payload), payload[_FRESH_UNTIL.size:]
+        if flags & COMPRESSED:
+            payload = zlib.decompress(payload)
+        return codec().loads(payload), fresh_until
+    except (ValueError, struct.error, zlib.error) as err:
+        # Поврежденное значение - такой же промах, как значение чужого формата
+        raise CodecError(f'Corrupted cache value: {err}') from err
+
+
+def decode(data: bytes) -> Any:
+    return decode_entry(data)[0]
@@ -1,3 +1,4 @@
+from typing import Literal
 from pathlib import Path
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import BaseModel
@@ -52,6 +53,37 @@ class SMTPSettings(BaseModel):
 
 class AWSSettings(BaseModel):
     bucket_name: str
+    # размер пула HTTP-соединений boto3 и число потоков для блокирующих вызовов S3
+    max_pool_connections: int = 50
+    max_workers: int = 16
+    # адрес S3-совместимого хранилища (MinIO, moto server); None - AWS S3
+    endpoint_url: str | None = None
+    # время жизни presigned-ссылок на загрузку, секунды
+    presigned_upload_expire: int = 15 * 60
+    # время жизни presigned-ссылок на скачивание, секунды
+    presigned_download_expire: int = 60 * 60
+    # как часто Celery beat удаляет из хранилища файлы без ссылок, секунды
+    delete_interval: int = 5 * 60
+    # сколько файл без ссылок остается в хранилище после замены или удаления, секунды;
+    # не меньше presigned_download_expire, чтобы выданные ссылки не вели на 404
+    retire_delay: int = 60 * 60
+
+
+class StorageSettings(BaseModel):
+    # где лежат файлы: s3 - AWS S3, minio - S3-совместимое хранилище по aws.endpoint_url,
+    # local - каталог directory на этой машине
+    backend: Literal['s3', 'minio', 'local'] = 's3'
+    directory: str = "/tmp/musichub_storage"
+
+
+class MediaCacheSettings(BaseModel):
+    # локальный дисковый кэш популярных файлов перед S3
+    enabled: bool = True
+    directory: str = "/tmp/musichub_media_cache"
+    max_size: int = 2 * 1024 ** 3
+    # сколько копия живет на диске, секунды: после удаления объекта из хранилища
+    # (aws.retire_delay) узел отдает его не дольше этого срока
+    ttl: int = 10 * 60
 
 
 class RedisSettings(BaseModel):
@@ -59,6 +91,35 @@ class RedisSettings(BaseModel):
     port: str
     first_db: str
     second_db: str
+    # пул соединений кэша, общий для всех запросов
+    max_connections: int = 50
+    # таймауты чтения/записи и установки соединения, секунды
+    socket_timeout: float = 5.0
+    socket_connect_timeout: float = 5.0
+    # соединение, простоявшее дольше, перед использованием проверяется PING, секунды
+    health_check_interval: int = 30
+    # кэш в памяти процесса перед Redis для song/ и album/: число ключей (0 - выключен)
+    # и время жизни записи, секунды - страховка на случай потерянной инвалидации
+    local_cache_size: int = 10_000
+    local_cache_ttl: float = 5.0
+    # сериализация значений кэша (msgpack - если установлен) и порог сжатия zlib, байты (0 - без сжатия)
+    codec: Literal['orjson', 'msgpack'] = 'orjson'
+    compress_threshold: int = 1024
+    # время жизни ключей song/, album/ и списков list/, секунды; изменения сбрасывают их раньше
+    # (song/ и album/ - по зависимостям, см. RedisCache.invalidate; списки - через поколения)
+    song_ttl: int = 6 * 60 * 60
+    album_ttl: int = 6 * 60 * 60
+    list_ttl: int = 60 * 60
+    # время жизни derivatives/ - состава уменьшенных копий файла, секунды; задачи Celery
+    # сбрасывают ключ, когда добавляют копии
+    derivatives_ttl: int = 60 * 60
+    # время жизни frame_index/ - индекса кадров MP3, секунды; содержимое по ключу не меняется
+    frame_index_ttl: int = 6 * 60 * 60
+    # сколько еще устаревшее значение отдается, пока один процесс его пересчитывает, секунды
+    stale_ttl: int = 60
+    # блокировка пересчета ключа: срок жизни и сколько ее ждут остальные, секунды
+    lock_timeout: float = 10.0
+    lock_wait: float = 1.0
 
 
 class Settings(BaseSettings):
@@ -72,6 +133,8 @@ class Settings(BaseSettings):
     aws: AWSSettings
     smtp: SMTPSettings
     redis: RedisSettings
+    storage: StorageSettings = StorageSettings()
+    media_cache: MediaCacheSettings = MediaCacheSettings()
     db_test: PostgresTestDatabaseSettings
 
 
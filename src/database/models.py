@@ -1,4 +1,5 @@
 from datetime import datetime
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy import TIMESTAMP, Boolean, LargeBinary, ForeignKey, MetaData, UniqueConstraint, func
 from sqlalchemy.orm import (
     Mapped,
@@ -43,6 +44,11 @@ class Song(Base):
     genre: Mapped["Genre"]
     artist_id: Mapped[int] = mapped_column(ForeignKey("user.id"))
     album_id: Mapped[int] = mapped_column(ForeignKey('album.id'))
+    # Длительность, мс, и средний битрейт, кбит/с - из заголовков кадров MP3
+    duration: Mapped[int | None]
+    bitrate: Mapped[int | None]
+    # Смещения кадров для перемотки по времени, см. music.mp3.FrameIndex
+    frame_index: Mapped[bytes | None] = mapped_column(LargeBinary, deferred=True)
     created_at: Mapped[datetime] = mapped_column(TIMESTAMP, server_default=func.now())
     updated_at: Mapped[datetime] = mapped_column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
     
@@ -66,4 +72,17 @@ class Album(Base):
 
     __table_args__ = (
         UniqueConstraint("name", "artist_id"),
-    )
\ No newline at end of file
+    )
+
+
+class MediaObject(Base):
+    # Объект в хранилище и число Song/Album, которые на него ссылаются
+    key: Mapped[str] = mapped_column(unique=True)
+    ref_count: Mapped[int] = mapped_column(default=0, server_default='0')
+    # Объект уже лежит в хранилище; до этого ссылку могли взять, а загрузку - еще не закончить
+    uploaded: Mapped[bool] = mapped_column(Boolean, default=False, server_default='false')
+    created_at: Mapped[datetime] = mapped_column(TIMESTAMP, server_default=func.now())
+    # Момент, когда ссылок не осталось: строка ждет удаления объекта из хранилища
+    released_at: Mapped[datetime | None] = mapped_column(TIMESTAMP, index=True)
+    # Ключи уменьшенных копий изображения по размеру: {"64": "...", "256": "..."}
+    derivatives: Mapped[dict[str, str] | None] = mapped_column(JSONB)
@@ -1,12 +1,31 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from prometheus_client import make_asgi_app
+from storage import storage_helper
+from database import db_helper
+from redis_cache import redis_helper
 from music.routers import router as music_router
 from auth.routers import router as auth_router
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Общие на всё приложение клиенты создаются один раз при старте
+    storage_helper.connect()
+    await redis_helper.connect()
+    redis_helper.start_invalidation_listener()
+    yield
+    await redis_helper.disconnect()
+    storage_helper.close()
+    await db_helper.dispose()
+
+
 app = FastAPI(
-    title="MusicHub API"
+    title="MusicHub API",
+    lifespan=lifespan
 )
 
 app.include_router(music_router)
 app.include_router(auth_router)
 
+app.mount("/metrics", make_asgi_app())
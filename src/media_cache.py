@@ -0,0 +1,183 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Awaitable, Callable
+
+from prometheus_client import Counter, Gauge
+
+from config import settings
+from storage import FileStream
+from storage.local import local_file_stream
+
+
+media_cache_requests = Counter(
+    'media_cache_requests_total',
+    'Media cache lookups',
+    ['result']
+)
+media_cache_bytes_served = Counter(
+    'media_cache_bytes_served_total',
+    'Bytes of media served from the local disk cache'
+)
+media_cache_hit_ratio = Gauge(
+    'media_cache_hit_ratio',
+    'Share of media cache lookups served from disk in this process'
+)
+media_cache_size = Gauge(
+    'media_cache_size_bytes',
+    'Bytes currently held in the local disk cache'
+)
+
+
+@dataclass
+class CacheEntry:
+    size: int
+    etag: str | None = None
+    last_modified: datetime | None = None
+    # когда копия скачана, time.time()
+    fetched_at: float = 0.0
+
+
+class MediaCache:
+    """
+    Локальный дисковый LRU-кэш объектов хранилища.
+
+    Файл наполняется во временный файл и атомарно переименовывается, так что
+    читатели никогда не видят недокачанный объект. Одновременные промахи по
+    одному ключу ждут единственную загрузку (single-flight).
+
+    Копия старше ttl скачивается заново: объект, удаленный из хранилища,
+    перестает отдаваться и с диска узла.
+    """
+    def __init__(self, directory: str, max_size: int, ttl: float):
+        self.directory = Path(directory)
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._size = 0
+        self._fills: dict[str, asyncio.Future] = {}
+        self._loaded = False
+        self._hits = 0
+        self._lookups = 0
+
+    def _path(self, key: str) -> Path:
+        # Имя файла - хэш ключа: без вложенных папок и без выхода за пределы каталога
+        return self.directory / hashlib.sha256(key.encode()).hexdigest()
+
+    def _load(self) -> None:
+        # Файлы, оставшиеся с прошлого запуска, в порядке последнего доступа
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._loaded = True
+        paths = [path for path in self.directory.iterdir() if path.is_file() and not path.name.endswith('.tmp')]
+        for path in sorted(paths, key=lambda path: path.stat().st_atime):
+            stat = path.stat()
+            self._entries[path.name] = CacheEntry(size=stat.st_size, fetched_at=stat.st_mtime)
+            self._size += stat.st_size
+        media_cache_size.set(self._size)
+
+    def _add(self, name: str, entry: CacheEntry) -> None:
+        if old_entry := self._entries.pop(name, None):
+            self._size -= old_entry.size
+        self._entries[name] = entry
+        self._size += entry.size
+        while self._size > self.max_size and len(self._entries) > 1:
+            evicted_name, evicted = self._entries.popitem(last=False)
+            self._size -= evicted.size
+            (self.directory / evicted_name).unlink(missing_ok=True)
+            logging.info("Media cache evicted %s", evicted_name)
+        media_cache_size.set(self._size)
+
+    def _discard(self, name: str) -> None:
+        if entry := self._entries.pop(name, None):
+            self._size -= entry.size
+        (self.directory / name).unlink(missing_ok=True)
+        media_cache_size.set(self._size)
+
+    async def get(
+        self,
+        key: str,
+        fetch: Callable[[Path], Awaitable[tuple[str | None, datetime | None]]],
+    ) -> tuple[Path, CacheEntry]:
+        """
+        Возвращает путь к локальной копии объекта.
+
+        fetch(path) скачивает объект в path и возвращает его ETag и Last-Modified.
+        """
+        if not self._loaded:
+            self._load()
+        path = self._path(key)
+
+        self._lookups += 1
+        entry = self._entries.get(path.name)
+        # Копию старше ttl скачиваем заново поверх старой: объект могли удалить из хранилища
+        if entry and path.exists() and time.time() - entry.fetched_at <= self.ttl:
+            self._entries.move_to_end(path.name)
+            self._hits += 1
+            media_cache_requests.labels(result='hit').inc()
+            media_cache_hit_ratio.set(self._hits / self._lookups)
+            return path, entry
+        media_cache_requests.labels(result='miss').inc()
+        media_cache_hit_ratio.set(self._hits / self._lookups)
+
+        while fill := self._fills.get(path.name):
+            try:
+                return path, await asyncio.shield(fill)
+            except asyncio.CancelledError:
+                if not fill.cancelled():
+                    raise
+                # Отменили запрос, который скачивал объект, - скачиваем сами
+
+        fill = asyncio.get_running_loop().create_future()
+        self._fills[path.name] = fill
+        tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        try:
+            etag, last_modified = await fetch(tmp_path)
+            os.replace(tmp_path, path)
+            entry = CacheEntry(
+                size=path.stat().st_size, 
+                etag=etag, 
+                last_modified=last_modified, 
+                fetched_at=time.time()
+            )
+            self._add(path.name, entry)
+            fill.set_result(entry)
+            return path, entry
+        except asyncio.CancelledError:
+            tmp_path.unlink(missing_ok=True)
+            fill.cancel()
+            raise
+        except Exception as err:
+            tmp_path.unlink(missing_ok=True)
+            if entry:
+                # Устаревшую копию не отдаем, даже если хранилище недоступно
+                self._discard(path.name)
+            fill.set_exception(err)
+            # Ошибку получают ожидающие запросы; если их нет - помечаем ее обработанной
+            fill.exception()
+            raise
+        finally:
+            del self._fills[path.name]
+
+
+def cached_file_stream(
+    path: Path,
+    entry: CacheEntry,
+    byte_range: str | None,
+    if_range: str | None,
+) -> FileStream:
+    stream = local_file_stream(path, entry.size, entry.etag, entry.last_modified, byte_range, if_range)
+    media_cache_bytes_served.inc(stream.content_length)
+    return stream
+
+
+media_cache = MediaCache(
+    directory=settings.media_cache.directory,
+    max_size=settings.media_cache.max_size,
+    ttl=settings.media_cache.ttl,
+)
@@ -0,0 +1,45 @@
+"""Added MediaObject table with reference counts of stored files
+
+Revision ID: 5b1f0c2e9a47
+Revises: 4d658e316b18
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b1f0c2e9a47'
+down_revision: Union[str, None] = '4d658e316b18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('mediaobject',
+    sa.Column('key', sa.String(), nullable=False),
+    sa.Column('ref_count', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('created_at', sa.TIMESTAMP(), server_default=sa.text('now()'), nullable=False),
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id', name=op.f('pk_mediaobject')),
+    sa.UniqueConstraint('key', name=op.f('uq_mediaobject_key'))
+    )
+    # Уже загруженные файлы получают счетчик по числу ссылок из song и album
+    op.execute(
+        """
+        INSERT INTO mediaobject (key, ref_count)
+        SELECT key, count(*) FROM (
+            SELECT file_url AS key FROM song
+            UNION ALL SELECT photo_url FROM song
+            UNION ALL SELECT photo_url FROM album
+        ) AS refs
+        GROUP BY key
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('mediaobject')
@@ -0,0 +1,28 @@
+"""Added released_at field to the MediaObject table
+
+Revision ID: 9c3e7a1d4b25
+Revises: 5b1f0c2e9a47
+Create Date: 2026-10-17 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9c3e7a1d4b25'
+down_revision: Union[str, None] = '5b1f0c2e9a47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('mediaobject', sa.Column('released_at', sa.TIMESTAMP(), nullable=True))
+    op.create_index(op.f('ix_mediaobject_released_at'), 'mediaobject', ['released_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_mediaobject_released_at'), table_name='mediaobject')
+    op.drop_column('mediaobject', 'released_at')
@@ -0,0 +1,27 @@
+"""Added derivatives field to the MediaObject table
+
+Revision ID: e27a4f9b6c13
+Revises: 9c3e7a1d4b25
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e27a4f9b6c13'
+down_revision: Union[str, None] = '9c3e7a1d4b25'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('mediaobject', sa.Column('derivatives', postgresql.JSONB(astext_type=sa.Text()), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('mediaobject', 'derivatives')
@@ -0,0 +1,30 @@
+"""Added duration, bitrate and frame_index fields to the Song table
+
+Revision ID: 3f8d2b6a0e91
+Revises: e27a4f9b6c13
+Create Date: 2026-10-17 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f8d2b6a0e91'
+down_revision: Union[str, None] = 'e27a4f9b6c13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('song', sa.Column('duration', sa.Integer(), nullable=True))
+    op.add_column('song', sa.Column('bitrate', sa.Integer(), nullable=True))
+    op.add_column('song', sa.Column('frame_index', sa.LargeBinary(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('song', 'frame_index')
+    op.drop_column('song', 'bitrate')
+    op.drop_column('song', 'duration')
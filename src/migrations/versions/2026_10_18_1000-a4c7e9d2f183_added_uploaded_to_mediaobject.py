@@ -0,0 +1,28 @@
+"""Added uploaded field to the MediaObject table
+
+Revision ID: a4c7e9d2f183
+Revises: 3f8d2b6a0e91
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a4c7e9d2f183'
+down_revision: Union[str, None] = '3f8d2b6a0e91'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Существующие строки заводились после загрузки объекта
+    op.add_column('mediaobject', sa.Column('uploaded', sa.Boolean(), server_default='true', nullable=False))
+    op.alter_column('mediaobject', 'uploaded', server_default='false')
+
+
+def downgrade() -> None:
+    op.drop_column('mediaobject', 'uploaded')
@@ -0,0 +1,57 @@
+import io
+import re
+import zipfile
+from datetime import datetime
+from typing import AsyncIterator
+
+
+# символы, которые нельзя оставлять в имени файла внутри архива
+UNSAFE_NAME_PATTERN = re.compile(r'[\\/:*?"<>|\x00-\x1f]')
+
+
+def archive_member_name(index: int, name: str, extension: str) -> str:
+    # Номер трека впереди: порядок сохраняется, одинаковые названия не совпадают
+    return f"{index:02d} - {UNSAFE_NAME_PATTERN.sub('_', name).strip()}.{extension}"
+
+
+class _ZipBuffer(io.RawIOBase):
+    """Поток без seek для zipfile: записанное забирается кусками через drain."""
+    def __init__(self):
+        self._chunks: list[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+async def stream_zip(
+    members: list[tuple[str, datetime, AsyncIterator[bytes]]],
+) -> AsyncIterator[bytes]:
+    """
+    ZIP без сжатия (MP3 не сжимается), собираемый на лету.
+
+    Поток не поддерживает seek, поэтому zipfile пишет CRC и размеры в дескриптор
+    после данных каждого файла. В памяти - только текущий кусок тела. Тела
+    members (имя, время изменения, содержимое) читаются по очереди.
+    """
+    buffer = _ZipBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for name, modified_at, body in members:
+            info = zipfile.ZipInfo(name, date_time=modified_at.timetuple()[:6])
+            with archive.open(info, 'w') as member:
+                async for chunk in body:
+                    member.write(chunk)
+                    if data := buffer.drain():
+                        yield data
+            if data := buffer.drain():
+                yield data
+    # Центральный каталог
+    yield buffer.drain()
@@ -0,0 +1,33 @@
+from database.models import Album, Song
+
+
+# Сущности, от которых зависят закэшированные song/{id} и album/{id} (см. RedisCache.invalidate)
+
+def song_ref(song_id: int) -> str:
+    return f"song/{song_id}"
+
+
+def album_ref(album_id: int) -> str:
+    return f"album/{album_id}"
+
+
+def album_songs_ref(album_id: int) -> str:
+    # Состав альбома: меняется при добавлении и удалении песен, а не при изменении самого альбома
+    return f"album/{album_id}/songs"
+
+
+def user_ref(user_id: int) -> str:
+    return f"user/{user_id}"
+
+
+def song_dependencies(song: Song) -> list[str]:
+    # SongOut содержит альбом и исполнителя
+    return [song_ref(song.id), album_ref(song.album_id), user_ref(song.artist_id)]
+
+
+def album_dependencies(album: Album) -> list[str]:
+    # AlbumOut содержит исполнителя и песни альбома
+    dependencies = [album_ref(album.id), album_songs_ref(album.id), user_ref(album.artist_id)]
+    for song in album.songs:
+        dependencies.extend((song_ref(song.id), user_ref(song.artist_id)))
+    return dependencies
@@ -32,3 +32,36 @@ MAX_FILE_SIZES = {
     'pdf': DEFAULT_MAX_SIZE,
 }
 
+
+# размер части multipart-загрузки в S3 (минимум, который допускает S3 для всех частей, кроме последней)
+MULTIPART_CHUNK_SIZE = 5 * MB
+
+# размер куска, которым тело файла отдается клиенту при скачивании
+DOWNLOAD_CHUNK_SIZE = 64 * KB
+
+# presigned-ссылка на скачивание кэшируется в Redis на столько секунд меньше, чем она живет
+PRESIGNED_URL_CACHE_MARGIN = 60
+
+# число первых символов sha256 в префиксе ключа: songs/music/ab/ab12....mp3
+KEY_FANOUT_LENGTH = 2
+
+# максимум ключей в одном запросе delete_objects
+DELETE_BATCH_SIZE = 1000
+
+# качество JPEG для уменьшенных копий обложек
+IMAGE_DERIVATIVE_QUALITY = 80
+
+# шаг индекса кадров MP3 для перемотки по времени, мс
+FRAME_INDEX_INTERVAL = 500
+
+# длительность сегмента потокового воспроизведения (HLS), секунды; кратна FRAME_INDEX_INTERVAL
+SEGMENT_DURATION = 6
+
+# число точек (пар min/max int8) в волне песни для плеера
+WAVEFORM_POINTS = 1024
+
+# сколько первых байт файла читается для определения типа по содержимому (libmagic)
+MAGIC_HEADER_SIZE = 2 * KB
+
+# наибольшее число id в одном запросе GET /music/batch и GET /album/batch
+BATCH_MAX_IDS = 200
@@ -1,4 +1,4 @@
-from enum import Enum
+from enum import Enum, IntEnum
 
 
 class Genre(Enum):
@@ -10,4 +10,17 @@ class Genre(Enum):
     ELECTRONIC = "electronic"
     REGGAE = "reggae"
     BLUES = "blues"
-    
\ No newline at end of file
+
+
+class DownloadMode(Enum):
+    # файл проксируется через API
+    PROXY = "proxy"
+    # 302 на короткоживущую presigned-ссылку хранилища
+    REDIRECT = "redirect"
+
+
+class ImageSize(IntEnum):
+    # сторона квадрата, в который вписывается уменьшенная копия обложки, px
+    SMALL = 64
+    MEDIUM = 256
+    LARGE = 1024
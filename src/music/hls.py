@@ -0,0 +1,55 @@
+import io
+import math
+
+from music.constants import FRAME_INDEX_INTERVAL, SEGMENT_DURATION
+from music.mp3 import build_frame_index
+
+
+# префикс сегментов в MediaObject.derivatives: {"hls/0": "...", "hls/1": "..."}
+SEGMENT_PREFIX = 'hls/'
+ID3V1_SIZE = 128
+
+
+def segment_key(key: str, index: int) -> str:
+    # songs/music/ab/ab12....mp3 -> songs/music/ab/ab12.../hls/00000.mp3
+    stem, extension = key.rsplit('.', 1)
+    return f"{stem}/hls/{index:05d}.{extension}"
+
+
+def split_segments(data: bytes) -> list[bytes]:
+    """
+    Режет MP3 на сегменты по SEGMENT_DURATION секунд.
+
+    Границы берутся из индекса кадров, поэтому каждый сегмент начинается с
+    заголовка кадра и играет сам по себе. Теги ID3 в сегменты не попадают.
+    """
+    frame_index = build_frame_index(io.BytesIO(data))
+    if frame_index is None:
+        return []
+    end = len(data) - ID3V1_SIZE if data[-ID3V1_SIZE:-ID3V1_SIZE + 3] == b'TAG' else len(data)
+    step = SEGMENT_DURATION * 1000 // FRAME_INDEX_INTERVAL
+    boundaries = list(frame_index.offsets[::step]) + [end]
+    return [data[first:last] for first, last in zip(boundaries, boundaries[1:])]
+
+
+def segment_durations(duration: int, count: int) -> list[float]:
+    # Все сегменты, кроме последнего, длятся SEGMENT_DURATION (с точностью до кадра)
+    last = duration / 1000 - SEGMENT_DURATION * (count - 1)
+    return [float(SEGMENT_DURATION)] * (count - 1) + [max(last, 0.0)]
+
+
+def build_playlist(segment_urls: list[str], duration: int) -> str:
+    """Плейлист HLS (VOD) для сегментов песни длительностью duration мс."""
+    durations = segment_durations(duration, len(segment_urls))
+    lines = [
+        '#EXTM3U',
+        '#EXT-X-VERSION:3',
+        f'#EXT-X-TARGETDURATION:{math.ceil(max(durations))}',
+        '#EXT-X-MEDIA-SEQUENCE:0',
+        '#EXT-X-PLAYLIST-TYPE:VOD',
+    ]
+    for url, segment_duration in zip(segment_urls, durations):
+        lines.append(f'#EXTINF:{segment_duration:.3f},')
+        lines.append(url)
+    lines.append('#EXT-X-ENDLIST')
+    return '\n'.join(lines) + '\n'
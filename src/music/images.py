@@ -0,0 +1,46 @@
+import io
+
+from PIL import Image, ImageOps
+
+from music.constants import IMAGE_DERIVATIVE_QUALITY
+from music.enums import ImageSize
+
+
+# форматы обложек, для которых строятся уменьшенные копии (pdf отдается как есть)
+DERIVATIVE_FORMATS = {
+    'jpg': 'JPEG',
+    'jpeg': 'JPEG',
+    'png': 'PNG',
+}
+
+
+def derivative_key(key: str, size: ImageSize) -> str:
+    # albums/images/ab/ab12....jpg -> albums/images/ab/ab12..._256.jpg
+    stem, extension = key.rsplit('.', 1)
+    return f"{stem}_{size.value}.{extension}"
+
+
+def render_image_derivatives(data: bytes, extension: str) -> dict[ImageSize, bytes]:
+    """
+    Уменьшает изображение под каждый ImageSize и пережимает его.
+
+    Метаданные (EXIF, ICC, комментарии) не сохраняются, поворот из EXIF
+    применяется к пикселям. Изображение меньше размера не увеличивается.
+    """
+    image_format = DERIVATIVE_FORMATS[extension]
+    with Image.open(io.BytesIO(data)) as original:
+        image = ImageOps.exif_transpose(original)
+        if image_format == 'JPEG' and image.mode != 'RGB':
+            image = image.convert('RGB')
+
+        derivatives = {}
+        for size in ImageSize:
+            resized = image.copy()
+            resized.thumbnail((size.value, size.value), Image.Resampling.LANCZOS)
+            output = io.BytesIO()
+            if image_format == 'JPEG':
+                resized.save(output, 'JPEG', quality=IMAGE_DERIVATIVE_QUALITY, optimize=True, progressive=True)
+            else:
+                resized.save(output, 'PNG', optimize=True)
+            derivatives[size] = output.getvalue()
+    return derivatives
@@ -0,0 +1,157 @@
+import hashlib
+import time
+from typing import Any, Awaitable, Callable, Iterable
+
+import orjson
+
+from cache_codec import CachedResponse, ResponseCodec
+from database.models import Album, Song
+from music.constants import ALBUMS, SONGS
+from music.enums import Genre
+from redis_cache import RedisCache
+
+
+def generation_key(*parts: Any) -> str:
+    # gen/songs, gen/artist/3, gen/genre/rock ...
+    return '/'.join(('gen', *(str(part) for part in parts)))
+
+
+def _genre(genre: Genre | str) -> str:
+    return Genre(genre).value
+
+
+def filters_hash(filters: dict[str, Any]) -> str:
+    # Порядок ключей и представление Genre не влияют на ключ кэша
+    normalized = {name: value.value if isinstance(value, Genre) else value for name, value in filters.items()}
+    return hashlib.sha256(orjson.dumps(normalized, option=orjson.OPT_SORT_KEYS)).hexdigest()[:32]
+
+
+def song_list_generations(filters: dict[str, Any]) -> list[str]:
+    """
+    Поколения, от которых зависит выборка песен.
+
+    Достаточно одного: любое изменение песни, которая может попасть в выборку
+    с album_id, artist_id или genre, увеличивает поколение этого альбома,
+    исполнителя или жанра. Остальные выборки зависят от общего поколения.
+    """
+    if 'album_id' in filters:
+        return [generation_key(ALBUMS, filters['album_id'])]
+    if 'artist_id' in filters:
+        return [generation_key('artist', filters['artist_id'])]
+    if 'genre' in filters:
+        return [generation_key('genre', _genre(filters['genre']))]
+    return [generation_key(SONGS)]
+
+
+def album_list_generations(filters: dict[str, Any]) -> list[str]:
+    if 'id' in filters:
+        return [generation_key(ALBUMS, filters['id'])]
+    if 'artist_id' in filters:
+        return [generation_key('artist', filters['artist_id'])]
+    return [generation_key(ALBUMS)]
+
+
+def song_generations(song: Song) -> set[str]:
+    """Поколения выборок, в ответе которых есть песня: списки песен и альбомы с ней."""
+    return {
+        generation_key(SONGS),
+        generation_key(ALBUMS),
+        generation_key(ALBUMS, song.album_id),
+        generation_key('artist', song.artist_id),
+        generation_key('artist', song.album.artist_id),
+        generation_key('genre', _genre(song.genre)),
+    }
+
+
+def album_generations(album: Album, songs: Iterable[Song] = ()) -> set[str]:
+    """Поколения выборок с альбомом; песни альбома содержат его в ответе списка песен."""
+    generations = {
+        generation_key(ALBUMS),
+        generation_key(ALBUMS, album.id),
+        generation_key('artist', album.artist_id),
+    }
+    for song in songs:
+        generations |= {
+            generation_key(SONGS),
+            generation_key('artist', song.artist_id),
+            generation_key('genre', _genre(song.genre)),
+        }
+    return generations
+
+
+def list_etag(key: str, generations: list[int]) -> str:
+    # Меняется вместе с поколениями, поэтому годится и для If-None-Match
+    return f'W/"{key.rsplit("/", 1)[-1][:16]}-{".".join(map(str, generations))}"'
+
+
+async def cached_list(
+    redis_helper: RedisCache,
+    namespace: str,
+    filters: dict[str, Any],
+    generation_keys: list[str],
+    load: Callable[[], Awaitable[bytes]],
+) -> CachedResponse:
+    """
+    JSON выборки из кэша или из load().
+
+    Запись помечается поколениями, прочитанными до запроса к БД: если
+    изменение случится во время загрузки, поколение вырастет и запись
+    при следующем чтении не совпадет. Ключи при изменениях не перебираются.
+    Устаревшую выборку пересчитывает один процесс, остальные пока получают старую.
+    """
+    key = f"list/{namespace}/{filters_hash(filters)}"
+    cached, generations = await redis_helper.get_with_generations(key, generation_keys)
+    etag = list_etag(key, generations)
+    if cached is not None and cached.etag == etag:
+        return cached
+
+    async def compute() -> CachedResponse:
+        computed = CachedResponse(body=await load(), etag=etag)
+        await redis_helper.set(key=key, value=computed, codec=ResponseCodec())
+        return computed
+
+    return await redis_helper.single_flight(
+        key, 
+        compute, 
+        accept=lambda value: value.etag == etag, 
+        stale=cached
+    )
+
+
+async def cached_batch(
+    redis_helper: RedisCache,
+    namespace: str,
+    ids: list[int],
+    load: Callable[[list[int]], Awaitable[dict[int, tuple[CachedResponse, list[str]]]]],
+) -> list[CachedResponse]:
+    """
+    JSON сущностей {namespace}/{id} в порядке ids: найденные в кэше - одним MGET,
+    остальные - одним load(missing), который возвращает {id: (JSON, зависимости)}.
+
+    Загруженные записываются в кэш одним пайплайном. Несуществующие id пропускаются.
+    """
+    unique_ids = list(dict.fromkeys(ids))
+    keys = [f"{namespace}/{id}" for id in unique_ids]
+    found, missing, expected = {}, [], {}
+    now = time.time()
+    entries, version = await redis_helper.get_many(keys)
+    for id, (data, value, fresh_until) in zip(unique_ids, entries):
+        if value is not None and (fresh_until is None or now < fresh_until):
+            found[id] = value
+        else:
+            missing.append(id)
+            expected[id] = data if value is not None else None
+    if missing:
+        if version is None:
+            version = await redis_helper.version()
+        loaded = await load(missing)
+        found.update({id: cached for id, (cached, _) in loaded.items()})
+        await redis_helper.fill_many(
+            [
+                (f"{namespace}/{id}", cached, dependencies, expected[id])
+                for id, (cached, dependencies) in loaded.items()
+            ],
+            version,
+            codec=ResponseCodec()
+        )
+    return [found[id] for id in ids if id in found]
@@ -0,0 +1,160 @@
+import math
+import sys
+from array import array
+from dataclasses import dataclass
+from typing import BinaryIO
+
+from music.constants import FRAME_INDEX_INTERVAL
+
+
+# Только Layer III; индексы по версии MPEG: 3 - MPEG1, 2 - MPEG2, 0 - MPEG2.5
+BITRATES = {
+    3: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    0: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+SAMPLE_RATES = {
+    3: (44100, 48000, 32000),
+    2: (22050, 24000, 16000),
+    0: (11025, 12000, 8000),
+}
+ID3V2_HEADER_SIZE = 10
+# сколько байт просматривается при потере синхронизации
+RESYNC_WINDOW = 64 * 1024
+
+
+@dataclass
+class Frame:
+    length: int
+    samples: int
+    sample_rate: int
+
+
+def _parse_header(header: bytes) -> Frame | None:
+    if len(header) < 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return None
+    version = (header[1] >> 3) & 0b11
+    layer = (header[1] >> 1) & 0b11
+    bitrate_index = header[2] >> 4
+    sample_rate_index = (header[2] >> 2) & 0b11
+    if version == 1 or layer != 1 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+    bitrate = BITRATES[version][bitrate_index] * 1000
+    sample_rate = SAMPLE_RATES[version][sample_rate_index]
+    samples = 1152 if version == 3 else 576
+    padding = (header[2] >> 1) & 1
+    return Frame(
+        length=samples // 8 * bitrate // sample_rate + padding,
+        samples=samples,
+        sample_rate=sample_rate,
+    )
+
+
+def _frame_at(file: BinaryIO, position: int) -> Frame | None:
+    file.seek(position)
+    return _parse_header(file.read(4))
+
+
+def _skip_id3v2(file: BinaryIO) -> int:
+    file.seek(0)
+    header = file.read(ID3V2_HEADER_SIZE)
+    if len(header) < ID3V2_HEADER_SIZE or header[:3] != b'ID3':
+        return 0
+    # syncsafe integer: по 7 бит в байте
+    size = (header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9]
+    footer = ID3V2_HEADER_SIZE if header[5] & 0x10 else 0
+    return ID3V2_HEADER_SIZE + size + footer
+
+
+def _resync(file: BinaryIO, position: int, file_size: int) -> int | None:
+    # Следующий кандидат засчитывается, только если за ним тоже идет корректный кадр
+    window_start = position + 1
+    while window_start < file_size:
+        file.seek(window_start)
+        window = file.read(RESYNC_WINDOW)
+        offset = window.find(b'\xff')
+        while offset != -1:
+            candidate = window_start + offset
+            if frame := _frame_at(file, candidate):
+                next_position = candidate + frame.length
+                if next_position >= file_size or _frame_at(file, next_position):
+                    return candidate
+            offset = window.find(b'\xff', offset + 1)
+        window_start += len(window)
+    return None
+
+
+@dataclass
+class FrameIndex:
+    """
+    Смещения кадров MP3 с шагом FRAME_INDEX_INTERVAL мс.
+
+    offsets[i] - байт, с которого начинается кадр, звучащий в момент
+    i * FRAME_INDEX_INTERVAL. Хранится в Song.frame_index как uint32 little-endian.
+    """
+    duration: int
+    bitrate: int
+    offsets: array
+
+    def to_bytes(self) -> bytes:
+        offsets = array('I', self.offsets)
+        if sys.byteorder == 'big':
+            offsets.byteswap()
+        return offsets.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes, duration: int, bitrate: int) -> "FrameIndex":
+        offsets = array('I')
+        offsets.frombytes(data)
+        if sys.byteorder == 'big':
+            offsets.byteswap()
+        return cls(duration=duration, bitrate=bitrate, offsets=offsets)
+
+    def byte_range(self, start: float, duration: float | None = None) -> str | None:
+        """Заголовок Range для отрезка [start, start + duration) в секундах; None - отрезок за концом файла."""
+        start_ms = start * 1000
+        if start_ms >= self.duration or not self.offsets:
+            return None
+        first = self.offsets[min(int(start_ms // FRAME_INDEX_INTERVAL), len(self.offsets) - 1)]
+        if duration is None:
+            return f'bytes={first}-'
+        end = math.ceil((start_ms + duration * 1000) / FRAME_INDEX_INTERVAL)
+        if end >= len(self.offsets):
+            return f'bytes={first}-'
+        return f'bytes={first}-{self.offsets[end] - 1}'
+
+
+def build_frame_index(file: BinaryIO) -> FrameIndex | None:
+    """
+    Проходит по заголовкам кадров MP3, не декодируя звук.
+
+    Читается по 4 байта на кадр, так что проход по локальному спулу
+    UploadFile занимает миллисекунды. None - в файле нет кадров Layer III.
+    """
+    file_size = file.seek(0, 2)
+    position = _skip_id3v2(file)
+    offsets = array('I')
+    elapsed = 0.0
+    audio_bytes = 0
+
+    while position + 4 <= file_size:
+        frame = _frame_at(file, position)
+        if frame is None:
+            position = _resync(file, position, file_size)
+            if position is None:
+                break
+            continue
+        while elapsed * 1000 >= len(offsets) * FRAME_INDEX_INTERVAL:
+            offsets.append(position)
+        elapsed += frame.samples / frame.sample_rate
+        audio_bytes += frame.length
+        position += frame.length
+
+    file.seek(0)
+    if not offsets:
+        return None
+    return FrameIndex(
+        duration=round(elapsed * 1000),
+        bitrate=round(audio_bytes * 8 / elapsed / 1000),
+        offsets=offsets,
+    )
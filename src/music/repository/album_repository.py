@@ -68,6 +68,23 @@ class AlbumRepository(AbstractRepository):
             detail="Album not found"
         )
     
+    @staticmethod
+    async def get_albums_by_ids(
+        session: AsyncSession,
+        album_ids: list[int]
+    ) -> list[Album]:
+        # Один запрос с IN на все альбомы; отсутствующих id в результате просто нет
+        stmt = (
+            select(Album)
+            .options(
+                joinedload(Album.artist),
+                selectinload(Album.songs)
+            )
+            .where(Album.id.in_(album_ids))
+        )
+        albums = await session.scalars(stmt)
+        return albums.all()
+
     @staticmethod
     async def get_albums(
         session: AsyncSession,
@@ -0,0 +1,205 @@
+from abc import ABC, abstractmethod
+from datetime import timedelta
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import HTTPException, status
+from sqlalchemy import delete, func, literal, select, update
+from sqlalchemy.dialects.postgresql import JSONB, insert
+from database.models import MediaObject
+
+
+class AbstractRepository(ABC):
+    @staticmethod
+    @abstractmethod
+    async def acquire_keys():
+        raise NotImplementedError
+
+    @staticmethod
+    @abstractmethod
+    async def mark_uploaded():
+        raise NotImplementedError
+
+    @staticmethod
+    @abstractmethod
+    async def release_keys():
+        raise NotImplementedError
+
+    @staticmethod
+    @abstractmethod
+    async def claim_released_objects():
+        raise NotImplementedError
+
+    @staticmethod
+    @abstractmethod
+    async def forget_keys():
+        raise NotImplementedError
+
+    @staticmethod
+    @abstractmethod
+    async def get_derivatives():
+        raise NotImplementedError
+
+    @staticmethod
+    @abstractmethod
+    async def add_derivatives():
+        raise NotImplementedError
+
+
+class MediaRepository(AbstractRepository):
+    @staticmethod
+    async def acquire_keys(
+        session: AsyncSession,
+        keys: list[str],
+        uploaded: bool = False,
+    ) -> dict[str, tuple[int, bool]]:
+        """
+        Увеличивает счетчики ссылок и возвращает (новое значение, объект уже загружен).
+
+        uploaded=True - объекты уже в хранилище (presigned-загрузка проверена).
+        """
+        set_ = {'ref_count': MediaObject.ref_count + 1, 'released_at': None}
+        if uploaded:
+            set_['uploaded'] = True
+        states = {}
+        try:
+            for key in keys:
+                stmt = (
+                    insert(MediaObject)
+                    .values(key=key, ref_count=1, uploaded=uploaded)
+                    .on_conflict_do_update(index_elements=[MediaObject.key], set_=set_)
+                    .returning(MediaObject.ref_count, MediaObject.uploaded)
+                )
+                ref_count, is_uploaded = (await session.execute(stmt)).one()
+                states[key] = (ref_count, is_uploaded)
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Can not register media files"
+            )
+        return states
+
+    @staticmethod
+    async def mark_uploaded(
+        session: AsyncSession,
+        keys: list[str]
+    ) -> None:
+        # Следующие загрузки того же содержимого больше не проверяют хранилище
+        await session.execute(
+            update(MediaObject)
+            .where(MediaObject.key.in_(keys))
+            .values(uploaded=True)
+        )
+        await session.commit()
+
+    @staticmethod
+    async def release_keys(
+        session: AsyncSession,
+        keys: list[str]
+    ) -> dict[str, int]:
+        """
+        Уменьшает счетчики ссылок и возвращает оставшееся число ссылок.
+
+        Строки с нулем ссылок не удаляются, а помечаются released_at - это
+        очередь на удаление объектов из хранилища, ее разбирает Celery.
+        """
+        remaining = {}
+        try:
+            for key in keys:
+                stmt = (
+                    update(MediaObject)
+                    .where(MediaObject.key == key)
+                    .values(ref_count=MediaObject.ref_count - 1)
+                    .returning(MediaObject.ref_count)
+                )
+                ref_count = await session.scalar(stmt)
+                if ref_count is None:
+                    # Ключ без записи остался с тех пор, когда ссылки не считались - на него никто не ссылается
+                    await session.execute(
+                        insert(MediaObject)
+                        .values(key=key, ref_count=0, released_at=func.now())
+                        .on_conflict_do_nothing(index_elements=[MediaObject.key])
+                    )
+                elif ref_count <= 0:
+                    await session.execute(
+                        update(MediaObject)
+                        .where(MediaObject.key == key)
+                        .values(ref_count=0, released_at=func.now())
+                    )
+                remaining[key] = max(ref_count or 0, 0)
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Can not release media files"
+            )
+        return remaining
+
+    @staticmethod
+    async def claim_released_objects(
+        session: AsyncSession,
+        limit: int,
+        retire_delay: int = 0
+    ) -> list[MediaObject]:
+        """
+        Блокирует до limit объектов, оставшихся без ссылок дольше retire_delay секунд.
+
+        Блокировка держится до конца транзакции: параллельная загрузка того же
+        файла ждет ее и после удаления строки загружает объект заново.
+        """
+        stmt = (
+            select(MediaObject)
+            .where(
+                MediaObject.ref_count <= 0,
+                MediaObject.released_at <= func.now() - timedelta(seconds=retire_delay)
+            )
+            .order_by(MediaObject.released_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        return list(await session.scalars(stmt))
+
+    @staticmethod
+    async def forget_keys(
+        session: AsyncSession,
+        keys: list[str]
+    ) -> None:
+        # Объекты уже удалены из хранилища - убираем их из очереди
+        await session.execute(
+            delete(MediaObject)
+            .where(MediaObject.key.in_(keys), MediaObject.ref_count <= 0)
+        )
+        await session.commit()
+
+    @staticmethod
+    async def get_derivatives(
+        session: AsyncSession,
+        key: str
+    ) -> dict[str, str] | None:
+        stmt = select(MediaObject.derivatives).where(MediaObject.key == key)
+        return await session.scalar(stmt)
+
+    @staticmethod
+    async def add_derivatives(
+        session: AsyncSession,
+        key: str,
+        derivatives: dict[str, str]
+    ) -> bool:
+        """Добавляет ключи производных файлов; False - объект уже удален и они не нужны."""
+        stmt = (
+            update(MediaObject)
+            .where(MediaObject.key == key, MediaObject.ref_count > 0)
+            .values(
+                derivatives=func.coalesce(MediaObject.derivatives, literal({}, JSONB))
+                .op('||')(literal(derivatives, JSONB))
+            )
+            .returning(MediaObject.id)
+        )
+        updated = await session.scalar(stmt)
+        await session.commit()
+        return updated is not None
+
+
+def get_media_repository() -> MediaRepository:
+    return MediaRepository
@@ -4,6 +4,7 @@ from fastapi import HTTPException, status
 from sqlalchemy import select
 from sqlalchemy.orm import joinedload
 from database.models import Song
+from music.mp3 import FrameIndex
 from music.schemas import SongIn, SongUpdate
 
 
@@ -62,6 +63,39 @@ class SongRepository(AbstractRepository):
             detail="Song not found"
         )
 
+    @staticmethod
+    async def get_songs_by_ids(
+        session: AsyncSession,
+        song_ids: list[int]
+    ) -> list[Song]:
+        # Один запрос с IN на все песни; отсутствующих id в результате просто нет
+        stmt = (
+            select(Song)
+            .options(
+                joinedload(Song.artist),
+                joinedload(Song.album)
+            )
+            .where(Song.id.in_(song_ids))
+        )
+        songs = await session.scalars(stmt)
+        return songs.all()
+
+    @staticmethod
+    async def get_frame_index(
+        session: AsyncSession,
+        file_url: str
+    ) -> FrameIndex | None:
+        # Одинаковое содержимое - один ключ, поэтому подходит индекс любой песни с этим файлом
+        stmt = (
+            select(Song.frame_index, Song.duration, Song.bitrate)
+            .where(Song.file_url == file_url, Song.frame_index.is_not(None))
+            .limit(1)
+        )
+        row = (await session.execute(stmt)).one_or_none()
+        if row is None:
+            return None
+        return FrameIndex.from_bytes(row.frame_index, duration=row.duration, bitrate=row.bitrate)
+
     @staticmethod
     async def get_songs(
         session: AsyncSession,
@@ -114,7 +148,7 @@ class SongRepository(AbstractRepository):
             song_id=song_id
         )
         try:
-            for name, value in song_update.model_dump(exclude_none=True).items():
+            for name, value in song_update.model_dump(exclude_unset=True).items():
                 setattr(song, name, value)
             await session.commit()
             return await SongRepository._get_song_with_options(session=session, song_id=song_id)
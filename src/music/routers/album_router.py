@@ -1,14 +1,23 @@
 import logging
 from typing import Annotated, Any
-from fastapi import APIRouter, Depends, File, Form, HTTPException, Response, UploadFile, status
+from urllib.parse import quote
+from fastapi import APIRouter, Depends, File, Form, Header, HTTPException, Query, Response, UploadFile, status
+from fastapi.responses import RedirectResponse, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from auth.schemas import UserOut
 from auth.validation import get_current_active_auth_user
 from music.constants import ALBUMS
-from music.schemas import Files, AlbumOut
+from music.enums import DownloadMode, ImageSize
+from music.schemas import AlbumUploadComplete, AlbumUploadIn, AlbumUploadUrls, Files, AlbumOut
 from database import db_helper
+from music.streaming import (
+    IMMUTABLE_CACHE_CONTROL,
+    SHORT_CACHE_CONTROL,
+    cached_entity_response,
+    media_stream_response,
+)
 from music.service.album_service import AlbumService, get_album_service
-from music.utils import get_album_filters
+from music.utils import get_batch_ids, get_album_filters
 from redis_cache import RedisCache, get_redis_helper
 
 
@@ -28,12 +37,36 @@ router = APIRouter(
 async def get_list_albums(
     album_service: Annotated[AlbumService, Depends(get_album_service)],
     session: Annotated[AsyncSession, Depends(db_helper.session_getter)],
+    redis_helper: Annotated[RedisCache, Depends(get_redis_helper)],
     filters: Annotated[dict[str, Any], Depends(get_album_filters)],
+    if_none_match: Annotated[str | None, Header(alias="If-None-Match")] = None,
 ) -> list[AlbumOut]:
-    return await album_service.list_albums(
+    cached = await album_service.list_albums(
         session=session,
+        redis_helper=redis_helper,
         **filters
     )
+    return cached_entity_response(cached, if_none_match)
+
+
+@router.get(
+    "/batch", 
+    response_model=list[AlbumOut], 
+    description="Albums by ids in request order; unknown ids are skipped"
+)
+async def get_albums_batch(
+    album_service: Annotated[AlbumService, Depends(get_album_service)],
+    session: Annotated[AsyncSession, Depends(db_helper.session_getter)],
+    redis_helper: Annotated[RedisCache, Depends(get_redis_helper)],
+    ids: Annotated[list[int], Depends(get_batch_ids)],
+    if_none_match: Annotated[str | None, Header(alias="If-None-Match")] = None,
+) -> list[AlbumOut]:
+    cached = await album_service.get_cached_albums(
+        session=session,
+        redis_helper=redis_helper,
+        album_ids=ids
+    )
+    return cached_entity_response(cached, if_none_match)
 
 
 @router.get("/{album_id}/", response_model=AlbumOut)
@@ -42,17 +75,33 @@ async def get_album(
     session: Annotated[AsyncSession, Depends(db_helper.session_getter)],
     redis_helper: Annotated[RedisCache, Depends(get_redis_helper)],
     album_id: int,
+    if_none_match: Annotated[str | None, Header(alias="If-None-Match")] = None,
 ) -> AlbumOut:
-    if not (
-        album := await redis_helper.get(
-            key=f"album/{album_id}", 
-        )
-    ):
-        album = await album_service.get_album_by_id(
-            session=session,
-            album_id=album_id,
-        )
-    return album
+    cached = await album_service.get_cached_album(
+        session=session,
+        redis_helper=redis_helper,
+        album_id=album_id
+    )
+    # Готовое тело из кэша отдается как есть, без валидации и повторной сериализации
+    return cached_entity_response(cached, if_none_match)
+
+
+@router.get("/{album_id}/archive", description="ZIP of all album songs, built on the fly")
+async def download_album_archive(
+    album_id: int,
+    album_service: Annotated[AlbumService, Depends(get_album_service)],
+    session: Annotated[AsyncSession, Depends(db_helper.session_getter)],
+) -> StreamingResponse:
+    album_name, archive = await album_service.stream_album_archive(
+        session=session,
+        album_id=album_id
+    )
+    # Размер архива заранее неизвестен - ответ идет кусками (chunked)
+    return StreamingResponse(
+        content=archive,
+        media_type='application/zip',
+        headers={'Content-Disposition': f"attachment; filename*=UTF-8''{quote(f'{album_name}.zip', safe='')}"}
+    )
 
 
 @router.post(
@@ -81,6 +130,42 @@ async def create_album(
         print(f"Error occurred: {e}")
         raise HTTPException(status_code=400, detail=str(e))
 
+
+@router.post("/uploads/", response_model=AlbumUploadUrls, description="Get presigned URL to upload cover directly to storage")
+async def create_album_upload_urls(
+    album_upload_in: AlbumUploadIn,
+    user: Annotated[UserOut, Depends(get_current_active_auth_user)],
+    album_service: Annotated[AlbumService, Depends(get_album_service)],
+    redis_helper: Annotated[RedisCache, Depends(get_redis_helper)],
+) -> AlbumUploadUrls:
+    return await album_service.create_upload_urls(
+        user=user,
+        redis_helper=redis_helper,
+        album_upload_in=album_upload_in
+    )
+
+
+@router.post(
+    "/uploads/complete/",
+    response_model=Files,
+    status_code=status.HTTP_201_CREATED,
+    response_model_exclude_none=True
+)
+async def complete_album_upload(
+    upload_complete: AlbumUploadComplete,
+    user: Annotated[UserOut, Depends(get_current_active_auth_user)],
+    album_service: Annotated[AlbumService, Depends(get_album_service)],
+    session: Annotated[AsyncSession, Depends(db_helper.session_getter)],
+    redis_helper: Annotated[RedisCache, Depends(get_redis_helper)],
+) -> Files:
+    return await album_service.complete_upload(
+        session=session,
+        user=user,
+        redis_helper=redis_helper,
+        upload_complete=upload_complete
+    )
+
+
 @router.patch(
     "/{album_id}/", 
     response_model=Files,
@@ -125,15 +210,33 @@ async def delete_album(
 async def download_album_photo(
     file_name: str,
     album_service: Annotated[AlbumService, Depends(get_album_service)],
+    redis_helper: Annotated[RedisCache, Depends(get_redis_helper)],
+    session: Annotated[AsyncSession, Depends(db_helper.session_getter)],
+    mode: DownloadMode = DownloadMode.PROXY,
+    size: Annotated[ImageSize | None, Query(description="Side of a precomputed cover thumbnail, px")] = None,
+    range_header: Annotated[str | None, Header(alias="Range")] = None,
+    if_range: Annotated[str | None, Header(alias="If-Range")] = None,
+    if_none_match: Annotated[str | None, Header(alias="If-None-Match")] = None,
 ) -> Response:
-    contents = await album_service.download_song_or_photo_file(
+    if mode is DownloadMode.REDIRECT:
+        url = await album_service.get_download_url(
+            session=session,
+            file_name=file_name,
+            folder_type=ALBUMS,
+            redis_helper=redis_helper,
+            size=size
+        )
+        return RedirectResponse(url=url, status_code=status.HTTP_302_FOUND)
+
+    stream = await album_service.stream_song_or_photo_file(
+        session=session,
+        redis_helper=redis_helper,
         file_name=file_name,
-        folder_type=ALBUMS
-    )
-    return Response(
-        content=contents,
-        headers={
-            'Content-Disposition': f'attachment;filename={file_name}',
-            'Content-Type': 'application/octet-stream',
-        }
+        folder_type=ALBUMS,
+        range_header=range_header,
+        if_range=if_range,
+        size=size,
+        if_none_match=if_none_match
     )
+    # Имя файла - его хэш, но под size может появиться готовая копия вместо оригинала
+    return media_stream_response(stream, file_name, cache_control=SHORT_CACHE_CONTROL if size else IMMUTABLE_CACHE_CONTROL)
@@ -1,15 +1,22 @@
 import logging
 from typing import Annotated, Any
-from fastapi import APIRouter, Depends, File, Form, Response, UploadFile, status
+from fastapi import APIRouter, Depends, File, Form, Header, Query, Request, Response, UploadFile, status
+from fastapi.responses import RedirectResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from auth.schemas import UserOut
 from auth.validation import get_current_active_auth_user
 from music.constants import SONGS
-from music.enums import Genre
-from music.schemas import Files, SongOut
+from music.enums import DownloadMode, Genre, ImageSize
+from music.schemas import Files, SongOut, SongUploadComplete, SongUploadIn, SongUploadUrls
 from database import db_helper
+from music.streaming import (
+    IMMUTABLE_CACHE_CONTROL,
+    SHORT_CACHE_CONTROL,
+    cached_entity_response,
+    media_stream_response,
+)
 from music.service.song_service import SongService, get_song_service
-from music.utils import get_music_filters
+from music.utils import get_batch_ids, get_music_filters
 from redis_cache import RedisCache, get_redis_helper
 
 
@@ -29,12 +36,36 @@ router = APIRouter(
 async def get_all_songs(
     song_service: Annotated[SongService, Depends(get_song_service)],
     session: Annotated[AsyncSession, Depends(db_helper.session_getter)],
+    redis_helper: Annotated[RedisCache, Depends(get_redis_helper)],
     filters: Annotated[dict[str, Any], Depends(get_music_filters)],
+    if_none_match: Annotated[str | None, Header(alias="If-None-Match")] = None,
 ) -> list[SongOut]:
-    return await song_service.list_songs(
+    cached = await song_service.list_songs(
         session=session,
+        redis_helper=redis_helper,
         **filters
     )
+    return cached_entity_response(cached, if_none_match)
+
+
+@router.get(
+    "/batch", 
+    response_model=list[SongOut], 
+    description="Songs by ids in request order; unknown ids are skipped"
+)
+async def get_songs_batch(
+    song_service: Annotated[SongService, Depends(get_song_service)],
+    session: Annotated[AsyncSession, Depends(db_helper.session_getter)],
+    redis_helper: Annotated[RedisCache, Depends(get_redis_helper)],
+    ids: Annotated[list[int], Depends(get_batch_ids)],
+    if_none_match: Annotated[str | None, Header(alias="If-None-Match")] = None,
+) -> list[SongOut]:
+    cached = await song_service.get_cached_songs(
+        session=session,
+        redis_helper=redis_helper,
+        song_ids=ids
+    )
+    return cached_entity_response(cached, if_none_match)
 
 
 @router.get("/{song_id}/", response_model=SongOut)
@@ -43,17 +74,15 @@ async def get_song(
     session: Annotated[AsyncSession, Depends(db_helper.session_getter)],
     redis_helper: Annotated[RedisCache, Depends(get_redis_helper)],
     song_id: int,
+    if_none_match: Annotated[str | None, Header(alias="If-None-Match")] = None,
 ) -> SongOut:
-    if not (
-        song := await redis_helper.get(
-            key=f"song/{song_id}", 
-        )
-    ):
-        song = await song_service.get_song_by_id(
-            session=session,
-            song_id=song_id
-        )
-    return song
+    cached = await song_service.get_cached_song(
+        session=session,
+        redis_helper=redis_helper,
+        song_id=song_id
+    )
+    # Готовое тело из кэша отдается как есть, без валидации и повторной сериализации
+    return cached_entity_response(cached, if_none_match)
 
 
 @router.post("/", response_model=Files, status_code=status.HTTP_201_CREATED)
@@ -80,6 +109,36 @@ async def create_song(
     )
 
 
+@router.post("/uploads/", response_model=SongUploadUrls, description="Get presigned URLs to upload files directly to storage")
+async def create_song_upload_urls(
+    song_upload_in: SongUploadIn,
+    user: Annotated[UserOut, Depends(get_current_active_auth_user)],
+    song_service: Annotated[SongService, Depends(get_song_service)],
+    redis_helper: Annotated[RedisCache, Depends(get_redis_helper)],
+) -> SongUploadUrls:
+    return await song_service.create_upload_urls(
+        user=user,
+        redis_helper=redis_helper,
+        song_upload_in=song_upload_in
+    )
+
+
+@router.post("/uploads/complete/", response_model=Files, status_code=status.HTTP_201_CREATED)
+async def complete_song_upload(
+    upload_complete: SongUploadComplete,
+    user: Annotated[UserOut, Depends(get_current_active_auth_user)],
+    song_service: Annotated[SongService, Depends(get_song_service)],
+    session: Annotated[AsyncSession, Depends(db_helper.session_getter)],
+    redis_helper: Annotated[RedisCache, Depends(get_redis_helper)],
+) -> Files:
+    return await song_service.complete_upload(
+        session=session,
+        user=user,
+        redis_helper=redis_helper,
+        upload_complete=upload_complete
+    )
+
+
 @router.patch("/{song_id}/", response_model=Files, response_model_exclude_none=True)
 async def update_song(
     song_id: int,
@@ -124,15 +183,110 @@ async def delete_song(
 async def download_song_or_photo(
     file_name: str,
     song_service: Annotated[SongService, Depends(get_song_service)],
+    redis_helper: Annotated[RedisCache, Depends(get_redis_helper)],
+    session: Annotated[AsyncSession, Depends(db_helper.session_getter)],
+    mode: DownloadMode = DownloadMode.PROXY,
+    size: Annotated[ImageSize | None, Query(description="Side of a precomputed cover thumbnail, px")] = None,
+    start: Annotated[float | None, Query(ge=0, description="Clip start, seconds")] = None,
+    duration: Annotated[float | None, Query(gt=0, description="Clip length, seconds")] = None,
+    range_header: Annotated[str | None, Header(alias="Range")] = None,
+    if_range: Annotated[str | None, Header(alias="If-Range")] = None,
+    if_none_match: Annotated[str | None, Header(alias="If-None-Match")] = None,
 ) -> Response:
-    contents = await song_service.download_song_or_photo_file(
+    if start is not None or duration is not None:
+        # Отрезок по времени всегда проксируется: presigned-ссылка не ограничивает диапазон
+        stream = await song_service.stream_song_clip(
+            session=session,
+            redis_helper=redis_helper,
+            file_name=file_name,
+            start=start or 0,
+            duration=duration,
+            if_none_match=if_none_match
+        )
+        return media_stream_response(stream, file_name, cache_control=IMMUTABLE_CACHE_CONTROL)
+
+    if mode is DownloadMode.REDIRECT:
+        url = await song_service.get_download_url(
+            session=session,
+            file_name=file_name,
+            folder_type=SONGS,
+            redis_helper=redis_helper,
+            size=size
+        )
+        return RedirectResponse(url=url, status_code=status.HTTP_302_FOUND)
+
+    stream = await song_service.stream_song_or_photo_file(
+        session=session,
+        redis_helper=redis_helper,
         file_name=file_name,
-        folder_type=SONGS
+        folder_type=SONGS,
+        range_header=range_header,
+        if_range=if_range,
+        size=size,
+        if_none_match=if_none_match
     )
+    # Имя файла - его хэш, но под size может появиться готовая копия вместо оригинала
+    return media_stream_response(stream, file_name, cache_control=SHORT_CACHE_CONTROL if size else IMMUTABLE_CACHE_CONTROL)
+
+
+@router.get("/{song_id}/playlist.m3u8", description="HLS playlist of ~6 s song segments")
+async def get_song_playlist(
+    song_id: int,
+    request: Request,
+    song_service: Annotated[SongService, Depends(get_song_service)],
+    session: Annotated[AsyncSession, Depends(db_helper.session_getter)],
+) -> Response:
+    playlist = await song_service.get_song_playlist(
+        session=session,
+        song_id=song_id,
+        segment_url=lambda file_stem, index: str(
+            request.url_for('stream_song_segment', file_stem=file_stem, index=index)
+        )
+    )
+    # Плейлист меняется вместе с файлом песни, сегменты - никогда
     return Response(
-        content=contents,
-        headers={
-            'Content-Disposition': f'attachment;filename={file_name}',
-            'Content-Type': 'application/octet-stream',
-        }
+        content=playlist,
+        media_type='application/vnd.apple.mpegurl',
+        headers={'Cache-Control': SHORT_CACHE_CONTROL}
+    )
+
+
+@router.get("/{song_id}/waveform", description="Waveform peaks: 1024 (min, max) int8 pairs")
+async def get_song_waveform(
+    song_id: int,
+    song_service: Annotated[SongService, Depends(get_song_service)],
+    session: Annotated[AsyncSession, Depends(db_helper.session_getter)],
+    redis_helper: Annotated[RedisCache, Depends(get_redis_helper)],
+    range_header: Annotated[str | None, Header(alias="Range")] = None,
+    if_range: Annotated[str | None, Header(alias="If-Range")] = None,
+    if_none_match: Annotated[str | None, Header(alias="If-None-Match")] = None,
+) -> Response:
+    stream = await song_service.stream_song_waveform(
+        session=session,
+        redis_helper=redis_helper,
+        song_id=song_id,
+        range_header=range_header,
+        if_range=if_range,
+        if_none_match=if_none_match
+    )
+    # Как и плейлист, адрес привязан к песне, а не к ее файлу
+    return media_stream_response(stream, f"song_{song_id}_waveform.bin", cache_control=SHORT_CACHE_CONTROL)
+
+
+@router.get("/hls/{file_stem}/{index}.mp3", description="One segment of a song, see playlist.m3u8")
+async def stream_song_segment(
+    file_stem: str,
+    index: int,
+    song_service: Annotated[SongService, Depends(get_song_service)],
+    range_header: Annotated[str | None, Header(alias="Range")] = None,
+    if_range: Annotated[str | None, Header(alias="If-Range")] = None,
+    if_none_match: Annotated[str | None, Header(alias="If-None-Match")] = None,
+) -> Response:
+    stream = await song_service.stream_song_segment(
+        file_stem=file_stem,
+        index=index,
+        range_header=range_header,
+        if_range=if_range,
+        if_none_match=if_none_match
     )
+    return media_stream_response(stream, f"{file_stem}_{index}.mp3", cache_control=IMMUTABLE_CACHE_CONTROL)
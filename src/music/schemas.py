@@ -1,5 +1,5 @@
 from datetime import datetime
-from pydantic import ConfigDict, BaseModel
+from pydantic import ConfigDict, BaseModel, Field
 
 from auth.schemas import UserBase
 from music.enums import Genre
@@ -14,13 +14,15 @@ class SongBase(BaseModel):
     album_id: int
     file_url: str | None = None
     photo_url: str | None = None
+    duration: int | None = None
+    bitrate: int | None = None
 
 
 class SongIn(SongBase):
-    pass
+    frame_index: bytes | None = None
 
 
-class SongOut(SongIn):
+class SongOut(SongBase):
     id: int
     artist: "UserBase"
     album: "AlbumBase"
@@ -33,6 +35,9 @@ class SongUpdate(BaseModel):
     genre: Genre | None = None
     file_url: str | None = None
     photo_url: str | None = None
+    duration: int | None = None
+    bitrate: int | None = None
+    frame_index: bytes | None = None
 
 
 class AlbumBase(BaseModel):
@@ -62,4 +67,42 @@ class AlbumUpdate(BaseModel):
  
 class Files(BaseModel):
     song_filename: str | None = None
-    photo_filename: str | None = None
\ No newline at end of file
+    photo_filename: str | None = None
+
+
+class PresignedUpload(BaseModel):
+    file_name: str
+    key: str
+    url: str
+    content_type: str
+
+
+class SongUploadIn(BaseModel):
+    song_file_name: str
+    photo_file_name: str
+
+
+class SongUploadUrls(BaseModel):
+    song: PresignedUpload
+    photo: PresignedUpload
+
+
+class SongUploadComplete(BaseModel):
+    name: str
+    genre: "Genre"
+    album_id: int = Field(gt=0)
+    song_key: str
+    photo_key: str
+
+
+class AlbumUploadIn(BaseModel):
+    photo_file_name: str
+
+
+class AlbumUploadUrls(BaseModel):
+    photo: PresignedUpload
+
+
+class AlbumUploadComplete(BaseModel):
+    name: str
+    photo_key: str
@@ -1,18 +1,29 @@
 from abc import ABC, abstractmethod
-from fastapi import UploadFile
+from typing import AsyncIterator
+from fastapi import HTTPException, UploadFile, status
+from pydantic import TypeAdapter
 from sqlalchemy.ext.asyncio import AsyncSession
 from auth.schemas import UserOut
-from aws.s3_actions import S3Client
+from storage import storage_helper
 from music.repository.song_repository import SongRepository, get_song_repository
-from music.schemas import AlbumIn, AlbumOut, AlbumUpdate, Files
+from music.schemas import AlbumIn, AlbumOut, AlbumUpdate, AlbumUploadComplete, AlbumUploadIn, AlbumUploadUrls, Files
 from database.models import Album
 from music.repository.album_repository import AlbumRepository, get_album_repository
+from music.archive import archive_member_name, stream_zip
+from music.cache_dependencies import album_dependencies, album_ref, album_songs_ref, song_ref
+from music.list_cache import album_generations, album_list_generations, cached_batch, cached_list
 from music.constants import ALBUMS, IMAGES
+from music.streaming import cached_batch_response, cached_entity
 from music.service.mixins.file_action_mixin import FileActionMixin
 from music.utils import check_user_role
+from cache_codec import CachedResponse, ResponseCodec
 from redis_cache import RedisCache
 
 
+# Список альбомов целиком: проверка по AlbumOut и сразу JSON, без списка моделей в ответе роутера
+ALBUM_LIST_ADAPTER = TypeAdapter(list[AlbumOut])
+
+
 class AbstractAlbumService(ABC):
     @staticmethod
     @abstractmethod
@@ -39,11 +50,15 @@ class AlbumService(AbstractAlbumService, FileActionMixin):
     @staticmethod
     async def list_albums(
         session: AsyncSession,
+        redis_helper: RedisCache,
         album_repository: AlbumRepository = get_album_repository(),
         **filters,
-    ) -> list[AlbumOut]:
-        albums: list[Album] = await album_repository.get_albums(session=session, **filters)
-        return [AlbumOut.model_validate(album, from_attributes=True) for album in albums]
+    ) -> CachedResponse:
+        async def load() -> bytes:
+            albums: list[Album] = await album_repository.get_albums(session=session, **filters)
+            return ALBUM_LIST_ADAPTER.dump_json(ALBUM_LIST_ADAPTER.validate_python(albums, from_attributes=True))
+
+        return await cached_list(redis_helper, ALBUMS, filters, album_list_generations(filters), load)
     
 
     @staticmethod
@@ -57,6 +72,64 @@ class AlbumService(AbstractAlbumService, FileActionMixin):
             album_id=album_id
         )
     
+    @staticmethod
+    async def get_cached_album(
+        session: AsyncSession,
+        redis_helper: RedisCache,
+        album_id: int,
+        album_repository: AlbumRepository = get_album_repository(),
+    ) -> CachedResponse:
+        """JSON альбома из кэша; при промахе его собирает из БД один процесс, а не все запросы сразу."""
+        async def load() -> tuple[CachedResponse, list[str]]:
+            album: Album = await album_repository.get_album_by_id(session=session, album_id=album_id)
+            return cached_entity(AlbumOut.model_validate(album, from_attributes=True)), album_dependencies(album)
+
+        return await redis_helper.get_or_compute(key=f"album/{album_id}", compute=load, codec=ResponseCodec())
+
+    @staticmethod
+    async def get_cached_albums(
+        session: AsyncSession,
+        redis_helper: RedisCache,
+        album_ids: list[int],
+        album_repository: AlbumRepository = get_album_repository(),
+    ) -> CachedResponse:
+        """JSON-массив альбомов в порядке album_ids: кэш - одним MGET, остальные - одним запросом к БД."""
+        async def load(missing: list[int]) -> dict[int, tuple[CachedResponse, list[str]]]:
+            albums: list[Album] = await album_repository.get_albums_by_ids(session=session, album_ids=missing)
+            return {
+                album.id: (
+                    cached_entity(AlbumOut.model_validate(album, from_attributes=True)),
+                    album_dependencies(album)
+                )
+                for album in albums
+            }
+
+        return cached_batch_response(await cached_batch(redis_helper, 'album', album_ids, load))
+
+    @staticmethod
+    async def stream_album_archive(
+        session: AsyncSession,
+        album_id: int,
+        album_repository: AlbumRepository = get_album_repository(),
+    ) -> tuple[str, AsyncIterator[bytes]]:
+        """Название альбома и ZIP его песен; песни читаются из хранилища по мере отдачи архива."""
+        album: Album = await album_repository.get_album_by_id(session=session, album_id=album_id)
+        if not album.songs:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Album has no songs"
+            )
+        songs = sorted(album.songs, key=lambda song: song.id)
+        members = [
+            (
+                archive_member_name(index, song.name, song.file_url.rsplit('.', 1)[-1]),
+                song.updated_at,
+                storage_helper.iter_file(song.file_url),
+            )
+            for index, song in enumerate(songs, start=1)
+        ]
+        return album.name, stream_zip(members)
+
     @staticmethod
     @check_user_role
     async def create_album(
@@ -69,8 +142,7 @@ class AlbumService(AbstractAlbumService, FileActionMixin):
     ) -> Files:
         photo_filename, photo_url_key = await AlbumService._generate_file_key(photo_file, IMAGES, ALBUMS)
 
-        async with S3Client() as s3_client:
-            await AlbumService._upload_file(s3_client, photo_file, photo_url_key, IMAGES)
+        await AlbumService._store_files(session, storage_helper, [(photo_file, photo_url_key, IMAGES)])
 
         album_in = AlbumIn(
             name=name,
@@ -78,9 +150,71 @@ class AlbumService(AbstractAlbumService, FileActionMixin):
             photo_url=photo_url_key,
         )
 
-        album: Album = await album_repository.create_album(session=session, album_in=album_in)
+        try:
+            album: Album = await album_repository.create_album(session=session, album_in=album_in)
+        except Exception:
+            await AlbumService._release_files(session, [photo_url_key])
+            raise
+        album_schema: AlbumOut = AlbumOut.model_validate(album, from_attributes=True)
+        await redis_helper.set(
+            key=f"album/{album.id}", 
+            value=cached_entity(album_schema), 
+            codec=ResponseCodec(),
+            dependencies=album_dependencies(album)
+        )
+        await redis_helper.bump_generations(album_generations(album))
+        await AlbumService._schedule_image_derivatives([photo_url_key])
+        return Files(photo_filename=photo_filename)
+
+
+    @staticmethod
+    @check_user_role
+    async def create_upload_urls(
+        user: UserOut,
+        redis_helper: RedisCache,
+        album_upload_in: AlbumUploadIn,
+    ) -> AlbumUploadUrls:
+        photo = await AlbumService._create_upload_url(
+            storage_helper, redis_helper, album_upload_in.photo_file_name, IMAGES, ALBUMS, user.id
+        )
+        return AlbumUploadUrls(photo=photo)
+
+
+    @staticmethod
+    @check_user_role
+    async def complete_upload(
+        session: AsyncSession,
+        user: UserOut,
+        redis_helper: RedisCache,
+        upload_complete: AlbumUploadComplete,
+        album_repository: AlbumRepository = get_album_repository(),
+    ) -> Files:
+        photo_key = upload_complete.photo_key
+        photo_filename = await AlbumService._verify_uploaded_file(
+            storage_helper, redis_helper, photo_key, IMAGES, ALBUMS, user.id
+        )
+        await AlbumService._register_files(session, [photo_key])
+
+        album_in = AlbumIn(
+            name=upload_complete.name,
+            artist_id=user.id,
+            photo_url=photo_key,
+        )
+
+        try:
+            album: Album = await album_repository.create_album(session=session, album_in=album_in)
+        except Exception:
+            await AlbumService._release_files(session, [photo_key])
+            raise
         album_schema: AlbumOut = AlbumOut.model_validate(album, from_attributes=True)
-        await redis_helper.set(key=f"album/{album.id}", value=album_schema.model_dump())
+        await redis_helper.set(
+            key=f"album/{album.id}", 
+            value=cached_entity(album_schema), 
+            codec=ResponseCodec(),
+            dependencies=album_dependencies(album)
+        )
+        await redis_helper.bump_generations(album_generations(album))
+        await AlbumService._schedule_image_derivatives([photo_key])
         return Files(photo_filename=photo_filename)
 
 
@@ -99,19 +233,38 @@ class AlbumService(AbstractAlbumService, FileActionMixin):
 
         photo_filename, photo_url_key = None, None
 
-        async with S3Client() as s3_client:
-            if photo_file:
-                photo_filename, photo_url_key = await AlbumService._generate_file_key(photo_file, IMAGES, ALBUMS)
-                await AlbumService._update_file(s3_client, photo_file, album_to_update.photo_url, photo_url_key, IMAGES)
+        if photo_file:
+            photo_filename, photo_url_key = await AlbumService._generate_file_key(photo_file, IMAGES, ALBUMS)
+            # Новая обложка загружается до изменения записи, старая освобождается после
+            await AlbumService._store_files(session, storage_helper, [(photo_file, photo_url_key, IMAGES)])
+        old_photo_url = album_to_update.photo_url
 
         album_update = AlbumUpdate(
             name=name or album_to_update.name,
             photo_url=photo_url_key or album_to_update.photo_url,
         )
         
-        album: Album = await album_repository.update_album(session=session, album_id=album_id, album_update=album_update)
+        try:
+            album: Album = await album_repository.update_album(session=session, album_id=album_id, album_update=album_update)
+        except Exception:
+            if photo_url_key:
+                await AlbumService._release_files(session, [photo_url_key])
+            raise
+        if photo_url_key:
+            await AlbumService._release_files(session, [old_photo_url])
         album_schema: AlbumOut = AlbumOut.model_validate(album, from_attributes=True)
-        await redis_helper.set(key=f"album/{album.id}", value=album_schema.model_dump())
+        # Альбом есть в ответе каждой своей песни
+        await redis_helper.invalidate([album_ref(album.id)])
+        await redis_helper.set(
+            key=f"album/{album.id}", 
+            value=cached_entity(album_schema), 
+            codec=ResponseCodec(),
+            dependencies=album_dependencies(album)
+        )
+        # Альбом есть и в ответах списка песен - сбрасываем и выборки его песен
+        await redis_helper.bump_generations(album_generations(album, album.songs))
+        if photo_url_key:
+            await AlbumService._schedule_image_derivatives([photo_url_key])
         return Files(photo_filename=photo_filename)
 
 
@@ -127,15 +280,20 @@ class AlbumService(AbstractAlbumService, FileActionMixin):
     ) -> None:        
         album: AlbumOut = await album_repository.get_album_by_id(session=session, album_id=album_id)
         
-        async with S3Client() as s3_client:
-            await AlbumService._delete_file(s3_client, album.photo_url)
+        file_keys = [album.photo_url]
+        for song in album.songs:
+            file_keys.extend((song.file_url, song.photo_url))
+        generations = album_generations(album, album.songs)
+        dependencies = [album_ref(album.id), album_songs_ref(album.id), *(song_ref(song.id) for song in album.songs)]
 
         for song in album.songs:
             await song_repository.delete_song(session=session, song_id=song.id)
 
-        await redis_helper.delete(f"album/{album.id}")
-
         await album_repository.delete_album(session=session, album_id=album_id)
+        await redis_helper.invalidate(dependencies)
+        await redis_helper.bump_generations(generations)
+
+        await AlbumService._release_files(session, file_keys)
     
 
 def get_album_service() -> AlbumService:
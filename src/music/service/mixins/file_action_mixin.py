@@ -1,36 +1,265 @@
+import asyncio
+import hashlib
+import logging
+import mimetypes
+import re
+from functools import partial
+from typing import BinaryIO
 from uuid import uuid4
 
+from celery import Task
 from fastapi import HTTPException, UploadFile, status
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from aws.s3_actions import S3Client
-from music.constants import IMAGES, MUSIC, SUPPORTED_FILE_TYPES
+from storage import FileStream, StorageBackend, storage_helper
+from config import settings
+from media_cache import cached_file_stream, media_cache
+from music.constants import (
+    DOWNLOAD_CHUNK_SIZE, 
+    IMAGES, 
+    KEY_FANOUT_LENGTH, 
+    MAGIC_HEADER_SIZE, 
+    MAX_FILE_SIZES, 
+    MUSIC, 
+    PRESIGNED_URL_CACHE_MARGIN, 
+    SUPPORTED_FILE_TYPES
+)
+from music.enums import ImageSize
+from music.repository.media_repository import MediaRepository, get_media_repository
+from music.schemas import PresignedUpload
+from music.streaming import etag_matches, parse_range_header
+from music.tasks import generate_image_derivatives
+from redis_cache import RedisCache
+
+
+CONTENT_HASH_PATTERN = re.compile(r'[0-9a-f]{64}')
+# Имена presigned-загрузок - uuid4 без дефисов; старые имена с дефисами остаются без префикса
+RANDOM_NAME_PATTERN = re.compile(r'[0-9a-f]{32}')
+
+
+def _hash_file(file: BinaryIO) -> tuple[str, int]:
+    # Проход по локальному спулу UploadFile: в памяти только один кусок
+    digest = hashlib.sha256()
+    size = 0
+    file.seek(0)
+    while chunk := file.read(DOWNLOAD_CHUNK_SIZE):
+        digest.update(chunk)
+        size += len(chunk)
+    file.seek(0)
+    return digest.hexdigest(), size
 
 
 class FileActionMixin:    
     @staticmethod
     async def _generate_file_key(file: UploadFile, file_type: str, folder_type: str) -> tuple[str, str]:
-        filename = f"{uuid4()}.{file.filename.split('.')[-1]}"
-        url_key = f"{folder_type}/{file_type}/{filename}"
-        return filename, url_key
+        """
+        Ключ по содержимому: имя файла - sha256 его байтов.
+
+        Одинаковые файлы получают один ключ и хранятся один раз. Тип (по имени
+        и по первым байтам) и размер проверяются здесь же, до обращения к хранилищу.
+        """
+        if not file:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail='No file found!!'
+            )
+        extension = await storage_helper.get_file_type(file.filename, SUPPORTED_FILE_TYPES[file_type])
+        # Подмененный файл отклоняется по заголовку, до полного прохода по содержимому
+        StorageBackend.check_file_content(await file.read(MAGIC_HEADER_SIZE), extension, SUPPORTED_FILE_TYPES[file_type])
+        digest, size = await asyncio.to_thread(_hash_file, file.file)
+        StorageBackend.check_file_size(size, extension, MAX_FILE_SIZES[extension])
+        filename = f"{digest}.{extension}"
+        return filename, FileActionMixin._build_key(filename, file_type, folder_type)
+
+    @staticmethod
+    def _generate_key_for_name(original_name: str, file_type: str, folder_type: str) -> tuple[str, str]:
+        filename = f"{uuid4().hex}.{original_name.split('.')[-1]}"
+        return filename, FileActionMixin._build_key(filename, file_type, folder_type)
+
+    @staticmethod
+    def _build_key(filename: str, file_type: str, folder_type: str) -> str:
+        stem = filename.split('.')[0]
+        if CONTENT_HASH_PATTERN.fullmatch(stem) or RANDOM_NAME_PATTERN.fullmatch(stem):
+            # Первые символы хэша или uuid - отдельный префикс, нагрузка распределяется по префиксам S3
+            return f"{folder_type}/{file_type}/{stem[:KEY_FANOUT_LENGTH]}/{filename}"
+        return f"{folder_type}/{file_type}/{filename}"
+
+    @staticmethod
+    async def _upload_file(storage: StorageBackend, file: UploadFile, key: str, file_type: str) -> None:
+        await storage.upload_file(file=file, key=key, SUPPORTED_FILE_TYPES=SUPPORTED_FILE_TYPES[file_type])
+
+    @staticmethod
+    async def _store_files(
+        session: AsyncSession,
+        storage: StorageBackend,
+        uploads: list[tuple[UploadFile, str, str]],
+        media_repository: MediaRepository = get_media_repository(),
+    ) -> None:
+        """
+        Регистрирует ссылки на файлы и загружает в хранилище только новые.
+
+        uploads - тройки (файл, ключ из _generate_file_key, тип файла). Если
+        объект с таким содержимым уже загружен (MediaObject.uploaded), загрузка
+        пропускается. Ссылку на еще не загруженный объект мог взять параллельный
+        запрос, чья загрузка идет или уже упала: такой объект проверяется в
+        хранилище и при отсутствии загружается заново - одинаковое содержимое
+        по одному ключу перезаписать безопасно. При ошибке ссылки освобождаются,
+        объекты без ссылок позже удаляет задача Celery (см. _release_files).
+        """
+        keys = [key for _, key, _ in uploads]
+        states = await media_repository.acquire_keys(session=session, keys=keys)
+        pending = [
+            (file, key, file_type) for file, key, file_type in uploads 
+            if not states[key][1]
+        ]
+        results = await asyncio.gather(
+            *(
+                FileActionMixin._upload_missing_file(storage, file, key, file_type, first=states[key][0] == 1)
+                for file, key, file_type in pending
+            ),
+            return_exceptions=True
+        )
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            await FileActionMixin._release_files(session, keys, media_repository)
+            raise errors[0]
+        if pending:
+            await media_repository.mark_uploaded(session=session, keys=[key for _, key, _ in pending])
+
+    @staticmethod
+    async def _upload_missing_file(
+        storage: StorageBackend, 
+        file: UploadFile, 
+        key: str, 
+        file_type: str, 
+        first: bool,
+    ) -> None:
+        # Первая ссылка - объекта точно нет; иначе его могла уже загрузить другая
+        if not first and await FileActionMixin._file_exists(storage, key):
+            return
+        await FileActionMixin._upload_file(storage, file, key, file_type)
+
+    @staticmethod
+    async def _file_exists(storage: StorageBackend, key: str) -> bool:
+        try:
+            await storage.head_file(key)
+        except HTTPException as err:
+            if err.status_code == status.HTTP_404_NOT_FOUND:
+                return False
+            raise
+        return True
+
+    @staticmethod
+    async def _register_files(
+        session: AsyncSession,
+        keys: list[str],
+        media_repository: MediaRepository = get_media_repository(),
+    ) -> None:
+        # Файлы уже в хранилище (presigned-загрузка) - только учитываем ссылки
+        await media_repository.acquire_keys(session=session, keys=keys, uploaded=True)
+
+    @staticmethod
+    async def _release_files(
+        session: AsyncSession,
+        keys: list[str],
+        media_repository: MediaRepository = get_media_repository(),
+    ) -> None:
+        """
+        Освобождает ссылки на файлы.
+
+        Объекты без ссылок удаляет из хранилища периодическая задача Celery
+        (beat_schedule в music.tasks): запрос не ждет S3, а очередь в таблице
+        mediaobject переживает падение брокера. Объект удаляется не раньше чем
+        через retire_delay, пока живут выданные ссылки на старый файл, поэтому
+        отдельная задача на каждое освобождение не нужна.
+        """
+        await media_repository.release_keys(session=session, keys=keys)
+
+    @staticmethod
+    async def _schedule_task(task: Task, *args, **options) -> None:
+        # apply_async ходит в брокер синхронно - выносим из event loop; сбой брокера не ломает запрос
+        try:
+            await asyncio.to_thread(task.apply_async, args, **options)
+        except Exception as err:
+            logging.error(f"Could not schedule task {task.name}: {err}")
 
     @staticmethod
-    async def _upload_file(s3_client: S3Client, file: UploadFile, key: str, file_type: str) -> None:
-        await s3_client.s3_upload_file(file=file, key=key, SUPPORTED_FILE_TYPES=SUPPORTED_FILE_TYPES[file_type])
+    async def _schedule_image_derivatives(keys: list[str]) -> None:
+        # Уменьшенные копии обложек строит Celery, оригинал доступен сразу
+        for key in keys:
+            await FileActionMixin._schedule_task(generate_image_derivatives, key)
 
     @staticmethod
-    async def _download_file(s3_client: S3Client, file_name: str, key: str) -> str:
-        return await s3_client.s3_download_file(file_name=file_name, key=key)
+    async def _delete_files(storage: StorageBackend, keys: list[str]) -> None:
+        # Объекты без записей в mediaobject - удаляем сразу, одной пачкой
+        if not keys:
+            return
+        try:
+            await storage.delete_files(keys)
+        except Exception as err:
+            logging.error(f"Could not remove files {keys}: {err}")
 
     @staticmethod
-    async def _update_file(s3_client: S3Client, file: UploadFile, old_key: str, new_key: str, file_type: str) -> None:
-        await s3_client.s3_update_file(file=file, old_key=old_key, new_key=new_key, SUPPORTED_FILE_TYPES=SUPPORTED_FILE_TYPES[file_type])
+    async def _create_upload_url(
+        storage: StorageBackend,
+        redis_helper: RedisCache,
+        original_name: str,
+        file_type: str,
+        folder_type: str,
+        user_id: int,
+    ) -> PresignedUpload:
+        content_type, _ = mimetypes.guess_type(original_name)
+        if content_type not in SUPPORTED_FILE_TYPES[file_type]:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f'Unsupported file type: {content_type}. Supported types are {SUPPORTED_FILE_TYPES[file_type]}'
+            )
+        filename, url_key = FileActionMixin._generate_key_for_name(original_name, file_type, folder_type)
+        expires_in = settings.aws.presigned_upload_expire
+        # Запоминаем, кому выдан ключ: завершить загрузку может только он и только один раз
+        await redis_helper.set(key=f"upload/{url_key}", value=user_id, expire=expires_in)
+        return PresignedUpload(
+            file_name=filename,
+            key=url_key,
+            url=storage.generate_presigned_upload_url(url_key, content_type, expires_in),
+            content_type=content_type,
+        )
 
     @staticmethod
-    async def _delete_file(s3_client: S3Client, key: str) -> None:
-        await s3_client.s3_delete_file(key=key)
+    async def _verify_uploaded_file(
+        storage: StorageBackend,
+        redis_helper: RedisCache,
+        key: str,
+        file_type: str,
+        folder_type: str,
+        user_id: int,
+    ) -> str:
+        # Токен проверяется и удаляется атомарно: два одновременных завершения не пройдут оба
+        if (
+            not key.startswith(f"{folder_type}/{file_type}/")
+            or not await redis_helper.delete_if_equal(key=f"upload/{key}", value=user_id)
+        ):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f'Upload {key} was not requested or has expired'
+            )
+        head = await storage.head_file(key)
+        content_type = head.get('ContentType')
+        supported_types = SUPPORTED_FILE_TYPES[file_type]
+        header = b''
+        if content_type in supported_types and 0 < head['ContentLength'] <= MAX_FILE_SIZES[supported_types[content_type]]:
+            # Тип объявляет клиент, поэтому сверяем его с первыми байтами объекта
+            header = await storage.read_file(key, byte_range=f'bytes=0-{MAGIC_HEADER_SIZE - 1}')
+        if not header or supported_types.get(StorageBackend.sniff_content_type(header)) != supported_types[content_type]:
+            await FileActionMixin._delete_files(storage, [key])
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f'Uploaded file {key} has unsupported type or size'
+            )
+        return key.split('/')[-1]
 
     @staticmethod
-    async def download_song_or_photo_file(file_name: str, folder_type: str) -> str:
+    def _get_file_key(file_name: str, folder_type: str) -> str:
         if not file_name:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -38,8 +267,117 @@ class FileActionMixin:
             )
         file_type = file_name.split(".")[-1]
         if file_type in SUPPORTED_FILE_TYPES[IMAGES].values():
-            key = f"{folder_type}/{IMAGES}/{file_name}"
+            return FileActionMixin._build_key(file_name, IMAGES, folder_type)
+        return FileActionMixin._build_key(file_name, MUSIC, folder_type)
+
+    @staticmethod
+    async def _get_download_key(
+        session: AsyncSession,
+        redis_helper: RedisCache,
+        file_name: str,
+        folder_type: str,
+        size: ImageSize | None = None,
+        media_repository: MediaRepository = get_media_repository(),
+    ) -> str:
+        """Ключ оригинала или его уменьшенной копии, если она уже построена."""
+        key = FileActionMixin._get_file_key(file_name, folder_type)
+        if size is None:
+            return key
+        derivatives = await redis_helper.get(key=f"derivatives/{key}")
+        if derivatives is None:
+            derivatives = await media_repository.get_derivatives(session=session, key=key)
+            if derivatives:
+                await redis_helper.set(
+                    key=f"derivatives/{key}", 
+                    value=derivatives, 
+                    expire=settings.redis.derivatives_ttl
+                )
+        return (derivatives or {}).get(str(size.value), key)
+
+    @staticmethod
+    async def stream_song_or_photo_file(
+        session: AsyncSession,
+        redis_helper: RedisCache,
+        file_name: str, 
+        folder_type: str,
+        range_header: str | None = None,
+        if_range: str | None = None,
+        size: ImageSize | None = None,
+        if_none_match: str | None = None,
+    ) -> FileStream:
+        key = await FileActionMixin._get_download_key(session, redis_helper, file_name, folder_type, size)
+        return await FileActionMixin._stream_key(key, range_header, if_range, if_none_match)
+
+    @staticmethod
+    def _media_etag(key: str) -> str:
+        """
+        Сильный ETag объекта по его ключу.
+
+        Содержимое по ключу не меняется, поэтому ETag известен без обращения
+        к хранилищу: для ключей по содержимому это sha256 файла, для остальных -
+        sha256 самого ключа.
+        """
+        stem = key.split('/')[-1].rsplit('.', 1)[0]
+        if CONTENT_HASH_PATTERN.fullmatch(stem):
+            return f'"{stem}"'
+        return f'"{hashlib.sha256(key.encode()).hexdigest()[:32]}"'
+
+    @staticmethod
+    def _not_modified(etag: str) -> FileStream:
+        return FileStream(body=None, content_length=0, etag=etag, not_modified=True)
+
+    @staticmethod
+    async def _stream_key(
+        key: str,
+        range_header: str | None = None,
+        if_range: str | None = None,
+        if_none_match: str | None = None,
+    ) -> FileStream:
+        etag = FileActionMixin._media_etag(key)
+        if etag_matches(if_none_match, etag):
+            return FileActionMixin._not_modified(etag)
+
+        byte_range = parse_range_header(range_header)
+        if if_range and if_range.startswith(('"', 'W/')):
+            # If-Range с нашим ETag сверяется здесь: хранилище знает только свой ETag.
+            # Слабый ETag в If-Range никогда не совпадает (RFC 9110, 13.1.5)
+            if if_range != etag:
+                byte_range = None
+            if_range = None
+
+        # Локальное хранилище отдает файл с диска само, кэш перед ним только дублирует данные
+        if settings.media_cache.enabled and not storage_helper.local:
+            path, entry = await media_cache.get(
+                key, 
+                fetch=partial(storage_helper.download_to_file, key)
+            )
+            stream = cached_file_stream(path, entry, byte_range, if_range)
         else:
-            key = f"{folder_type}/{MUSIC}/{file_name}"
-        async with S3Client() as s3_client:
-            return await FileActionMixin._download_file(s3_client, file_name, key=key)
\ No newline at end of file
+            stream = await storage_helper.stream_file(
+                key=key,
+                byte_range=byte_range,
+                if_range=if_range
+            )
+        stream.etag = etag
+        return stream
+
+    @staticmethod
+    async def get_download_url(
+        session: AsyncSession,
+        file_name: str,
+        folder_type: str,
+        redis_helper: RedisCache,
+        size: ImageSize | None = None,
+    ) -> str:
+        key = await FileActionMixin._get_download_key(session, redis_helper, file_name, folder_type, size)
+        if url := await redis_helper.get(key=f"presigned/{key}"):
+            return url
+        expires_in = settings.aws.presigned_download_expire
+        url = storage_helper.generate_presigned_download_url(key, file_name, expires_in)
+        # Ссылка уходит из кэша раньше, чем истекает ее подпись
+        await redis_helper.set(
+            key=f"presigned/{key}", 
+            value=url, 
+            expire=expires_in - PRESIGNED_URL_CACHE_MARGIN
+        )
+        return url
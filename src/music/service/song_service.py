@@ -1,18 +1,36 @@
+import asyncio
 from abc import ABC, abstractmethod
-from fastapi import UploadFile
+from typing import Callable
+import orjson
+from fastapi import HTTPException, UploadFile, status
+from pydantic import TypeAdapter
 from sqlalchemy.ext.asyncio import AsyncSession
 from auth.schemas import UserOut
-from aws.s3_actions import S3Client
+from storage import FileStream, storage_helper
+from config import settings
 from music.enums import Genre
-from music.schemas import SongIn, SongOut, SongUpdate, Files
+from music.schemas import SongIn, SongOut, SongUpdate, Files, SongUploadComplete, SongUploadIn, SongUploadUrls
 from database.models import Song
 from music.repository.song_repository import SongRepository, get_song_repository
 from music.constants import MUSIC, SONGS, IMAGES
+from music.hls import SEGMENT_PREFIX, build_playlist, segment_key
+from music.cache_dependencies import album_songs_ref, song_dependencies, song_ref
+from music.list_cache import cached_batch, cached_list, song_generations, song_list_generations
+from music.mp3 import FrameIndex, build_frame_index
+from music.streaming import cached_batch_response, cached_entity, etag_matches
+from music.waveform import WAVEFORM_DERIVATIVE, waveform_key
+from music.repository.media_repository import MediaRepository, get_media_repository
+from music.tasks import generate_song_waveform, index_song_file, segment_song_file
 from music.service.mixins.file_action_mixin import FileActionMixin
 from music.utils import check_user_role
+from cache_codec import CachedResponse, MsgpackCodec, ResponseCodec
 from redis_cache import RedisCache
 
 
+# Список песен целиком: проверка по SongOut и сразу JSON, без списка моделей в ответе роутера
+SONG_LIST_ADAPTER = TypeAdapter(list[SongOut])
+
+
 class AbstractSongService(ABC):
     @staticmethod
     @abstractmethod
@@ -39,11 +57,15 @@ class SongService(AbstractSongService, FileActionMixin):
     @staticmethod
     async def list_songs(
         session: AsyncSession,
+        redis_helper: RedisCache,
         song_repository: SongRepository = get_song_repository(),
         **filters,
-    ) -> list[SongOut]:
-        songs: list[Song] = await song_repository.get_songs(session=session, **filters)
-        return [SongOut.model_validate(song, from_attributes=True) for song in songs]
+    ) -> CachedResponse:
+        async def load() -> bytes:
+            songs: list[Song] = await song_repository.get_songs(session=session, **filters)
+            return SONG_LIST_ADAPTER.dump_json(SONG_LIST_ADAPTER.validate_python(songs, from_attributes=True))
+
+        return await cached_list(redis_helper, SONGS, filters, song_list_generations(filters), load)
     
     @staticmethod
     async def get_song_by_id(
@@ -56,6 +78,173 @@ class SongService(AbstractSongService, FileActionMixin):
             song_id=song_id
         )
     
+    @staticmethod
+    async def get_cached_song(
+        session: AsyncSession,
+        redis_helper: RedisCache,
+        song_id: int,
+        song_repository: SongRepository = get_song_repository(),
+    ) -> CachedResponse:
+        """JSON песни из кэша; при промахе его собирает из БД один процесс, а не все запросы сразу."""
+        async def load() -> tuple[CachedResponse, list[str]]:
+            song: Song = await song_repository.get_song_by_id(session=session, song_id=song_id)
+            return cached_entity(SongOut.model_validate(song, from_attributes=True)), song_dependencies(song)
+
+        return await redis_helper.get_or_compute(key=f"song/{song_id}", compute=load, codec=ResponseCodec())
+
+    @staticmethod
+    async def get_cached_songs(
+        session: AsyncSession,
+        redis_helper: RedisCache,
+        song_ids: list[int],
+        song_repository: SongRepository = get_song_repository(),
+    ) -> CachedResponse:
+        """JSON-массив песен в порядке song_ids: кэш - одним MGET, остальные - одним запросом к БД."""
+        async def load(missing: list[int]) -> dict[int, tuple[CachedResponse, list[str]]]:
+            songs: list[Song] = await song_repository.get_songs_by_ids(session=session, song_ids=missing)
+            return {
+                song.id: (
+                    cached_entity(SongOut.model_validate(song, from_attributes=True)),
+                    song_dependencies(song)
+                )
+                for song in songs
+            }
+
+        return cached_batch_response(await cached_batch(redis_helper, 'song', song_ids, load))
+
+    @staticmethod
+    async def _index_song_file(song_file: UploadFile) -> dict:
+        # Длительность, битрейт и индекс кадров для Song; пусто, если кадры MP3 не нашлись
+        frame_index = await asyncio.to_thread(build_frame_index, song_file.file)
+        if frame_index is None:
+            return {'duration': None, 'bitrate': None, 'frame_index': None}
+        return {
+            'duration': frame_index.duration,
+            'bitrate': frame_index.bitrate,
+            'frame_index': frame_index.to_bytes(),
+        }
+
+    @staticmethod
+    async def stream_song_clip(
+        session: AsyncSession,
+        redis_helper: RedisCache,
+        file_name: str,
+        start: float,
+        duration: float | None = None,
+        if_none_match: str | None = None,
+        song_repository: SongRepository = get_song_repository(),
+    ) -> FileStream:
+        """
+        Отрезок песни по времени: индекс кадров превращает его в диапазон байт.
+
+        Отрезок начинается и заканчивается на границах кадров, поэтому играет
+        как самостоятельный MP3 и отдается как обычный ответ 200.
+        """
+        key = SongService._get_file_key(file_name, SONGS)
+        etag = f'"{key.split("/")[-1].split(".")[0]}-{start:g}-{duration or 0:g}"'
+        if etag_matches(if_none_match, etag):
+            return SongService._not_modified(etag)
+        if cached := await redis_helper.get(key=f"frame_index/{key}"):
+            frame_index = FrameIndex.from_bytes(*cached)
+        else:
+            frame_index = await song_repository.get_frame_index(session=session, file_url=key)
+            if frame_index is None:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Time seeking is not available for {file_name}"
+                )
+            await redis_helper.set(
+                key=f"frame_index/{key}", 
+                value=(frame_index.to_bytes(), frame_index.duration, frame_index.bitrate), 
+                expire=settings.redis.frame_index_ttl, 
+                # Смещения - те же байты, что в Song.frame_index, без array в кэше
+                codec=MsgpackCodec()
+            )
+
+        byte_range = frame_index.byte_range(start, duration)
+        if byte_range is None:
+            raise HTTPException(
+                status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                detail=f"Song is only {frame_index.duration / 1000:.1f} seconds long"
+            )
+        stream = await SongService.stream_song_or_photo_file(
+            session=session,
+            redis_helper=redis_helper,
+            file_name=file_name,
+            folder_type=SONGS,
+            range_header=byte_range,
+        )
+        # Для клиента отрезок - отдельный файл, а не часть оригинала
+        stream.content_range = None
+        stream.etag = etag
+        return stream
+
+    @staticmethod
+    async def get_song_playlist(
+        session: AsyncSession,
+        song_id: int,
+        segment_url: Callable[[str, int], str],
+        song_repository: SongRepository = get_song_repository(),
+        media_repository: MediaRepository = get_media_repository(),
+    ) -> str:
+        """Плейлист HLS песни; segment_url(file_stem, index) строит адрес сегмента."""
+        song: Song = await song_repository.get_song_by_id(session=session, song_id=song_id)
+        derivatives = await media_repository.get_derivatives(session=session, key=song.file_url) or {}
+        segment_count = sum(name.startswith(SEGMENT_PREFIX) for name in derivatives)
+        if not segment_count or not song.duration:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Segmented stream is not ready yet"
+            )
+        file_stem = song.file_url.split('/')[-1].rsplit('.', 1)[0]
+        return build_playlist(
+            [segment_url(file_stem, index) for index in range(segment_count)],
+            duration=song.duration
+        )
+
+    @staticmethod
+    async def stream_song_waveform(
+        session: AsyncSession,
+        redis_helper: RedisCache,
+        song_id: int,
+        range_header: str | None = None,
+        if_range: str | None = None,
+        if_none_match: str | None = None,
+        song_repository: SongRepository = get_song_repository(),
+        media_repository: MediaRepository = get_media_repository(),
+    ) -> FileStream:
+        """Пики волны песни: WAVEFORM_POINTS пар (min, max) int8, см. music.waveform."""
+        cached = await SongService.get_cached_song(
+            session=session, 
+            redis_helper=redis_helper, 
+            song_id=song_id, 
+            song_repository=song_repository
+        )
+        file_url = orjson.loads(cached.body)['file_url']
+        # Ключ волны выводится из ключа песни - на 304 не нужен ни запрос к БД, ни к хранилищу
+        key = waveform_key(file_url)
+        etag = SongService._media_etag(key)
+        if etag_matches(if_none_match, etag):
+            return SongService._not_modified(etag)
+        derivatives = await media_repository.get_derivatives(session=session, key=file_url) or {}
+        if WAVEFORM_DERIVATIVE not in derivatives:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Waveform is not ready yet"
+            )
+        return await SongService._stream_key(key, range_header, if_range)
+
+    @staticmethod
+    async def stream_song_segment(
+        file_stem: str,
+        index: int,
+        range_header: str | None = None,
+        if_range: str | None = None,
+        if_none_match: str | None = None,
+    ) -> FileStream:
+        key = SongService._get_file_key(f"{file_stem}.mp3", SONGS)
+        return await SongService._stream_key(segment_key(key, index), range_header, if_range, if_none_match)
+
     @staticmethod
     @check_user_role
     async def create_song(
@@ -69,12 +258,20 @@ class SongService(AbstractSongService, FileActionMixin):
         redis_helper: RedisCache,
         song_repository: SongRepository = get_song_repository(),
     ) -> Files:
-        song_filename, song_url_key = await SongService._generate_file_key(song_file, MUSIC, SONGS)
-        photo_filename, photo_url_key = await SongService._generate_file_key(photo_file, IMAGES, SONGS)
+        (song_filename, song_url_key), (photo_filename, photo_url_key) = await asyncio.gather(
+            SongService._generate_file_key(song_file, MUSIC, SONGS),
+            SongService._generate_file_key(photo_file, IMAGES, SONGS),
+        )
+        song_metadata = await SongService._index_song_file(song_file)
 
-        async with S3Client() as s3_client:
-            await SongService._upload_file(s3_client, song_file, song_url_key, MUSIC)
-            await SongService._upload_file(s3_client, photo_file, photo_url_key, IMAGES)
+        await SongService._store_files(
+            session,
+            storage_helper,
+            [
+                (song_file, song_url_key, MUSIC),
+                (photo_file, photo_url_key, IMAGES),
+            ]
+        )
 
         song_in = SongIn(
             name=name,
@@ -83,13 +280,103 @@ class SongService(AbstractSongService, FileActionMixin):
             album_id=album_id,
             file_url=song_url_key,
             photo_url=photo_url_key,
+            **song_metadata,
         )
 
-        song: Song = await song_repository.create_song(session=session, song_in=song_in)
+        try:
+            song: Song = await song_repository.create_song(session=session, song_in=song_in)
+        except Exception:
+            await SongService._release_files(session, [song_url_key, photo_url_key])
+            raise
         song_schema: SongOut = SongOut.model_validate(song, from_attributes=True)
-        await redis_helper.set(key=f"song/{song.id}", value=song_schema.model_dump())
+        # В альбоме новая песня
+        await redis_helper.invalidate([album_songs_ref(song.album_id)])
+        await redis_helper.set(
+            key=f"song/{song.id}", 
+            value=cached_entity(song_schema), 
+            codec=ResponseCodec(),
+            dependencies=song_dependencies(song)
+        )
+        await redis_helper.bump_generations(song_generations(song))
+        await SongService._schedule_image_derivatives([photo_url_key])
+        await SongService._schedule_task(segment_song_file, song_url_key)
+        await SongService._schedule_task(generate_song_waveform, song_url_key)
         return Files(song_filename=song_filename, photo_filename=photo_filename)
 
+    @staticmethod
+    @check_user_role
+    async def create_upload_urls(
+        user: UserOut,
+        redis_helper: RedisCache,
+        song_upload_in: SongUploadIn,
+    ) -> SongUploadUrls:
+        song, photo = await asyncio.gather(
+            SongService._create_upload_url(storage_helper, redis_helper, song_upload_in.song_file_name, MUSIC, SONGS, user.id),
+            SongService._create_upload_url(storage_helper, redis_helper, song_upload_in.photo_file_name, IMAGES, SONGS, user.id),
+        )
+        return SongUploadUrls(song=song, photo=photo)
+
+    @staticmethod
+    @check_user_role
+    async def complete_upload(
+        session: AsyncSession,
+        user: UserOut,
+        redis_helper: RedisCache,
+        upload_complete: SongUploadComplete,
+        song_repository: SongRepository = get_song_repository(),
+    ) -> Files:
+        song_key, photo_key = upload_complete.song_key, upload_complete.photo_key
+        results = await asyncio.gather(
+            SongService._verify_uploaded_file(storage_helper, redis_helper, song_key, MUSIC, SONGS, user.id),
+            SongService._verify_uploaded_file(storage_helper, redis_helper, photo_key, IMAGES, SONGS, user.id),
+            return_exceptions=True
+        )
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            # Непрошедший проверку объект уже удален. Прошедший не удаляется сразу:
+            # его ссылка регистрируется и освобождается, и объект удаляет сборщик
+            # мусора (music.tasks) через retire_delay, как и при ошибке create_song ниже
+            verified_keys = [
+                key for key, result in zip([song_key, photo_key], results)
+                if not isinstance(result, BaseException)
+            ]
+            if verified_keys:
+                await SongService._register_files(session, verified_keys)
+                await SongService._release_files(session, verified_keys)
+            raise errors[0]
+        await SongService._register_files(session, [song_key, photo_key])
+
+        song_in = SongIn(
+            name=upload_complete.name,
+            genre=upload_complete.genre,
+            artist_id=user.id,
+            album_id=upload_complete.album_id,
+            file_url=song_key,
+            photo_url=photo_key,
+        )
+
+        try:
+            song: Song = await song_repository.create_song(session=session, song_in=song_in)
+        except Exception:
+            await SongService._release_files(session, [song_key, photo_key])
+            raise
+        song_schema: SongOut = SongOut.model_validate(song, from_attributes=True)
+        # В альбоме новая песня
+        await redis_helper.invalidate([album_songs_ref(song.album_id)])
+        await redis_helper.set(
+            key=f"song/{song.id}", 
+            value=cached_entity(song_schema), 
+            codec=ResponseCodec(),
+            dependencies=song_dependencies(song)
+        )
+        await redis_helper.bump_generations(song_generations(song))
+        await SongService._schedule_image_derivatives([photo_key])
+        # Файл не проходил через API - индекс кадров строит воркер
+        await SongService._schedule_task(index_song_file, song.id)
+        await SongService._schedule_task(segment_song_file, song_key)
+        await SongService._schedule_task(generate_song_waveform, song_key)
+        return Files(song_filename=song_key.split('/')[-1], photo_filename=photo_key.split('/')[-1])
+
     @staticmethod
     @check_user_role
     async def update_song(
@@ -104,29 +391,57 @@ class SongService(AbstractSongService, FileActionMixin):
         song_repository: SongRepository = get_song_repository(),
     ) -> Files:
         song_to_update: SongOut = await song_repository.get_song_by_id(session=session, song_id=song_id)
+        # До изменения: запись из той же сессии, после update_song в ней уже новый жанр
+        old_generations = song_generations(song_to_update)
 
         song_filename, song_url_key = None, None
         photo_filename, photo_url_key = None, None
 
-        async with S3Client() as s3_client:
-            if song_file:
-                song_filename, song_url_key = await SongService._generate_file_key(song_file, MUSIC, SONGS)
-                await SongService._update_file(s3_client, song_file, song_to_update.file_url, song_url_key, MUSIC)
+        uploads, old_keys, song_metadata = [], [], {}
+        if song_file:
+            song_filename, song_url_key = await SongService._generate_file_key(song_file, MUSIC, SONGS)
+            song_metadata = await SongService._index_song_file(song_file)
+            uploads.append((song_file, song_url_key, MUSIC))
+            old_keys.append(song_to_update.file_url)
 
-            if photo_file:
-                photo_filename, photo_url_key = await SongService._generate_file_key(photo_file, IMAGES, SONGS)
-                await SongService._update_file(s3_client, photo_file, song_to_update.photo_url, photo_url_key, IMAGES)
+        if photo_file:
+            photo_filename, photo_url_key = await SongService._generate_file_key(photo_file, IMAGES, SONGS)
+            uploads.append((photo_file, photo_url_key, IMAGES))
+            old_keys.append(song_to_update.photo_url)
+
+        # Новые файлы загружаются до изменения записи, старые освобождаются после
+        await SongService._store_files(session, storage_helper, uploads)
 
         song_update = SongUpdate(
             name=name or song_to_update.name,
             genre=genre or song_to_update.genre,
             file_url=song_url_key or song_to_update.file_url,
             photo_url=photo_url_key or song_to_update.photo_url,
+            **song_metadata,
         )
         
-        song: Song = await song_repository.update_song(session=session, song_id=song_id, song_update=song_update)
+        try:
+            song: Song = await song_repository.update_song(session=session, song_id=song_id, song_update=song_update)
+        except Exception:
+            await SongService._release_files(session, [key for _, key, _ in uploads])
+            raise
+        await SongService._release_files(session, old_keys)
         song_schema: SongOut = SongOut.model_validate(song, from_attributes=True)
-        await redis_helper.set(key=f"song/{song.id}", value=song_schema.model_dump())
+        # Песня есть и в ответе своего альбома
+        await redis_helper.invalidate([song_ref(song.id)])
+        await redis_helper.set(
+            key=f"song/{song.id}", 
+            value=cached_entity(song_schema), 
+            codec=ResponseCodec(),
+            dependencies=song_dependencies(song)
+        )
+        # Жанр мог смениться - сбрасываем выборки и старого, и нового
+        await redis_helper.bump_generations(old_generations | song_generations(song))
+        if photo_url_key:
+            await SongService._schedule_image_derivatives([photo_url_key])
+        if song_url_key:
+            await SongService._schedule_task(segment_song_file, song_url_key)
+            await SongService._schedule_task(generate_song_waveform, song_url_key)
         return Files(song_filename=song_filename, photo_filename=photo_filename)
 
     @staticmethod
@@ -140,13 +455,14 @@ class SongService(AbstractSongService, FileActionMixin):
     ) -> None:
         song: Song = await song_repository.get_song_by_id(session=session, song_id=song_id)
         
-        async with S3Client() as s3_client:
-            await SongService._delete_file(s3_client, song.file_url)
-            await SongService._delete_file(s3_client, song.photo_url)
-
-        await redis_helper.delete(f"song/{song.id}")
+        file_keys = [song.file_url, song.photo_url]
+        generations = song_generations(song)
 
         await song_repository.delete_song(session=session, song_id=song_id)
+        await redis_helper.invalidate([song_ref(song.id), album_songs_ref(song.album_id)])
+        await redis_helper.bump_generations(generations)
+
+        await SongService._release_files(session, file_keys)
 
 
 # Зависимость для получения сервиса
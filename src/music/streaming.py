@@ -0,0 +1,121 @@
+import hashlib
+import re
+from datetime import timezone
+from email.utils import format_datetime
+
+from fastapi import Response
+from fastapi.responses import FileResponse, StreamingResponse
+from pydantic import BaseModel
+
+from cache_codec import CachedResponse
+from storage import FileStream
+
+
+# Ключи по содержимому неизменны: ответ можно кэшировать в браузере и CDN сколько угодно
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Ответ по адресу может смениться (готова копия, заменен файл песни) - недолго и с перепроверкой по ETag
+SHORT_CACHE_CONTROL = 'public, max-age=60'
+# JSON сущностей клиент хранит, но каждый раз сверяет по ETag: ответ 304 дешевле тела
+ENTITY_CACHE_CONTROL = 'no-cache'
+
+# Поддерживаем только один диапазон: bytes=first-last, bytes=first- или bytes=-suffix
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_range_header(range_header: str | None) -> str | None:
+    """Возвращает нормализованный заголовок Range или None, если его нужно проигнорировать."""
+    if not range_header:
+        return None
+    match = RANGE_PATTERN.match(range_header.replace(' ', ''))
+    if not match:
+        # Несколько диапазонов или чужие единицы - отдаем файл целиком (RFC 9110, 14.2)
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if first and last and int(first) > int(last):
+        return None
+    return f'bytes={first}-{last}'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    # If-None-Match сравнивается слабо (RFC 9110, 13.1.2): W/"x" совпадает с "x"
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+    return etag.removeprefix('W/') in tags
+
+
+def body_etag(body: bytes) -> str:
+    # По телу, а не по updated_at: в JSON вложены альбом, исполнитель и песни,
+    # которые меняются, не трогая updated_at самой сущности
+    return f'W/"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+def cached_entity(schema: BaseModel) -> CachedResponse:
+    """JSON сущности для кэша: сериализуется один раз при записи, а не на каждый GET."""
+    body = schema.model_dump_json().encode()
+    return CachedResponse(body=body, etag=body_etag(body))
+
+
+def cached_batch_response(cached: list[CachedResponse]) -> CachedResponse:
+    """JSON-массив из готовых тел сущностей - без разбора и повторной сериализации."""
+    body = b'[' + b','.join(item.body for item in cached) + b']'
+    return CachedResponse(body=body, etag=body_etag(body))
+
+
+def cached_entity_response(cached: CachedResponse, if_none_match: str | None) -> Response:
+    if etag_matches(if_none_match, cached.etag):
+        return not_modified_response(cached.etag, ENTITY_CACHE_CONTROL)
+    return Response(
+        content=cached.body,
+        media_type='application/json',
+        headers={'ETag': cached.etag, 'Cache-Control': ENTITY_CACHE_CONTROL}
+    )
+
+
+def not_modified_response(etag: str, cache_control: str | None = None) -> Response:
+    headers = {'ETag': etag}
+    if cache_control:
+        headers['Cache-Control'] = cache_control
+    return Response(status_code=304, headers=headers)
+
+
+def media_stream_response(
+    stream: FileStream, 
+    file_name: str, 
+    cache_control: str | None = None,
+) -> StreamingResponse | FileResponse | Response:
+    if stream.not_modified:
+        return not_modified_response(stream.etag, cache_control)
+
+    headers = {
+        'Content-Disposition': f'attachment;filename={file_name}',
+        'Accept-Ranges': 'bytes',
+        'Content-Length': str(stream.content_length),
+    }
+    if cache_control:
+        headers['Cache-Control'] = cache_control
+    if stream.etag:
+        headers['ETag'] = stream.etag
+    if stream.last_modified:
+        headers['Last-Modified'] = format_datetime(stream.last_modified.astimezone(timezone.utc), usegmt=True)
+    if stream.content_range:
+        headers['Content-Range'] = stream.content_range
+
+    if stream.path:
+        # Файл на локальном диске (кэш или LocalStorage): сервер с расширением pathsend отдает его через sendfile
+        return FileResponse(
+            path=stream.path,
+            media_type='application/octet-stream',
+            headers=headers,
+        )
+
+    return StreamingResponse(
+        content=stream.body,
+        status_code=206 if stream.content_range else 200,
+        media_type='application/octet-stream',
+        headers=headers,
+    )
@@ -1,10 +1,27 @@
+import asyncio
+import io
 import logging
+import mimetypes
 import smtplib
 from email.message import EmailMessage
 
 from celery import Celery
 
+from storage import storage_helper
 from config import settings
+from database import db_helper
+from music.constants import DELETE_BATCH_SIZE
+from music.cache_dependencies import song_ref
+from music.enums import ImageSize
+from music.hls import SEGMENT_PREFIX, segment_key, split_segments
+from music.images import DERIVATIVE_FORMATS, derivative_key, render_image_derivatives
+from music.list_cache import song_generations
+from music.mp3 import build_frame_index
+from music.repository.media_repository import MediaRepository, get_media_repository
+from music.repository.song_repository import SongRepository, get_song_repository
+from music.schemas import SongUpdate
+from music.waveform import WAVEFORM_DERIVATIVE, compute_peaks, waveform_key
+from redis_cache import redis_helper
 
 
 
@@ -13,6 +30,28 @@ celery_app = Celery(
     broker=f'redis://{settings.redis.host}:{settings.redis.port}/{settings.redis.first_db}'
 )
 
+# Объекты без ссылок удаляет только периодический проход: задачи с countdown на каждое
+# освобождение копились бы в памяти воркера и повторялись после visibility_timeout брокера
+celery_app.conf.beat_schedule = {
+    'delete-released-media': {
+        'task': 'music.tasks.delete_released_media',
+        'schedule': settings.aws.delete_interval,
+    },
+}
+
+
+async def _forget_derivatives(*keys: str) -> None:
+    # Закэшированный состав копий (см. FileActionMixin._get_download_key) изменился
+    await redis_helper.connect()
+    for key in keys:
+        await redis_helper.delete(f"derivatives/{key}")
+
+
+async def _disconnect() -> None:
+    # Соединения пулов привязаны к event loop, который закрывает asyncio.run
+    await db_helper.dispose()
+    await redis_helper.disconnect()
+
 
 def get_email_template_dashboard(username, email):
     email_message = EmailMessage()
@@ -42,9 +81,214 @@ def send_email_message_after_register_or_login(username, email):
     logging.info(f"Sending email to {email}")
 
 
+async def _delete_released_media(
+    media_repository: MediaRepository = get_media_repository(),
+) -> int:
+    deleted = 0
+    try:
+        while True:
+            async with db_helper.session_factory() as session:
+                media_objects = await media_repository.claim_released_objects(
+                    session=session, 
+                    limit=DELETE_BATCH_SIZE,
+                    retire_delay=settings.aws.retire_delay
+                )
+                if not media_objects:
+                    return deleted
+                # Вместе с файлом удаляются и его уменьшенные копии
+                storage_keys = {
+                    media_object.key: [media_object.key, *(media_object.derivatives or {}).values()]
+                    for media_object in media_objects
+                }
+                failed_keys = set(await storage_helper.delete_files(
+                    [key for keys in storage_keys.values() for key in keys]
+                ))
+                deleted_keys = [
+                    key for key, keys in storage_keys.items() 
+                    if failed_keys.isdisjoint(keys)
+                ]
+                await media_repository.forget_keys(session=session, keys=deleted_keys)
+            await _forget_derivatives(*deleted_keys)
+            deleted += len(deleted_keys)
+            if failed_keys:
+                # Оставшиеся ключи остаются в очереди, задача перезапустится с задержкой
+                raise RuntimeError(f"Could not remove {len(failed_keys)} files from storage")
+    finally:
+        await _disconnect()
+
+
+@celery_app.task(
+    autoretry_for=(Exception,),
+    retry_backoff=True,
+    retry_backoff_max=10 * 60,
+    max_retries=5,
+)
+def delete_released_media():
+    # Удаление объектов без ссылок: DELETE_BATCH_SIZE ключей на запрос delete_objects
+    deleted = asyncio.run(_delete_released_media())
+    logging.info(f"Deleted {deleted} released files from storage")
+
+
+async def _generate_image_derivatives(
+    key: str,
+    media_repository: MediaRepository = get_media_repository(),
+) -> None:
+    extension = key.rsplit('.', 1)[-1]
+    content_type, _ = mimetypes.guess_type(key)
+    try:
+        async with db_helper.session_factory() as session:
+            recorded = await media_repository.get_derivatives(session=session, key=key) or {}
+            if str(ImageSize.SMALL.value) in recorded:
+                return
+            data = await storage_helper.read_file(key)
+            derivatives = await asyncio.to_thread(render_image_derivatives, data, extension)
+            derivative_keys = {size: derivative_key(key, size) for size in derivatives}
+            await asyncio.gather(*(
+                storage_helper.put_file(derivative_keys[size], content, content_type)
+                for size, content in derivatives.items()
+            ))
+            if not await media_repository.add_derivatives(
+                session=session,
+                key=key,
+                derivatives={str(size.value): value for size, value in derivative_keys.items()}
+            ):
+                # Оригинал успели освободить, пока строились копии
+                await storage_helper.delete_files(list(derivative_keys.values()))
+                return
+            await _forget_derivatives(key)
+    finally:
+        await _disconnect()
+
 
+@celery_app.task(
+    autoretry_for=(Exception,),
+    retry_backoff=True,
+    max_retries=3,
+)
+def generate_image_derivatives(key: str):
+    # Уменьшенные копии обложки для списков и карточек: см. music.images
+    if key.rsplit('.', 1)[-1] not in DERIVATIVE_FORMATS:
+        return
+    asyncio.run(_generate_image_derivatives(key))
+    logging.info(f"Generated image derivatives for {key}")
+
+
+async def _index_song_file(
+    song_id: int,
+    song_repository: SongRepository = get_song_repository(),
+) -> None:
+    try:
+        async with db_helper.session_factory() as session:
+            song = await song_repository.get_song_by_id(session=session, song_id=song_id)
+            data = await storage_helper.read_file(song.file_url)
+            frame_index = await asyncio.to_thread(build_frame_index, io.BytesIO(data))
+            if frame_index is None:
+                logging.info(f"No MP3 frames found in {song.file_url}")
+                return
+            await song_repository.update_song(
+                session=session,
+                song_id=song_id,
+                song_update=SongUpdate(
+                    duration=frame_index.duration,
+                    bitrate=frame_index.bitrate,
+                    frame_index=frame_index.to_bytes(),
+                )
+            )
+            # duration и bitrate есть в SongOut: сбрасываем песню, альбомы с ней и выборки, как сервисы
+            await redis_helper.connect()
+            await redis_helper.invalidate([song_ref(song_id)])
+            await redis_helper.bump_generations(song_generations(song))
+    finally:
+        await _disconnect()
 
 
+@celery_app.task(
+    autoretry_for=(Exception,),
+    retry_backoff=True,
+    max_retries=3,
+)
+def index_song_file(song_id: int):
+    # Индекс кадров для песен, загруженных по presigned-ссылке мимо API
+    asyncio.run(_index_song_file(song_id))
+    logging.info(f"Indexed MP3 frames of song {song_id}")
+
 
+async def _segment_song_file(
+    key: str,
+    media_repository: MediaRepository = get_media_repository(),
+) -> None:
+    try:
+        async with db_helper.session_factory() as session:
+            recorded = await media_repository.get_derivatives(session=session, key=key) or {}
+            if any(name.startswith(SEGMENT_PREFIX) for name in recorded):
+                return
+            data = await storage_helper.read_file(key)
+            segments = await asyncio.to_thread(split_segments, data)
+            if not segments:
+                logging.info(f"No MP3 frames found in {key}")
+                return
+            segment_keys = [segment_key(key, index) for index in range(len(segments))]
+            await asyncio.gather(*(
+                storage_helper.put_file(storage_key, segment, 'audio/mpeg')
+                for storage_key, segment in zip(segment_keys, segments)
+            ))
+            if not await media_repository.add_derivatives(
+                session=session,
+                key=key,
+                derivatives={f"{SEGMENT_PREFIX}{index}": value for index, value in enumerate(segment_keys)}
+            ):
+                await storage_helper.delete_files(segment_keys)
+                return
+            await _forget_derivatives(key)
+    finally:
+        await _disconnect()
 
 
+@celery_app.task(
+    autoretry_for=(Exception,),
+    retry_backoff=True,
+    max_retries=3,
+)
+def segment_song_file(key: str):
+    # Сегменты для потокового воспроизведения: клиент качает только то, что слушает
+    asyncio.run(_segment_song_file(key))
+    logging.info(f"Segmented {key} for streaming")
+
+
+async def _generate_song_waveform(
+    key: str,
+    media_repository: MediaRepository = get_media_repository(),
+) -> None:
+    try:
+        async with db_helper.session_factory() as session:
+            recorded = await media_repository.get_derivatives(session=session, key=key) or {}
+            if WAVEFORM_DERIVATIVE in recorded:
+                return
+            data = await storage_helper.read_file(key)
+            peaks = await asyncio.to_thread(compute_peaks, data)
+            if peaks is None:
+                logging.info(f"Could not decode {key}")
+                return
+            peaks_key = waveform_key(key)
+            await storage_helper.put_file(peaks_key, peaks, 'application/octet-stream')
+            if not await media_repository.add_derivatives(
+                session=session,
+                key=key,
+                derivatives={WAVEFORM_DERIVATIVE: peaks_key}
+            ):
+                await storage_helper.delete_files([peaks_key])
+                return
+            await _forget_derivatives(key)
+    finally:
+        await _disconnect()
+
+
+@celery_app.task(
+    autoretry_for=(Exception,),
+    retry_backoff=True,
+    max_retries=3,
+)
+def generate_song_waveform(key: str):
+    # Волна для плеера: несколько КБ вместо декодирования всего файла в браузере
+    asyncio.run(_generate_song_waveform(key))
+    logging.info(f"Generated waveform for {key}")
@@ -1,8 +1,9 @@
 from typing import Any, Optional
 import logging
-from fastapi import Query
+from fastapi import HTTPException, Query, status
 from auth.custom_exceptions import not_enough_rights_exception
 from auth.enums import Role
+from music.constants import BATCH_MAX_IDS
 from music.enums import Genre
 
 
@@ -51,6 +52,24 @@ def get_album_filters(
     return filters
 
 
+def get_batch_ids(
+    ids: str = Query(description=f"Comma-separated ids, at most {BATCH_MAX_IDS}"),
+) -> list[int]:
+    try:
+        batch_ids = [int(value) for value in ids.split(",") if value.strip()]
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="ids must be comma-separated integers"
+        )
+    if not 0 < len(batch_ids) <= BATCH_MAX_IDS or min(batch_ids) <= 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Expected 1 - {BATCH_MAX_IDS} positive ids"
+        )
+    return batch_ids
+
+
 def check_user_role(func):
     async def wrapper(*args, **kwargs):
         user = kwargs.get("user")
@@ -0,0 +1,35 @@
+import miniaudio
+import numpy as np
+
+from music.constants import WAVEFORM_POINTS
+
+
+# имя волны в MediaObject.derivatives
+WAVEFORM_DERIVATIVE = 'waveform'
+
+
+def waveform_key(key: str) -> str:
+    # songs/music/ab/ab12....mp3 -> songs/music/ab/ab12.../waveform.bin
+    stem, _ = key.rsplit('.', 1)
+    return f"{stem}/waveform.bin"
+
+
+def compute_peaks(data: bytes, points: int = WAVEFORM_POINTS) -> bytes | None:
+    """
+    Декодирует песню в моно и сжимает ее до points пар (min, max).
+
+    Результат - 2 * points байт int8: min0, max0, min1, max1, ...
+    Плееру хватает их, чтобы нарисовать волну без загрузки самого файла.
+    None - файл не декодируется.
+    """
+    try:
+        decoded = miniaudio.decode(data, nchannels=1)
+    except miniaudio.DecodeError:
+        return None
+    samples = np.frombuffer(decoded.samples, dtype=np.int16)
+    if len(samples) < points:
+        samples = np.pad(samples, (0, points - len(samples)))
+    # Хвост, не делящийся на points, отбрасывается: это меньше одной точки
+    buckets = samples[:len(samples) // points * points].reshape(points, -1)
+    peaks = np.stack((buckets.min(axis=1), buckets.max(axis=1)), axis=1)
+    return (peaks >> 8).astype(np.int8).tobytes()
@@ -1,49 +1,545 @@
-import pickle
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Iterable
+from uuid import uuid4
 from pydantic import BaseModel
 import aioredis
+from aioredis.exceptions import LockError
+from prometheus_client import Counter
+from cache_codec import CODECS, Codec, CodecError, decode_entry, encode
 from config import settings
 import logging
 
 
+# канал, по которому узлы сообщают друг другу об измененных ключах
+INVALIDATION_CHANNEL = 'cache-invalidation'
+
+local_cache_requests = Counter(
+    'local_cache_requests_total',
+    'In-process cache lookups in front of Redis',
+    ['result']
+)
+cache_fills = Counter(
+    'cache_fills_total',
+    'Cache misses by how they were resolved: computed, stale, waited or timeout',
+    ['result']
+)
+
+# как часто ждущий пересчета чужим процессом проверяет ключ, секунды
+LOCK_POLL_INTERVAL = 0.05
+
+# счетчик изменений: invalidate увеличивает его и помечает им измененные сущности
+VERSION_KEY = 'cache-version'
+
+# Записать пересчитанное значение KEYS[1] и добавить его в множества зависимостей deps/.
+# KEYS: ключ, n меток changed/, n множеств deps/; ARGV: n, значение, EX, срок жизни deps/,
+# прочитанное значение ('' - ключа не было), VERSION_KEY на момент чтения. Не пишет,
+# если ключ изменился с момента чтения или какая-то из зависимостей изменилась позже.
+FILL = """
+local n = tonumber(ARGV[1])
+local version = tonumber(ARGV[6])
+for i = 2, n + 1 do
+    local changed = redis.call('GET', KEYS[i])
+    if changed and tonumber(changed) > version then return false end
+end
+local current = redis.call('GET', KEYS[1])
+if ARGV[5] == '' then
+    if current then return false end
+elseif current ~= ARGV[5] then
+    return false
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+for i = n + 2, 2 * n + 1 do
+    redis.call('SADD', KEYS[i], KEYS[1])
+    redis.call('EXPIRE', KEYS[i], ARGV[4])
+end
+return true
+"""
+
+# Увеличить KEYS[1] (VERSION_KEY), пометить его новым значением метки changed/ на ARGV[1]
+# секунд и удалить все ключи из множеств deps/.
+# KEYS: счетчик, n меток changed/, затем n множеств deps/ в том же порядке. Возвращает удаленные ключи.
+INVALIDATE = """
+local n = (#KEYS - 1) / 2
+local version = redis.call('INCR', KEYS[1])
+local deleted = {}
+for i = 2, n + 1 do
+    redis.call('SET', KEYS[i], version, 'EX', ARGV[1])
+    for _, key in ipairs(redis.call('SMEMBERS', KEYS[n + i])) do
+        table.insert(deleted, key)
+    end
+    redis.call('DEL', KEYS[n + i])
+end
+for _, key in ipairs(deleted) do
+    redis.call('DEL', key)
+end
+return deleted
+"""
+
+# Удалить KEYS[1], только если в нем ARGV[1]. Возвращает 1, если ключ удален.
+DELETE_IF_EQUAL = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class LocalCache:
+    """
+    Ограниченный по размеру и времени жизни LRU-кэш в памяти процесса.
+
+    Хранит закодированные значения: каждый get получает свою копию объекта.
+    """
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+
+    def get(self, key: str) -> bytes | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, data = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return data
+
+    def set(self, key: str, data: bytes) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, data)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
 class RedisCache:
-    def __init__(self, redis_url: str):
+    """
+    Один клиент Redis на всё приложение.
+
+    Клиент держит пул соединений: запрос берет готовое соединение из пула
+    и возвращает его, а не открывает новое TCP-соединение.
+
+    Ключи из local_namespaces дополнительно кэшируются в памяти процесса.
+    Запись и удаление таких ключей публикуются в INVALIDATION_CHANNEL, и
+    остальные процессы удаляют их у себя. Пока процесс не подписан на канал
+    (listener не запущен или соединение потеряно), локальный кэш не используется.
+
+    Значения кодируются codec (см. cache_codec), больше compress_threshold
+    байт - сжимаются. Для отдельного значения кодек можно передать в set.
+
+    Срок жизни ключа без явного expire задается по пространству имен (ttls).
+    После него значение stale_ttl секунд считается устаревшим: get_or_compute
+    отдает его, пока один процесс пересчитывает новое.
+
+    Значение может зависеть от других сущностей (песня - от альбома и
+    исполнителя): ключ записывается в множества deps/ этих сущностей, и
+    invalidate удаляет его вместе с ними, не дожидаясь срока жизни.
+    """
+    def __init__(
+        self,
+        redis_url: str,
+        max_connections: int | None = None,
+        socket_timeout: float | None = None,
+        socket_connect_timeout: float | None = None,
+        health_check_interval: int = 0,
+        local_cache_size: int = 0,
+        local_cache_ttl: float = 0,
+        local_namespaces: tuple[str, ...] = (),
+        codec: Codec | None = None,
+        compress_threshold: int = 0,
+        ttls: dict[str, int] | None = None,
+        default_ttl: int = 15,
+        stale_ttl: int = 0,
+        lock_timeout: float = 10.0,
+        lock_wait: float = 1.0,
+    ):
         self.redis_url = redis_url
+        self.max_connections = max_connections
+        self.socket_timeout = socket_timeout
+        self.socket_connect_timeout = socket_connect_timeout
+        self.health_check_interval = health_check_interval
         self.redis = None
+        self.codec = codec or CODECS['orjson']()
+        self.compress_threshold = compress_threshold
+        self.ttls = ttls or {}
+        self.default_ttl = default_ttl
+        self.stale_ttl = stale_ttl
+        self.lock_timeout = lock_timeout
+        self.lock_wait = lock_wait
+        self.local_cache = LocalCache(max_size=local_cache_size, ttl=local_cache_ttl)
+        self.local_namespaces = local_namespaces
+        # свои сообщения об инвалидации процесс пропускает
+        self.instance_id = uuid4().hex
+        self._listener: asyncio.Task | None = None
+        self._subscribed = False
+        # счетчик инвалидаций: ответ Redis, прочитанный до инвалидации, в локальный кэш не кладется
+        self._invalidations = 0
 
     async def connect(self):
-        self.redis = await aioredis.from_url(self.redis_url)
+        if self.redis is not None:
+            return
+        # from_url ничего не ждет: соединения открываются пулом по мере надобности
+        self.redis = aioredis.from_url(
+            self.redis_url,
+            max_connections=self.max_connections,
+            socket_timeout=self.socket_timeout,
+            socket_connect_timeout=self.socket_connect_timeout,
+            health_check_interval=self.health_check_interval,
+        )
         logging.info("Redis connected!")
 
+    def start_invalidation_listener(self) -> None:
+        if self._listener is None and self.local_cache.max_size > 0:
+            self._listener = asyncio.create_task(self._listen_invalidations())
+
+    async def _listen_invalidations(self) -> None:
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                self._subscribed = True
+                logging.info("Redis invalidation listener subscribed")
+                while True:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if message and message['type'] == 'message':
+                        origin, key = message['data'].decode().split(' ', 1)
+                        if origin != self.instance_id:
+                            self._invalidations += 1
+                            self.local_cache.delete(key)
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                logging.error(f"Redis invalidation listener failed: {err}")
+            finally:
+                # Пропущенные сообщения не восстановить - локальный кэш сбрасывается целиком
+                self._subscribed = False
+                self._invalidations += 1
+                self.local_cache.clear()
+                await pubsub.close()
+            await asyncio.sleep(1)
+
+    def _is_local(self, key: str) -> bool:
+        return self._subscribed and key.startswith(self.local_namespaces)
+
+    async def _invalidate(self, key: str) -> None:
+        await self._invalidate_many([key])
+
+    async def _invalidate_many(self, keys: list[str]) -> None:
+        self._invalidations += 1
+        local_keys = [key for key in keys if key.startswith(self.local_namespaces)]
+        for key in local_keys:
+            self.local_cache.delete(key)
+        if local_keys:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key in local_keys:
+                    pipe.publish(INVALIDATION_CHANNEL, f"{self.instance_id} {key}")
+                await pipe.execute()
+
     async def disconnect(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
         if self.redis:
             await self.redis.close()
+            await self.redis.connection_pool.disconnect()
+            self.redis = None
             logging.info("Redis disconnected!")
 
-    async def get(self, key: int):
-        data = await self.redis.get(key)
-        if data:
+    @staticmethod
+    def _decode(key: str, data: bytes) -> tuple:
+        try:
+            return decode_entry(data)
+        except CodecError:
+            # Значение старого формата (до заголовка кодека) считается промахом
+            logging.warning("Redis key %s has unknown format", key)
+            return None, None
+
+    async def get_many(self, keys: list[str]) -> tuple[list[tuple], int | None]:
+        """
+        Для каждого ключа - закодированное значение, само значение и время, до которого
+        оно свежее, а также VERSION_KEY, прочитанный вместе с ними (None, если Redis
+        не понадобился).
+
+        Ключи, которых нет в локальном кэше, читаются одним MGET.
+        """
+        entries: list[tuple] = [(None, None, None)] * len(keys)
+        remote = []
+        for index, key in enumerate(keys):
+            if self._is_local(key):
+                if (data := self.local_cache.get(key)) is not None:
+                    local_cache_requests.labels(result='hit').inc()
+                    entries[index] = (data, *self._decode(key, data))
+                    continue
+                local_cache_requests.labels(result='miss').inc()
+            remote.append(index)
+        if not remote:
+            return entries, None
+        invalidations = self._invalidations
+        version, *values = await self.redis.mget(VERSION_KEY, *(keys[index] for index in remote))
+        for index, data in zip(remote, values):
+            key = keys[index]
+            if not data:
+                logging.info("Redis didnt found key %s", key)
+                continue
             logging.info("Redis found key %s", key)
-            return pickle.loads(data)
-        logging.info("Redis didnt found key %s", key)
-        return None
+            if self._is_local(key) and self._invalidations == invalidations:
+                self.local_cache.set(key, data)
+            entries[index] = (data, *self._decode(key, data))
+        return entries, int(version or 0)
+
+    async def version(self) -> int:
+        # Читается до пересчета: см. fill_many
+        return int(await self.redis.get(VERSION_KEY) or 0)
+
+    async def _get_entry(self, key: str) -> tuple:
+        entries, _ = await self.get_many([key])
+        return entries[0]
+
+    async def get(self, key: int):
+        # Устаревшее по мягкому сроку значение тоже возвращается: обновляет его get_or_compute
+        _, value, _ = await self._get_entry(key)
+        return value
+
+    def _ttl(self, key: str) -> int:
+        for namespace, ttl in self.ttls.items():
+            if key.startswith(namespace):
+                return ttl
+        return self.default_ttl
+
+    def _encode(self, key: str, value, expire: int | None, codec: Codec | None) -> tuple[bytes, int]:
+        """
+        Значение для записи и полный срок жизни ключа.
+
+        Без явного expire срок берется по пространству имен ключа, и значение
+        еще stale_ttl секунд после него хранится устаревшим. Явный expire -
+        жесткий срок: такие значения (ссылки, токены загрузки) после него не отдаются.
+        """
+        if expire is not None:
+            return encode(value, codec or self.codec, self.compress_threshold), expire
+        ttl = self._ttl(key)
+        fresh_until = time.time() + ttl
+        return encode(value, codec or self.codec, self.compress_threshold, fresh_until), ttl + self.stale_ttl
     
-    async def set(self, key: int, value: dict):
-        await self.redis.set(key, pickle.dumps(value))
-        await self.redis.expire(key, 15)
-        logging.info("Redis set key %s value %s", key, value)
+    async def set(
+        self, 
+        key: int, 
+        value: dict, 
+        expire: int | None = None, 
+        codec: Codec | None = None,
+        dependencies: Iterable[str] = (),
+    ):
+        data, expire = self._encode(key, value, expire, codec)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            # SET EX - одна команда: ключ не может остаться без срока жизни
+            pipe.set(key, data, ex=expire)
+            for dependency in dependencies:
+                pipe.sadd(f"deps/{dependency}", key)
+                pipe.expire(f"deps/{dependency}", self.dependency_ttl)
+            await pipe.execute()
+        await self._invalidate(key)
+        logging.info("Redis set key %s (%s bytes, %s s)", key, len(data), expire)
+
+    @property
+    def dependency_ttl(self) -> int:
+        # Множество deps/ живет не меньше самого долгого ключа, который в нем может быть
+        return max((*self.ttls.values(), self.default_ttl)) + self.stale_ttl
+
+    async def fill_many(self, entries: list[tuple], version: int, codec: Codec | None = None) -> None:
+        """
+        Записывает пересчитанные значения одним пайплайном.
+
+        entries - (ключ, значение, зависимости, прочитанное закодированное значение
+        или None), version - VERSION_KEY, прочитанный до пересчета. Значение
+        записывается, только если за время пересчета ничего не изменилось: запрос
+        на изменение мог записать в ключ более новое или изменить одну из зависимостей
+        (ее метка changed/ больше version) - тогда значение уже устарело и в кэш
+        не попадает. Пересчет, начатый после изменения, записывается сразу.
+        """
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key, value, dependencies, expected in entries:
+                data, expire = self._encode(key, value, None, codec)
+                pipe.eval(
+                    FILL,
+                    1 + 2 * len(dependencies),
+                    key,
+                    *(f"changed/{dependency}" for dependency in dependencies),
+                    *(f"deps/{dependency}" for dependency in dependencies),
+                    len(dependencies), data, expire, self.dependency_ttl, expected or b'', version,
+                )
+            results = await pipe.execute()
+        stored = [key for (key, *_), result in zip(entries, results) if result]
+        if stored:
+            await self._invalidate_many(stored)
+            logging.info("Redis filled keys %s", stored)
+
+    async def single_flight(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[Any]],
+        accept: Callable[[Any], bool] = lambda value: True,
+        stale: Any = None,
+    ) -> Any:
+        """
+        Пересчет значения key одним процессом вместо всех, кто его не нашел.
+
+        Процесс, взявший блокировку lock/{key}, вызывает compute. Остальные
+        получают stale, если он есть, иначе до lock_wait секунд ждут, пока
+        в Redis появится значение, подходящее по accept. Не дождались -
+        считают сами: держатель блокировки мог упасть.
+        """
+        lock = self.redis.lock(f"lock/{key}", timeout=self.lock_timeout)
+        if await lock.acquire(blocking=False):
+            cache_fills.labels(result='computed').inc()
+            try:
+                return await compute()
+            finally:
+                try:
+                    await lock.release()
+                except LockError:
+                    # Блокировка истекла раньше, чем закончился пересчет
+                    logging.warning("Redis lock for key %s expired before release", key)
+        if stale is not None:
+            cache_fills.labels(result='stale').inc()
+            return stale
+        deadline = time.monotonic() + self.lock_wait
+        while time.monotonic() < deadline:
+            await asyncio.sleep(LOCK_POLL_INTERVAL)
+            _, value, _ = await self._get_entry(key)
+            if value is not None and accept(value):
+                cache_fills.labels(result='waited').inc()
+                return value
+        cache_fills.labels(result='timeout').inc()
+        return await compute()
+
+    async def get_or_compute(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[Any]],
+        codec: Codec | None = None,
+    ) -> Any:
+        """
+        Значение key из кэша или из compute с защитой от одновременных пересчетов.
+
+        Свежее значение возвращается сразу. Устаревшее (после мягкого срока,
+        но до удаления ключа) пересчитывает один процесс, остальные получают
+        его без ожидания. Отсутствующее считает один процесс, остальные ждут.
+
+        compute возвращает значение и сущности, от которых оно зависит
+        (см. invalidate), например ('album/1', 'user/2').
+        """
+        [(data, value, fresh_until)], version = await self.get_many([key])
+        if value is not None and (fresh_until is None or time.time() < fresh_until):
+            return value
+
+        async def recompute():
+            captured = version if version is not None else await self.version()
+            computed, dependencies = await compute()
+            await self.fill_many(
+                [(key, computed, list(dependencies), data if value is not None else None)],
+                captured,
+                codec
+            )
+            return computed
+
+        return await self.single_flight(key, recompute, stale=value)
 
     async def delete(self, key: int):
         await self.redis.delete(key)
+        await self._invalidate(key)
         logging.info("Redis delete key %s", key)
 
+    async def delete_if_equal(self, key: str, value, codec: Codec | None = None) -> bool:
+        """
+        Удаляет key, только если в нем value, записанное через set с явным expire.
+
+        Сравнение и удаление - один скрипт: из одновременных запросов ключ
+        получает ровно один (например, токен загрузки используется один раз).
+        """
+        data = encode(value, codec or self.codec, self.compress_threshold)
+        deleted = await self.redis.eval(DELETE_IF_EQUAL, 1, key, data)
+        if deleted:
+            await self._invalidate(key)
+            logging.info("Redis delete key %s", key)
+        return bool(deleted)
+
+    async def invalidate(self, dependencies: Iterable[str]) -> list[str]:
+        """
+        Удаляет все ключи, записанные с зависимостью от dependencies, одним скриптом.
+
+        Зависимость - изменившаяся сущность: 'song/1', 'album/2', 'user/3'.
+        Ключи пересчитываются при следующем чтении. Метка changed/ хранит
+        новое значение VERSION_KEY: пересчет, прочитавший VERSION_KEY до изменения,
+        старое значение не запишет, а начатый после - запишет (см. fill_many).
+        """
+        dependencies = sorted(set(dependencies))
+        if not dependencies:
+            return []
+        deleted = [
+            key.decode() for key in await self.redis.eval(
+                INVALIDATE,
+                1 + 2 * len(dependencies),
+                VERSION_KEY,
+                *(f"changed/{dependency}" for dependency in dependencies),
+                *(f"deps/{dependency}" for dependency in dependencies),
+                self.dependency_ttl,
+            )
+        ]
+        await self._invalidate_many(deleted)
+        logging.info("Redis invalidated %s: deleted %s", dependencies, deleted)
+        return deleted
+
+    async def get_with_generations(self, key: str, generation_keys: list[str]) -> tuple:
+        """Значение key и текущие поколения generation_keys (нет ключа - 0) за один MGET."""
+        data, *generations = await self.redis.mget(key, *generation_keys)
+        value, _ = self._decode(key, data) if data else (None, None)
+        return value, [int(generation or 0) for generation in generations]
+
+    async def bump_generations(self, generation_keys: Iterable[str]) -> None:
+        # Счетчики без срока жизни: записи с устаревшим поколением просто перестают совпадать
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for generation_key in sorted(generation_keys):
+                pipe.incr(generation_key)
+            await pipe.execute()
+        logging.info("Redis bumped generations %s", sorted(generation_keys))
+
+
+redis_helper = RedisCache(
+    redis_url=f"redis://{settings.redis.host}:{settings.redis.port}/{settings.redis.second_db}",
+    max_connections=settings.redis.max_connections,
+    socket_timeout=settings.redis.socket_timeout,
+    socket_connect_timeout=settings.redis.socket_connect_timeout,
+    health_check_interval=settings.redis.health_check_interval,
+    local_cache_size=settings.redis.local_cache_size,
+    local_cache_ttl=settings.redis.local_cache_ttl,
+    local_namespaces=('song/', 'album/'),
+    codec=CODECS[settings.redis.codec](),
+    compress_threshold=settings.redis.compress_threshold,
+    ttls={
+        'song/': settings.redis.song_ttl,
+        'album/': settings.redis.album_ttl,
+        'list/': settings.redis.list_ttl,
+    },
+    stale_ttl=settings.redis.stale_ttl,
+    lock_timeout=settings.redis.lock_timeout,
+    lock_wait=settings.redis.lock_wait,
+)
+
 
 # Функция для зависимостей FastAPI
 async def get_redis_helper():
-    redis_helper = RedisCache(
-        redis_url=f"redis://{settings.redis.host}:{settings.redis.port}/{settings.redis.second_db}"
-    )
+    # Пул создается в lifespan; lazy connect - для запуска без lifespan (тесты через ASGITransport)
     await redis_helper.connect()
-    try:
-        yield redis_helper
-    finally:
-        await redis_helper.disconnect()
\ No newline at end of file
+    yield redis_helper
\ No newline at end of file
@@ -0,0 +1,4 @@
+__all__ = ("storage_helper", "StorageBackend", "FileStream")
+
+from .base import FileStream, StorageBackend
+from .storage import storage_helper
@@ -0,0 +1,147 @@
+import asyncio
+import mimetypes
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import AsyncIterator
+
+import magic
+from fastapi import HTTPException, UploadFile, status
+
+from music.constants import DOWNLOAD_CHUNK_SIZE, MAGIC_HEADER_SIZE
+
+
+@dataclass
+class FileStream:
+    body: AsyncIterator[bytes] | None
+    content_length: int
+    content_range: str | None = None
+    etag: str | None = None
+    last_modified: datetime | None = None
+    # локальный файл, который отдается целиком вместо body
+    path: Path | None = None
+    # клиент прислал актуальный If-None-Match: тело не нужно, ответ 304
+    not_modified: bool = False
+
+
+class StorageBackend(ABC):
+    """
+    Хранилище файлов: S3, MinIO или локальная файловая система.
+
+    Выбирается настройкой STORAGE__BACKEND, остальной код работает только
+    с этим интерфейсом.
+    """
+    # Файлы лежат на этой же машине - локальный кэш перед хранилищем не нужен
+    local: bool = False
+
+    def connect(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    async def get_file_type(
+        self,
+        file_name: str,
+        SUPPORTED_FILE_TYPES: dict
+    ) -> str:
+        # Получаем тип файла
+        file_type, _ = mimetypes.guess_type(file_name)
+
+        # Проверка, что этот тип есть в разрешенных типах файлов
+        if file_type not in SUPPORTED_FILE_TYPES:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f'Unsupported file type: {file_type}. Supported types are {SUPPORTED_FILE_TYPES}'
+            )
+        return SUPPORTED_FILE_TYPES[file_type]
+
+    @staticmethod
+    def sniff_content_type(header: bytes) -> str:
+        # У MP3 с большим тегом ID3v2 первый кадр дальше заголовка - узнаем файл по сигнатуре тега
+        if header.startswith(b'ID3'):
+            return 'audio/mpeg'
+        return magic.from_buffer(header, mime=True)
+
+    @staticmethod
+    def check_file_content(header: bytes, file_type: str, SUPPORTED_FILE_TYPES: dict) -> None:
+        """Сверяет тип по имени файла с типом по первым MAGIC_HEADER_SIZE байтам содержимого."""
+        content_type = StorageBackend.sniff_content_type(header[:MAGIC_HEADER_SIZE])
+        if SUPPORTED_FILE_TYPES.get(content_type) != file_type:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f'File content does not match its type: detected {content_type}, expected {file_type}'
+            )
+
+    @staticmethod
+    def check_file_size(size: int, file_type: str, max_file_size: int) -> None:
+        # Общая для бэкендов и для загрузок, размер которых известен до обращения к хранилищу
+        if not 0 < size <= max_file_size:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f'Supported {file_type} file size is 0 - {max_file_size} KB'
+            )
+
+    @abstractmethod
+    async def upload_file(self, file: UploadFile, key: str, SUPPORTED_FILE_TYPES: dict) -> None:
+        raise NotImplementedError
+
+    async def delete_file(self, key: str) -> None:
+        if await self.delete_files([key]):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Error during deletion file {key}"
+            )
+
+    @abstractmethod
+    async def delete_files(self, keys: list[str]) -> list[str]:
+        """Удаляет файлы и возвращает ключи, которые удалить не удалось."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def read_file(self, key: str, byte_range: str | None = None) -> bytes:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def put_file(self, key: str, content: bytes, content_type: str) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def head_file(self, key: str) -> dict:
+        """Метаданные в форме ответа head_object: ContentLength, ContentType, ETag, LastModified."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def generate_presigned_upload_url(self, key: str, content_type: str, expires_in: int) -> str:
+        raise NotImplementedError
+
+    @abstractmethod
+    def generate_presigned_download_url(self, key: str, file_name: str, expires_in: int) -> str:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def download_to_file(self, key: str, path: Path) -> tuple[str | None, datetime | None]:
+        """Копирует файл в path и возвращает его ETag и Last-Modified."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def stream_file(
+        self,
+        key: str,
+        byte_range: str | None = None,
+        if_range: str | None = None,
+    ) -> FileStream:
+        raise NotImplementedError
+
+    async def iter_file(self, key: str) -> AsyncIterator[bytes]:
+        """Файл целиком кусками по DOWNLOAD_CHUNK_SIZE, не загружая его в память."""
+        stream = await self.stream_file(key)
+        if stream.body is not None:
+            async for chunk in stream.body:
+                yield chunk
+            return
+        # Локальный файл отдается по пути
+        with open(stream.path, 'rb') as file:
+            while chunk := await asyncio.to_thread(file.read, DOWNLOAD_CHUNK_SIZE):
+                yield chunk
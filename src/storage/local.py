@@ -0,0 +1,238 @@
+import asyncio
+import logging
+import mimetypes
+import mmap
+import os
+import shutil
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import AsyncIterator
+from uuid import uuid4
+
+from fastapi import HTTPException, UploadFile, status
+
+from music.constants import DOWNLOAD_CHUNK_SIZE, MAX_FILE_SIZES, MULTIPART_CHUNK_SIZE
+from storage.base import FileStream, StorageBackend
+
+
+def _mmap_range(path: Path, start: int, end: int) -> AsyncIterator[bytes]:
+    async def iterate() -> AsyncIterator[bytes]:
+        with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for offset in range(start, end + 1, DOWNLOAD_CHUNK_SIZE):
+                yield mapped[offset:min(offset + DOWNLOAD_CHUNK_SIZE, end + 1)]
+    return iterate()
+
+
+def _range_is_current(if_range: str | None, etag: str | None, last_modified: datetime | None) -> bool:
+    if not if_range:
+        return True
+    if if_range.startswith('"'):
+        return etag is not None and if_range == etag
+    if if_range.startswith('W/') or last_modified is None:
+        return False
+    try:
+        return last_modified <= parsedate_to_datetime(if_range)
+    except (TypeError, ValueError):
+        return False
+
+
+def _resolve_range(byte_range: str, size: int) -> tuple[int, int]:
+    first, last = byte_range.removeprefix('bytes=').split('-')
+    if not first:
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start >= size:
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            detail='Requested range not satisfiable',
+            headers={'Content-Range': f'bytes */{size}'}
+        )
+    return start, end
+
+
+def local_file_stream(
+    path: Path,
+    size: int,
+    etag: str | None,
+    last_modified: datetime | None,
+    byte_range: str | None,
+    if_range: str | None,
+) -> FileStream:
+    """
+    Ответ по файлу на локальном диске.
+
+    Весь файл отдается по пути (FileResponse, sendfile), диапазон - кусками
+    из mmap без копирования файла в память процесса.
+    """
+    last_modified = last_modified or datetime.fromtimestamp(path.stat().st_mtime, tz=timezone.utc)
+
+    if not byte_range or not _range_is_current(if_range, etag, last_modified):
+        return FileStream(
+            body=None,
+            path=path,
+            content_length=size,
+            etag=etag,
+            last_modified=last_modified
+        )
+
+    start, end = _resolve_range(byte_range, size)
+    return FileStream(
+        body=_mmap_range(path, start, end),
+        content_length=end - start + 1,
+        content_range=f'bytes {start}-{end}/{size}',
+        etag=etag,
+        last_modified=last_modified,
+    )
+
+
+class LocalStorage(StorageBackend):
+    """
+    Файлы в каталоге на этой машине: для разработки и установок на одном сервере.
+
+    Ключ хранилища - относительный путь внутри каталога. Запись идет во
+    временный файл с атомарным переименованием, как в MediaCache.
+    """
+    local = True
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory).resolve()
+
+    def connect(self) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        path = (self.directory / key).resolve()
+        if not path.is_relative_to(self.directory) or path == self.directory:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f'Invalid file key {key}'
+            )
+        return path
+
+    def _existing_path(self, key: str) -> Path:
+        path = self._path(key)
+        if not path.is_file():
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f'File {key} not found'
+            )
+        return path
+
+    @staticmethod
+    def _etag(path: Path) -> tuple[str, datetime]:
+        # Содержимое по ключу не меняется, поэтому mtime и размера достаточно
+        stat = path.stat()
+        return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"', datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc)
+
+    @staticmethod
+    def _tmp_path(path: Path) -> Path:
+        # Свой временный файл у каждой записи: одинаковое содержимое могут загружать одновременно
+        return path.with_name(f'{path.name}.{os.getpid()}.{uuid4().hex[:8]}.tmp')
+
+    def _write(self, path: Path, content: bytes) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self._tmp_path(path)
+        try:
+            tmp_path.write_bytes(content)
+            os.replace(tmp_path, path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+    async def upload_file(
+        self,
+        file: UploadFile,
+        key: str,
+        SUPPORTED_FILE_TYPES: dict
+    ) -> None:
+        if not file:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail='No file found!!'
+            )
+        file_type = await self.get_file_type(file.filename, SUPPORTED_FILE_TYPES)
+        max_file_size = MAX_FILE_SIZES[file_type]
+        if file.size is not None:
+            self.check_file_size(file.size, file_type, max_file_size)
+
+        path = self._path(key)
+        chunk = await file.read(MULTIPART_CHUNK_SIZE)
+        self.check_file_content(chunk, file_type, SUPPORTED_FILE_TYPES)
+        logging.info(f'Saving {key} to {self.directory}')
+        await asyncio.to_thread(path.parent.mkdir, parents=True, exist_ok=True)
+        tmp_path = self._tmp_path(path)
+        size = 0
+        try:
+            with open(tmp_path, 'wb') as output:
+                while chunk:
+                    size += len(chunk)
+                    self.check_file_size(size, file_type, max_file_size)
+                    await asyncio.to_thread(output.write, chunk)
+                    chunk = await file.read(MULTIPART_CHUNK_SIZE)
+            self.check_file_size(size, file_type, max_file_size)
+            os.replace(tmp_path, path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+    async def delete_files(self, keys: list[str]) -> list[str]:
+        failed_keys = []
+        for key in keys:
+            try:
+                await asyncio.to_thread(self._path(key).unlink, missing_ok=True)
+            except (HTTPException, OSError) as err:
+                logging.error(f"Could not remove file {key}: {err}")
+                failed_keys.append(key)
+        return failed_keys
+
+    def _read(self, path: Path, byte_range: str | None) -> bytes:
+        with open(path, 'rb') as file:
+            if not byte_range:
+                return file.read()
+            start, end = _resolve_range(byte_range, os.fstat(file.fileno()).st_size)
+            file.seek(start)
+            return file.read(end - start + 1)
+
+    async def read_file(self, key: str, byte_range: str | None = None) -> bytes:
+        return await asyncio.to_thread(self._read, self._existing_path(key), byte_range)
+
+    async def put_file(self, key: str, content: bytes, content_type: str) -> None:
+        logging.info(f'Saving {key} ({len(content)} bytes) to {self.directory}')
+        await asyncio.to_thread(self._write, self._path(key), content)
+
+    async def head_file(self, key: str) -> dict:
+        path = self._existing_path(key)
+        etag, last_modified = self._etag(path)
+        return {
+            'ContentLength': path.stat().st_size,
+            'ContentType': mimetypes.guess_type(key)[0],
+            'ETag': etag,
+            'LastModified': last_modified,
+        }
+
+    def generate_presigned_upload_url(self, key: str, content_type: str, expires_in: int) -> str:
+        raise HTTPException(
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            detail='Direct uploads are not supported by local storage'
+        )
+
+    def generate_presigned_download_url(self, key: str, file_name: str, expires_in: int) -> str:
+        raise HTTPException(
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            detail='Direct downloads are not supported by local storage'
+        )
+
+    async def download_to_file(self, key: str, path: Path) -> tuple[str | None, datetime | None]:
+        source = self._existing_path(key)
+        await asyncio.to_thread(shutil.copyfile, source, path)
+        return self._etag(source)
+
+    async def stream_file(
+        self,
+        key: str,
+        byte_range: str | None = None,
+        if_range: str | None = None,
+    ) -> FileStream:
+        path = self._existing_path(key)
+        etag, last_modified = self._etag(path)
+        return local_file_stream(path, path.stat().st_size, etag, last_modified, byte_range, if_range)
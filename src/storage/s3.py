@@ -0,0 +1,361 @@
+import asyncio
+import boto3
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from functools import partial
+from pathlib import Path
+from typing import AsyncIterator
+from botocore.client import Config
+from fastapi import HTTPException, UploadFile, status
+from music.constants import DELETE_BATCH_SIZE, DOWNLOAD_CHUNK_SIZE, MAX_FILE_SIZES, MULTIPART_CHUNK_SIZE
+from botocore.exceptions import ClientError
+from storage.base import FileStream, StorageBackend
+
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(filename)s:%(lineno)s - %(asctime)s - %(levelname)s - %(message)s'
+)
+
+
+class S3Client(StorageBackend):
+    """
+    Один клиент S3 на всё приложение.
+
+    boto3 блокирующий, поэтому каждый запрос к S3 выполняется в ограниченном
+    пуле потоков, а не в event loop. Клиент boto3 (в отличие от resource)
+    потокобезопасен и держит пул HTTP-соединений размером max_pool_connections.
+    """
+    def __init__(
+        self,
+        bucket_name: str,
+        max_pool_connections: int = 50,
+        max_workers: int = 16,
+        endpoint_url: str | None = None,
+        addressing_style: str = 'auto',
+    ):
+        self.AWS_BUCKET_NAME = bucket_name
+        self.endpoint_url = endpoint_url
+        self.addressing_style = addressing_style
+        self.max_pool_connections = max_pool_connections
+        self.max_workers = max_workers
+        self._client = None
+        self._executor: ThreadPoolExecutor | None = None
+
+
+    def connect(self) -> None:
+        if self._client is None:
+            self._client = boto3.client(
+                's3',
+                endpoint_url=self.endpoint_url,
+                config=Config(
+                    signature_version='s3v4',
+                    max_pool_connections=self.max_pool_connections,
+                    s3={'addressing_style': self.addressing_style}
+                )
+            )
+            logging.info("S3 client created")
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix='s3'
+            )
+
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self._client = None
+        logging.info("S3 client closed")
+
+
+    @property
+    def client(self):
+        # Клиент создается лениво: lifespan не запускается, например, в тестах через ASGITransport
+        self.connect()
+        return self._client
+
+
+    async def _run(self, func, /, *args, **kwargs):
+        self.connect()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args, **kwargs))
+
+
+    async def __aenter__(self):
+        logging.info("Entering async context")
+        return self
+
+
+    async def __aexit__(self, exc_type, exc, tb):
+        logging.info("Exiting async context")
+
+
+    async def upload_file(
+        self,
+        file: UploadFile,
+        key: str,
+        SUPPORTED_FILE_TYPES: dict
+    ) -> None:
+        if not file:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail='No file found!!'
+            )
+        file_type = await self.get_file_type(file.filename, SUPPORTED_FILE_TYPES)
+        max_file_size = MAX_FILE_SIZES[file_type]
+
+        # Размер известен заранее (Content-Length части формы) - отклоняем файл до чтения
+        if file.size is not None:
+            self.check_file_size(file.size, file_type, max_file_size)
+
+        # Читаем файл частями, в памяти держим не больше одной части
+        chunk = await file.read(MULTIPART_CHUNK_SIZE)
+        # Содержимое проверяется по первым байтам, до отправки чего-либо в S3
+        self.check_file_content(chunk, file_type, SUPPORTED_FILE_TYPES)
+        if len(chunk) < MULTIPART_CHUNK_SIZE:
+            # Файл целиком помещается в одну часть - multipart не нужен
+            self.check_file_size(len(chunk), file_type, max_file_size)
+            logging.info(f'Uploading {key} to s3')
+            try:
+                await self._run(
+                    self.client.put_object,
+                    Bucket=self.AWS_BUCKET_NAME,
+                    Key=key,
+                    Body=chunk
+                )
+            except ClientError as err:
+                logging.error(str(err))
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Error during loading file {file.filename}"
+                )
+            return
+
+        logging.info(f'Uploading {key} to s3 in parts')
+        upload_id = (await self._run(
+            self.client.create_multipart_upload,
+            Bucket=self.AWS_BUCKET_NAME,
+            Key=key
+        ))['UploadId']
+        parts = []
+        size = 0
+        try:
+            while chunk:
+                size += len(chunk)
+                # Проверяем размер по мере поступления байтов
+                self.check_file_size(size, file_type, max_file_size)
+                part = await self._run(
+                    self.client.upload_part,
+                    Bucket=self.AWS_BUCKET_NAME,
+                    Key=key,
+                    UploadId=upload_id,
+                    PartNumber=len(parts) + 1,
+                    Body=chunk,
+                )
+                parts.append({'PartNumber': len(parts) + 1, 'ETag': part['ETag']})
+                chunk = await file.read(MULTIPART_CHUNK_SIZE)
+            await self._run(
+                self.client.complete_multipart_upload,
+                Bucket=self.AWS_BUCKET_NAME,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={'Parts': parts},
+            )
+        except (HTTPException, ClientError) as err:
+            logging.error(f'Aborting upload of {key}: {err}')
+            await self._run(
+                self.client.abort_multipart_upload,
+                Bucket=self.AWS_BUCKET_NAME,
+                Key=key,
+                UploadId=upload_id
+            )
+            if isinstance(err, HTTPException):
+                raise
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Error during loading file {file.filename}"
+            )
+
+    async def delete_files(self, keys: list[str]) -> list[str]:
+        """Удаляет объекты пачками по DELETE_BATCH_SIZE ключей и возвращает ключи, которые удалить не удалось."""
+        failed_keys = []
+        for start in range(0, len(keys), DELETE_BATCH_SIZE):
+            batch = keys[start:start + DELETE_BATCH_SIZE]
+            logging.info(f'Deleting {len(batch)} files from s3')
+            response = await self._run(
+                self.client.delete_objects,
+                Bucket=self.AWS_BUCKET_NAME,
+                Delete={
+                    'Objects': [{'Key': key} for key in batch],
+                    'Quiet': True
+                }
+            )
+            for error in response.get('Errors', []):
+                logging.error(f"Could not remove file {error['Key']}: {error.get('Message')}")
+                failed_keys.append(error['Key'])
+        return failed_keys
+
+
+    async def read_file(self, key: str, byte_range: str | None = None) -> bytes:
+        # Файл или его часть целиком в память - для проверок и обработки в фоновых задачах
+        try:
+            response = await self._run(
+                self.client.get_object, 
+                Bucket=self.AWS_BUCKET_NAME, 
+                Key=key, 
+                **({'Range': byte_range} if byte_range else {})
+            )
+        except ClientError as err:
+            if err.response['Error']['Code'] in ('NoSuchKey', '404'):
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=f"File {key} not found"
+                )
+            raise
+        return await self._run(response['Body'].read)
+
+    async def put_file(self, key: str, content: bytes, content_type: str) -> None:
+        logging.info(f'Uploading {key} ({len(content)} bytes) to s3')
+        await self._run(
+            self.client.put_object,
+            Bucket=self.AWS_BUCKET_NAME,
+            Key=key,
+            Body=content,
+            ContentType=content_type
+        )
+
+    async def head_file(self, key: str) -> dict:
+        try:
+            return await self._run(
+                self.client.head_object,
+                Bucket=self.AWS_BUCKET_NAME,
+                Key=key
+            )
+        except ClientError as err:
+            if err.response['Error']['Code'] in ('NoSuchKey', '404'):
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=f'File {key} not found'
+                )
+            raise
+
+
+    def generate_presigned_upload_url(self, key: str, content_type: str, expires_in: int) -> str:
+        # Подпись считается локально, запроса к S3 нет
+        return self.client.generate_presigned_url(
+            'put_object',
+            Params={
+                'Bucket': self.AWS_BUCKET_NAME,
+                'Key': key,
+                'ContentType': content_type,
+            },
+            ExpiresIn=expires_in
+        )
+
+
+    def generate_presigned_download_url(self, key: str, file_name: str, expires_in: int) -> str:
+        return self.client.generate_presigned_url(
+            'get_object',
+            Params={
+                'Bucket': self.AWS_BUCKET_NAME,
+                'Key': key,
+                'ResponseContentDisposition': f'attachment;filename={file_name}',
+            },
+            ExpiresIn=expires_in
+        )
+
+
+    def _download_to_file(self, key: str, path: Path) -> dict:
+        response = self.client.get_object(Bucket=self.AWS_BUCKET_NAME, Key=key)
+        with open(path, 'wb') as file:
+            for chunk in response['Body'].iter_chunks(DOWNLOAD_CHUNK_SIZE):
+                file.write(chunk)
+        return response
+
+
+    async def download_to_file(self, key: str, path: Path) -> tuple[str | None, datetime | None]:
+        try:
+            logging.info(f"Downloading file {key} from s3 to {path}")
+            response = await self._run(self._download_to_file, key, path)
+        except ClientError as err:
+            if err.response['Error']['Code'] in ('NoSuchKey', '404'):
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=f'File {key} not found'
+                )
+            raise
+        return response.get('ETag'), response.get('LastModified')
+
+
+    async def stream_file(
+        self,
+        key: str,
+        byte_range: str | None = None,
+        if_range: str | None = None,
+    ) -> FileStream:
+        params = {'Bucket': self.AWS_BUCKET_NAME, 'Key': key}
+        if byte_range:
+            params['Range'] = byte_range
+            # If-Range: отдаем диапазон, только если объект не изменился, иначе - весь файл
+            if if_range:
+                if if_range.startswith('W/'):
+                    params.pop('Range')
+                elif if_range.startswith('"'):
+                    params['IfMatch'] = if_range
+                else:
+                    try:
+                        params['IfUnmodifiedSince'] = parsedate_to_datetime(if_range)
+                    except (TypeError, ValueError):
+                        params.pop('Range')
+
+        try:
+            logging.info(f"Streaming file {key} from s3, range {params.get('Range')}")
+            response = await self._run(self.client.get_object, **params)
+        except ClientError as err:
+            code = err.response['Error']['Code']
+            if code in ('PreconditionFailed', '412'):
+                return await self.stream_file(key=key)
+            if code == 'InvalidRange':
+                size = (await self._run(
+                    self.client.head_object,
+                    Bucket=self.AWS_BUCKET_NAME,
+                    Key=key
+                ))['ContentLength']
+                raise HTTPException(
+                    status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                    detail='Requested range not satisfiable',
+                    headers={'Content-Range': f'bytes */{size}'}
+                )
+            if code in ('NoSuchKey', '404'):
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=f'File {key} not found'
+                )
+            logging.error(str(err))
+            raise
+
+        return FileStream(
+            body=self._iter_body(response['Body'], DOWNLOAD_CHUNK_SIZE),
+            content_length=response['ContentLength'],
+            content_range=response.get('ContentRange'),
+            etag=response.get('ETag'),
+            last_modified=response.get('LastModified'),
+        )
+
+
+    async def _iter_body(self, body, chunk_size: int) -> AsyncIterator[bytes]:
+        try:
+            while chunk := await self._run(body.read, chunk_size):
+                yield chunk
+        finally:
+            body.close()
+
+
+class MinioClient(S3Client):
+    """MinIO и другие S3-совместимые хранилища: свой адрес и адресация бакета в пути."""
+    def __init__(self, *args, endpoint_url: str, **kwargs):
+        super().__init__(*args, endpoint_url=endpoint_url, addressing_style='path', **kwargs)
@@ -0,0 +1,20 @@
+from config import settings
+from storage.base import StorageBackend
+from storage.local import LocalStorage
+from storage.s3 import MinioClient, S3Client
+
+
+def create_storage() -> StorageBackend:
+    if settings.storage.backend == 'local':
+        return LocalStorage(directory=settings.storage.directory)
+    options = dict(
+        bucket_name=settings.aws.bucket_name,
+        max_pool_connections=settings.aws.max_pool_connections,
+        max_workers=settings.aws.max_workers,
+    )
+    if settings.storage.backend == 'minio':
+        return MinioClient(endpoint_url=settings.aws.endpoint_url, **options)
+    return S3Client(endpoint_url=settings.aws.endpoint_url, **options)
+
+
+storage_helper = create_storage()
@@ -11,6 +11,7 @@ from database import db_helper
 from config import settings
 from database.models import Base
 from main import app
+from redis_cache import RedisCache, get_redis_helper
 
 # DATABASE
 DATABASE_URL_TEST = settings.db_test.url
@@ -27,8 +28,20 @@ async def override_get_async_session() -> AsyncGenerator[AsyncSession, None]:
         finally:
             await session.close()  # Закрытие сессии после использования
 
+async def override_get_redis_helper() -> AsyncGenerator[RedisCache, None]:
+    # Как NullPool для БД: у тестов разные event loop, соединения пула между ними не переносятся
+    redis_helper = RedisCache(
+        redis_url=f"redis://{settings.redis.host}:{settings.redis.port}/{settings.redis.second_db}"
+    )
+    await redis_helper.connect()
+    try:
+        yield redis_helper
+    finally:
+        await redis_helper.disconnect()
+
 app.dependency_overrides[db_helper.session_getter] = override_get_async_session
 app.dependency_overrides[db_helper.session_factory] = async_session_maker
+app.dependency_overrides[get_redis_helper] = override_get_redis_helper
 
 @pytest.fixture(autouse=True, scope='session')
 async def prepare_database():
@@ -46,6 +59,11 @@ async def prepare_database():
 
 client = TestClient(app)
 
+@pytest.fixture(scope="function")
+async def redis_helper() -> AsyncGenerator[RedisCache, None]:
+    async for redis_helper in override_get_redis_helper():
+        yield redis_helper
+
 @pytest.fixture(scope="session")
 async def ac() -> AsyncGenerator[AsyncClient, None]:
     transport = ASGITransport(app=app)
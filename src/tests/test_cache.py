@@ -0,0 +1,309 @@
+import asyncio
+import logging
+import pickle
+import time
+
+import pytest
+
+from cache_codec import (
+    COMPRESSED,
+    SOFT_TTL,
+    CachedResponse,
+    CodecError,
+    MsgpackCodec,
+    OrjsonCodec,
+    ResponseCodec,
+    decode,
+    decode_entry,
+    encode,
+)
+from redis_cache import INVALIDATION_CHANNEL, LocalCache, RedisCache
+
+VALUE = {'id': 1, 'name': 'song_name', 'genre': 'rock', 'duration': 215, 'tags': ['a', 'b']}
+
+
+@pytest.mark.parametrize('codec', [OrjsonCodec(), MsgpackCodec()])
+def test_codec_roundtrip(codec):
+    data = encode(VALUE, codec)
+    assert data[:2] == codec.tag + bytes([0])
+    assert decode(data) == VALUE
+
+    logging.info("Test 'codec_roundtrip' was successful")
+
+
+def test_response_codec_roundtrip():
+    cached = CachedResponse(body=b'{"id":1,"name":"a\\nb"}', etag='W/"abc"')
+    data = encode(cached, ResponseCodec())
+    assert data.startswith(b'r\x00W/"abc"\n')
+    assert decode(data) == cached
+
+    logging.info("Test 'response_codec_roundtrip' was successful")
+
+
+def test_codec_compression():
+    value = {'name': 'x' * 2000}
+    # Меньше порога - без сжатия, не меньше - zlib и флаг COMPRESSED
+    assert encode(VALUE, OrjsonCodec(), compress_threshold=1024)[1] == 0
+    data = encode(value, OrjsonCodec(), compress_threshold=1024)
+    assert data[1] == COMPRESSED
+    assert len(data) < 1024
+    assert decode(data) == value
+    # 0 - сжатие выключено
+    assert encode(value, OrjsonCodec())[1] == 0
+
+    logging.info("Test 'codec_compression' was successful")
+
+
+def test_codec_fresh_until():
+    fresh_until = time.time() + 60
+    data = encode({'name': 'x' * 2000}, OrjsonCodec(), compress_threshold=1024, fresh_until=fresh_until)
+    assert data[1] == COMPRESSED | SOFT_TTL
+    value, decoded_fresh_until = decode_entry(data)
+    assert value == {'name': 'x' * 2000}
+    assert decoded_fresh_until == fresh_until
+    assert decode_entry(encode(VALUE, OrjsonCodec()))[1] is None
+
+    logging.info("Test 'codec_fresh_until' was successful")
+
+
+@pytest.mark.parametrize('data', [
+    # pickle из кэша до смены формата и значение с тегом удаленного PickleCodec
+    pickle.dumps(VALUE),
+    b'p\x00' + pickle.dumps(VALUE),
+    b'z\x00{}',
+    b'j',
+    # Поврежденные данные с известным тегом
+    b'j\x00{"id": ',
+    b'j\x01not zlib',
+    b'j\x02\x00',
+])
+def test_unknown_cache_format_is_miss(data):
+    with pytest.raises(CodecError):
+        decode_entry(data)
+    # RedisCache считает такое значение промахом, а не ошибкой запроса
+    assert RedisCache._decode('song/1', data) == (None, None)
+
+    logging.info("Test 'unknown_cache_format_is_miss' was successful")
+
+
+class FakePubSub:
+    def __init__(self, messages: asyncio.Queue):
+        self.messages = messages
+
+    async def subscribe(self, channel: str) -> None:
+        assert channel == INVALIDATION_CHANNEL
+
+    async def get_message(self, ignore_subscribe_messages: bool, timeout: float):
+        try:
+            return await asyncio.wait_for(self.messages.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def close(self) -> None:
+        pass
+
+
+class FakeLock:
+    def __init__(self, locks: set, name: str):
+        self.locks = locks
+        self.name = name
+
+    async def acquire(self, blocking: bool) -> bool:
+        if self.name in self.locks:
+            return False
+        self.locks.add(self.name)
+        return True
+
+    async def release(self) -> None:
+        self.locks.discard(self.name)
+
+
+class FakeRedis:
+    """Канал инвалидации и MGET без сервера: before_reply вызывается, пока ответ MGET "в пути"."""
+    def __init__(self, values: dict[str, bytes]):
+        self.values = values
+        self.messages = asyncio.Queue()
+        self.before_reply = None
+        self.locks = set()
+        # disconnect() закрывает и клиента, и пул
+        self.connection_pool = self
+
+    def pubsub(self) -> FakePubSub:
+        return FakePubSub(self.messages)
+
+    def send(self, origin: str, key: str) -> None:
+        self.messages.put_nowait({'type': 'message', 'data': f"{origin} {key}".encode()})
+
+    def lock(self, name: str, timeout: float) -> "FakeLock":
+        return FakeLock(self.locks, name)
+
+    async def mget(self, *keys: str) -> list:
+        reply = [self.values.get(key) for key in keys]
+        if self.before_reply:
+            await self.before_reply()
+        return reply
+
+    async def close(self) -> None:
+        pass
+
+    async def disconnect(self) -> None:
+        pass
+
+
+async def wait_for(condition) -> None:
+    for _ in range(100):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError('Condition was not met')
+
+
+@pytest.fixture
+async def local_redis_helper():
+    redis_helper = RedisCache(
+        redis_url='redis://unused',
+        local_cache_size=10,
+        local_cache_ttl=60,
+        local_namespaces=('song/',),
+    )
+    redis_helper.redis = FakeRedis({'song/1': encode(VALUE, OrjsonCodec())})
+    redis_helper.start_invalidation_listener()
+    await wait_for(lambda: redis_helper._subscribed)
+    yield redis_helper
+    await redis_helper.disconnect()
+
+
+def test_local_cache_lru():
+    local_cache = LocalCache(max_size=2, ttl=60)
+    local_cache.set('song/1', b'1')
+    local_cache.set('song/2', b'2')
+    # Чтение делает ключ самым свежим - вытесняется song/2
+    assert local_cache.get('song/1') == b'1'
+    local_cache.set('song/3', b'3')
+    assert local_cache.get('song/2') is None
+    assert local_cache.get('song/1') == b'1'
+    assert local_cache.get('song/3') == b'3'
+
+    logging.info("Test 'local_cache_lru' was successful")
+
+
+def test_local_cache_ttl(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr(time, 'monotonic', lambda: now)
+    local_cache = LocalCache(max_size=10, ttl=5)
+    local_cache.set('song/1', b'1')
+    now += 4.9
+    assert local_cache.get('song/1') == b'1'
+    now += 0.2
+    assert local_cache.get('song/1') is None
+
+    logging.info("Test 'local_cache_ttl' was successful")
+
+
+async def test_invalidation_listener(local_redis_helper):
+    await local_redis_helper.get('song/1')
+    assert local_redis_helper.local_cache.get('song/1') is not None
+
+    # Свои сообщения процесс пропускает: он уже удалил ключ сам
+    local_redis_helper.redis.send(local_redis_helper.instance_id, 'song/1')
+    local_redis_helper.redis.send('other', 'song/2')
+    await wait_for(lambda: local_redis_helper.redis.messages.empty())
+    await asyncio.sleep(0.01)
+    assert local_redis_helper.local_cache.get('song/1') is not None
+
+    local_redis_helper.redis.send('other', 'song/1')
+    await wait_for(lambda: local_redis_helper.local_cache.get('song/1') is None)
+
+    logging.info("Test 'invalidation_listener' was successful")
+
+
+async def test_read_before_invalidation_is_not_cached_locally(local_redis_helper):
+    async def invalidate_in_flight():
+        # Пока ответ MGET идет, другой процесс меняет ключ
+        local_redis_helper.redis.send('other', 'song/1')
+        await wait_for(lambda: local_redis_helper.redis.messages.empty())
+        await asyncio.sleep(0.01)
+
+    local_redis_helper.redis.before_reply = invalidate_in_flight
+    # Значение возвращается, но в локальный кэш не попадает: оно могло устареть
+    assert await local_redis_helper.get('song/1') == VALUE
+    assert local_redis_helper.local_cache.get('song/1') is None
+
+    local_redis_helper.redis.before_reply = None
+    assert await local_redis_helper.get('song/1') == VALUE
+    assert local_redis_helper.local_cache.get('song/1') is not None
+
+    logging.info("Test 'read_before_invalidation_is_not_cached_locally' was successful")
+
+
+@pytest.fixture
+def flight_redis_helper(monkeypatch) -> RedisCache:
+    redis_helper = RedisCache(redis_url='redis://unused', ttls={'song/': 60}, lock_wait=0.2)
+    redis_helper.redis = FakeRedis({})
+
+    async def fill_many(entries: list[tuple], version: int, codec=None) -> None:
+        # Скрипт FILL требует Redis; здесь значение просто записывается свежим
+        for key, value, _, _ in entries:
+            redis_helper.redis.values[key] = encode(value, OrjsonCodec(), fresh_until=time.time() + 60)
+
+    monkeypatch.setattr(redis_helper, 'fill_many', fill_many)
+    return redis_helper
+
+
+def counting_compute(value: dict, delay: float = 0.05):
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        return value, ['song/1']
+    return compute, calls
+
+
+async def test_get_or_compute_serves_stale_while_refreshing(flight_redis_helper):
+    # Мягкий срок прошел, ключ еще не удален
+    flight_redis_helper.redis.values['song/1'] = encode(
+        {'version': 1}, OrjsonCodec(), fresh_until=time.time() - 1
+    )
+    compute, calls = counting_compute({'version': 2})
+    results = await asyncio.gather(*(flight_redis_helper.get_or_compute('song/1', compute) for _ in range(5)))
+    # Пересчитывает один процесс, остальные сразу получают старое значение
+    assert len(calls) == 1
+    assert sorted(result['version'] for result in results) == [1, 1, 1, 1, 2]
+    assert await flight_redis_helper.get_or_compute('song/1', compute) == {'version': 2}
+    assert len(calls) == 1
+
+    logging.info("Test 'get_or_compute_serves_stale_while_refreshing' was successful")
+
+
+async def test_get_or_compute_waits_for_lock_holder(flight_redis_helper):
+    compute, calls = counting_compute({'version': 1})
+    results = await asyncio.gather(*(flight_redis_helper.get_or_compute('song/1', compute) for _ in range(5)))
+    # Старого значения нет: остальные ждут, пока держатель блокировки запишет новое
+    assert len(calls) == 1
+    assert results == [{'version': 1}] * 5
+    assert not flight_redis_helper.redis.locks
+
+    logging.info("Test 'get_or_compute_waits_for_lock_holder' was successful")
+
+
+async def test_single_flight_computes_after_wait_timeout(flight_redis_helper):
+    # Держатель блокировки упал и значение не запишет
+    flight_redis_helper.redis.locks.add('lock/song/1')
+    compute, calls = counting_compute({'version': 1}, delay=0)
+    started = time.monotonic()
+    assert await flight_redis_helper.single_flight('song/1', compute) == ({'version': 1}, ['song/1'])
+    assert time.monotonic() - started >= flight_redis_helper.lock_wait
+    assert len(calls) == 1
+
+    # Значение, не подходящее по accept, ожидание тоже не прекращает
+    flight_redis_helper.redis.values['song/1'] = encode({'version': 0}, OrjsonCodec())
+    result = await flight_redis_helper.single_flight(
+        'song/1', 
+        compute, 
+        accept=lambda value: value['version'] > 0
+    )
+    assert result == ({'version': 1}, ['song/1'])
+    assert len(calls) == 2
+
+    logging.info("Test 'single_flight_computes_after_wait_timeout' was successful")
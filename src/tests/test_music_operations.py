@@ -1,9 +1,39 @@
+import io
 import logging
+import math
 import os
+import wave
+import zipfile
+
+import numpy as np
+from httpx import AsyncClient
+
+from music.constants import FRAME_INDEX_INTERVAL, SEGMENT_DURATION, WAVEFORM_POINTS
+from music.hls import build_playlist, split_segments
+from music.mp3 import FrameIndex, build_frame_index
+from music.waveform import compute_peaks
 
 file = {'photo_file': ('doberman1.jpg', open(os.path.join(os.path.dirname(__file__), 'content', 'doberman1.jpg'), 'rb'))}
 file_name = None
 
+# MPEG1 Layer III, 128 кбит/с, 44100 Гц без звука: кадр 417 байт, 1152 сэмпла
+MP3_FRAME = b'\xff\xfb\x90\x00' + bytes(413)
+
+
+def generate_mp3(seconds: float) -> bytes:
+    return MP3_FRAME * math.ceil(seconds * 44100 / 1152)
+
+
+def generate_wav(samples: list[int]) -> bytes:
+    # Моно 16 бит с частотой декодера: сэмплы доходят до compute_peaks без пересчета
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(44100)
+        wav.writeframes(np.array(samples, dtype='<i2').tobytes())
+    return buffer.getvalue()
+
 
 async def test_create_album(ac, login_user):
     logging.info("TOKEN BEFORE SENDING TO ENDPOINT: %s", login_user['access_token'])
@@ -76,6 +106,65 @@ async def test_download_album_photo(ac, ):
     logging.info("Test 'download_album_photo' was successful")
 
 
+async def test_download_album_photo_range(ac, ):
+    full_response = await ac.get(
+        url="/album/download/",
+        params={"file_name": file_name}
+    )
+    response = await ac.get(
+        url="/album/download/",
+        params={"file_name": file_name},
+        headers={"Range": "bytes=0-99"}
+    )
+    assert response.status_code == 206
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert response.headers['Content-Range'] == f'bytes 0-99/{len(full_response.content)}'
+    assert response.headers['Content-Length'] == '100'
+    assert response.content == full_response.content[:100]
+
+    logging.info("Test 'download_album_photo_range' was successful")
+
+
+async def test_download_album_photo_redirect(ac, ):
+    response = await ac.get(
+        url="/album/download/",
+        params={"file_name": file_name, "mode": "redirect"}
+    )
+    assert response.status_code == 302
+    assert file_name in response.headers['Location']
+
+    # Повторный запрос отдает ту же ссылку из кэша
+    cached_response = await ac.get(
+        url="/album/download/",
+        params={"file_name": file_name, "mode": "redirect"}
+    )
+    assert cached_response.headers['Location'] == response.headers['Location']
+
+    logging.info("Test 'download_album_photo_redirect' was successful")
+
+
+async def test_download_album_photo_thumbnail(ac, ):
+    full_response = await ac.get(
+        url="/album/download/",
+        params={"file_name": file_name}
+    )
+    # Пока воркер не построил копию, отдается оригинал
+    response = await ac.get(
+        url="/album/download/",
+        params={"file_name": file_name, "size": 64}
+    )
+    assert response.status_code == 200
+    assert int(response.headers['Content-Length']) <= int(full_response.headers['Content-Length'])
+
+    response = await ac.get(
+        url="/album/download/",
+        params={"file_name": file_name, "size": 100}
+    )
+    assert response.status_code == 422
+
+    logging.info("Test 'download_album_photo_thumbnail' was successful")
+
+
 files = {
     'photo_file': ('doberman1.jpg', open(os.path.join(os.path.dirname(__file__), 'content', 'doberman1.jpg'), 'rb')),
     'song_file': ('song.mp3', open(os.path.join(os.path.dirname(__file__), 'content', 'song.mp3'), 'rb'))
@@ -85,6 +174,30 @@ song_filename = None
 photo_filename = None
 
 
+async def test_create_song_with_renamed_file(ac, login_user):
+    headers = {"Authorization": f"Bearer {login_user['access_token']}"}
+    with open(os.path.join(os.path.dirname(__file__), 'content', 'doberman1.jpg'), 'rb') as photo_file:
+        photo = photo_file.read()
+    response = await ac.post(
+        url="/music/",
+        headers=headers,
+        data={
+            "name": "renamed_song",
+            "genre": "rock",
+            "album_id": 1,
+        },
+        files={
+            'photo_file': ('doberman1.jpg', photo),
+            # Картинка, переименованная в .mp3, отклоняется по первым байтам
+            'song_file': ('song.mp3', photo),
+        }
+    )
+    assert response.status_code == 400
+    assert "does not match" in response.json()["detail"]
+
+    logging.info("Test 'create_song_with_renamed_file' was successful")
+
+
 async def test_create_song(ac, login_user):
     headers = {"Authorization": f"Bearer {login_user['access_token']}"}
     response = await ac.post(
@@ -145,6 +258,20 @@ async def test_get_all_songs(ac, login_user):
     logging.info("Test 'get_all_songs' was successful")
 
 
+async def test_get_song_not_modified(ac, ):
+    response = await ac.get(url="/music/1/")
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert etag.startswith('W/')
+    assert response.headers['Cache-Control'] == 'no-cache'
+
+    response = await ac.get(url="/music/1/", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b''
+
+    logging.info("Test 'get_song_not_modified' was successful")
+
+
 async def test_update_song(ac, login_user):
     headers = {"Authorization": f"Bearer {login_user['access_token']}"}
     response = await ac.patch(
@@ -174,6 +301,285 @@ async def test_update_song(ac, login_user):
     logging.info("Test 'update_song' was successful")
 
 
+async def test_get_all_songs_after_update(ac, ):
+    # Список из test_get_all_songs закэширован - изменение песни должно его сбросить
+    response = await ac.get(url="/music/")
+    assert response.status_code == 200
+    assert response.json()[0]["name"] == "song_name1"
+    etag = response.headers['ETag']
+
+    response = await ac.get(url="/music/", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    response = await ac.get(url="/music/", params={"genre": "pop"})
+    assert [song["id"] for song in response.json()] == [1]
+    response = await ac.get(url="/music/", params={"genre": "rock"})
+    assert response.json() == []
+
+    logging.info("Test 'get_all_songs_after_update' was successful")
+
+
+async def test_get_song_after_album_rename(ac, login_user):
+    # Песня закэширована вместе с альбомом - переименование альбома должно ее сбросить
+    response = await ac.get(url="/music/1/")
+    assert response.json()["album"]["name"] == "album_name1"
+    etag = response.headers['ETag']
+
+    headers = {"Authorization": f"Bearer {login_user['access_token']}"}
+    response = await ac.patch(
+        url="/album/1/",
+        headers=headers,
+        data={"name": "album_name2"},
+    )
+    assert response.status_code == 200
+
+    # updated_at песни не изменился, но ETag старого тела уже не совпадает
+    response = await ac.get(url="/music/1/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["album"]["name"] == "album_name2"
+
+    logging.info("Test 'get_song_after_album_rename' was successful")
+
+
+async def test_get_song_cached_after_write(ac, login_user, redis_helper):
+    # Чтение сразу после изменения снова кэширует песню, а не ждет, пока истечет метка changed/
+    headers = {"Authorization": f"Bearer {login_user['access_token']}"}
+    response = await ac.patch(
+        url="/album/1/",
+        headers=headers,
+        data={"name": "album_name2"},
+    )
+    assert response.status_code == 200
+
+    response = await ac.get(url="/music/1/")
+    assert response.status_code == 200
+    assert await redis_helper.get("song/1") is not None
+
+    logging.info("Test 'get_song_cached_after_write' was successful")
+
+
+async def test_get_batch(ac, ):
+    response = await ac.get(url="/music/batch", params={"ids": "1,999,1"})
+    assert response.status_code == 200
+    assert [song["id"] for song in response.json()] == [1, 1]
+    assert response.json()[0]["album"]["name"] == "album_name2"
+
+    response = await ac.get(url="/album/batch", params={"ids": "999,1"})
+    assert response.status_code == 200
+    assert [album["id"] for album in response.json()] == [1]
+    assert [song["name"] for song in response.json()[0]["songs"]] == ["song_name1"]
+
+    response = await ac.get(url="/music/batch", params={"ids": "1,a"})
+    assert response.status_code == 400
+
+    logging.info("Test 'get_batch' was successful")
+
+
+async def test_download_song_clip(ac, ):
+    full_response = await ac.get(
+        url="/music/download",
+        params={"file_name": song_filename}
+    )
+    response = await ac.get(
+        url="/music/download",
+        params={"file_name": song_filename, "start": 0, "duration": 1}
+    )
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+    assert int(response.headers['Content-Length']) < int(full_response.headers['Content-Length'])
+    # Отрезок начинается с заголовка кадра MP3
+    assert response.content[0] == 0xFF
+
+    logging.info("Test 'download_song_clip' was successful")
+
+
+async def test_download_song_not_modified(ac, ):
+    response = await ac.get(
+        url="/music/download",
+        params={"file_name": song_filename}
+    )
+    assert response.status_code == 200
+    # Сильный ETag - sha256 содержимого, он же имя файла
+    assert response.headers['ETag'] == f'"{song_filename.split(".")[0]}"'
+
+    response = await ac.get(
+        url="/music/download",
+        params={"file_name": song_filename},
+        headers={"If-None-Match": response.headers['ETag']}
+    )
+    assert response.status_code == 304
+    assert response.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+
+    logging.info("Test 'download_song_not_modified' was successful")
+
+
+async def test_get_song_playlist(ac, ):
+    response = await ac.get(url="/music/1/playlist.m3u8")
+    # Сегменты режет воркер: пока их нет, плейлист недоступен
+    assert response.status_code in (200, 404)
+    if response.status_code == 200:
+        assert response.text.startswith('#EXTM3U')
+        segment_url = next(line for line in response.text.splitlines() if not line.startswith('#'))
+        segment_response = await ac.get(url=segment_url)
+        assert segment_response.status_code == 200
+        assert segment_response.content[0] == 0xFF
+
+    response = await ac.get(url="/music/999/playlist.m3u8")
+    assert response.status_code == 404
+
+    logging.info("Test 'get_song_playlist' was successful")
+
+
+def test_split_segments():
+    data = generate_mp3(15)
+    segments = split_segments(data)
+    # 15.02 с: два полных сегмента и остаток
+    assert len(segments) == math.ceil(15 / SEGMENT_DURATION)
+    assert all(segment.startswith(b'\xff\xfb') for segment in segments)
+    assert b''.join(segments) == data
+
+    # Тег ID3v1 в конце файла в последний сегмент не попадает
+    assert b''.join(split_segments(data + b'TAG' + bytes(125))) == data
+    assert split_segments(b'not an mp3') == []
+
+    logging.info("Test 'split_segments' was successful")
+
+
+def test_build_frame_index():
+    frame_duration = 1152 / 44100 * 1000
+    data = generate_mp3(10)
+    frame_count = len(data) // len(MP3_FRAME)
+    frame_index = build_frame_index(io.BytesIO(data))
+    assert frame_index.duration == round(frame_count * frame_duration)
+    # 417 байт на 26.1 мс - 127.7 кбит/с
+    assert frame_index.bitrate == 128
+    # Точки индекса - до начала последнего кадра
+    assert len(frame_index.offsets) == int((frame_count - 1) * frame_duration // FRAME_INDEX_INTERVAL) + 1
+    # Точка индекса - первый кадр, начинающийся не раньше нее
+    assert [offset // len(MP3_FRAME) for offset in frame_index.offsets[:3]] == [
+        0, 
+        math.ceil(FRAME_INDEX_INTERVAL / frame_duration), 
+        math.ceil(2 * FRAME_INDEX_INTERVAL / frame_duration)
+    ]
+
+    # Тег ID3v2 (размер - syncsafe integer) пропускается, смещения считаются от начала файла
+    tag = b'ID3\x04\x00\x00' + bytes([0, 0, 1, 0]) + bytes(128)
+    tagged_index = build_frame_index(io.BytesIO(tag + data))
+    assert tagged_index.duration == frame_index.duration
+    assert tagged_index.offsets[0] == len(tag)
+    assert [offset - len(tag) for offset in tagged_index.offsets] == list(frame_index.offsets)
+
+    # После мусора с байтами 0xFF разбор находит следующий настоящий кадр
+    garbage = b'\xff\x00\x00\xff\x12' * 20
+    middle = len(MP3_FRAME) * (frame_count // 2)
+    resynced_index = build_frame_index(io.BytesIO(data[:middle] + garbage + data[middle:]))
+    assert resynced_index.duration == frame_index.duration
+    resynced = data[:middle] + garbage + data[middle:]
+    assert all(resynced[offset:offset + 2] == b'\xff\xfb' for offset in resynced_index.offsets)
+
+    assert build_frame_index(io.BytesIO(b'not an mp3' * 100)) is None
+
+    logging.info("Test 'build_frame_index' was successful")
+
+
+def test_frame_index_byte_range():
+    frame_index = build_frame_index(io.BytesIO(generate_mp3(10)))
+    offsets = frame_index.offsets
+    assert frame_index.byte_range(0) == 'bytes=0-'
+    # Отрезок заканчивается перед кадром следующей точки индекса
+    assert frame_index.byte_range(0, 1) == f'bytes=0-{offsets[2] - 1}'
+    assert frame_index.byte_range(2.5, 1) == f'bytes={offsets[5]}-{offsets[7] - 1}'
+    # Отрезок до конца файла и за его концом
+    assert frame_index.byte_range(9.5, 5) == f'bytes={offsets[19]}-'
+    assert frame_index.byte_range(frame_index.duration / 1000) is None
+    assert frame_index.byte_range(60) is None
+
+    logging.info("Test 'frame_index_byte_range' was successful")
+
+
+def test_frame_index_serialization():
+    frame_index = build_frame_index(io.BytesIO(generate_mp3(10)))
+    data = frame_index.to_bytes()
+    # uint32 little-endian на точку индекса
+    assert len(data) == 4 * len(frame_index.offsets)
+    assert int.from_bytes(data[4:8], 'little') == frame_index.offsets[1]
+    assert FrameIndex.from_bytes(data, frame_index.duration, frame_index.bitrate) == frame_index
+
+    logging.info("Test 'frame_index_serialization' was successful")
+
+
+def test_build_playlist():
+    playlist = build_playlist(["/segments/0", "/segments/1", "/segments/2"], duration=15020)
+    assert playlist.splitlines() == [
+        '#EXTM3U',
+        '#EXT-X-VERSION:3',
+        '#EXT-X-TARGETDURATION:6',
+        '#EXT-X-MEDIA-SEQUENCE:0',
+        '#EXT-X-PLAYLIST-TYPE:VOD',
+        '#EXTINF:6.000,',
+        '/segments/0',
+        '#EXTINF:6.000,',
+        '/segments/1',
+        '#EXTINF:3.020,',
+        '/segments/2',
+        '#EXT-X-ENDLIST',
+    ]
+
+    logging.info("Test 'build_playlist' was successful")
+
+
+async def test_get_song_waveform(ac, ):
+    response = await ac.get(url="/music/1/waveform")
+    # Волну строит воркер: пока ее нет, отвечаем 404
+    assert response.status_code in (200, 404)
+    if response.status_code == 200:
+        # 1024 пары (min, max) по байту
+        assert len(response.content) == 2048
+        assert response.headers['Cache-Control'] == 'public, max-age=60'
+
+    response = await ac.get(url="/music/999/waveform")
+    assert response.status_code == 404
+
+    logging.info("Test 'get_song_waveform' was successful")
+
+
+def test_compute_peaks():
+    # По 4 сэмпла на точку: минимум и максимум каждой - крайние значения int16
+    peaks = compute_peaks(generate_wav([-32768, 0, 0, 32767] * WAVEFORM_POINTS))
+    assert len(peaks) == 2 * WAVEFORM_POINTS == 2048
+    values = np.frombuffer(peaks, dtype=np.int8)
+    assert (values[0::2] == -128).all()
+    assert (values[1::2] == 127).all()
+
+    # Короткий файл дополняется тишиной до WAVEFORM_POINTS точек
+    peaks = compute_peaks(generate_wav([32767] * 100))
+    assert len(peaks) == 2048
+    values = np.frombuffer(peaks, dtype=np.int8)
+    assert (values[:200] == 127).all()
+    assert (values[200:] == 0).all()
+
+    assert compute_peaks(b'not audio') is None
+
+    logging.info("Test 'compute_peaks' was successful")
+
+
+async def test_download_album_archive(ac, ):
+    response = await ac.get(url="/album/1/archive")
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == 'application/zip'
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        members = archive.infolist()
+        assert [member.filename for member in members] == ['01 - song_name1.mp3']
+        # MP3 не сжимается - файлы лежат в архиве как есть
+        assert members[0].compress_type == zipfile.ZIP_STORED
+        assert archive.testzip() is None
+
+    response = await ac.get(url="/album/999/archive")
+    assert response.status_code == 404
+
+    logging.info("Test 'download_album_archive' was successful")
+
+
 async def test_delete_song(ac, login_user):
     headers = {"Authorization": f"Bearer {login_user['access_token']}"}
     response = await ac.delete(
@@ -209,4 +615,55 @@ async def test_delete_album(ac, login_user):
     file_name = None
     logging.info('GLOBAL Photo file name after tests: %s', file_name)
 
-    logging.info("Test 'delete_album' was successful")
\ No newline at end of file
+    logging.info("Test 'delete_album' was successful")
+
+
+async def test_create_album_with_presigned_upload(ac, login_user):
+    headers = {"Authorization": f"Bearer {login_user['access_token']}"}
+    response = await ac.post(
+        url="/album/uploads/",
+        headers=headers,
+        json={"photo_file_name": "doberman1.jpg"}
+    )
+    assert response.status_code == 200
+    photo = response.json()["photo"]
+    assert photo["content_type"] == "image/jpeg"
+
+    # Файл уходит напрямую в хранилище, минуя API
+    with open(os.path.join(os.path.dirname(__file__), 'content', 'doberman1.jpg'), 'rb') as photo_file:
+        async with AsyncClient() as storage_client:
+            upload_response = await storage_client.put(
+                photo["url"],
+                content=photo_file.read(),
+                headers={"Content-Type": photo["content_type"]}
+            )
+    assert upload_response.status_code == 200
+
+    response = await ac.post(
+        url="/album/uploads/complete/",
+        headers=headers,
+        json={"name": "presigned_album", "photo_key": photo["key"]}
+    )
+    assert response.status_code == 201
+    assert response.json()["photo_filename"] == photo["file_name"]
+
+    # Токен загрузки одноразовый
+    response = await ac.post(
+        url="/album/uploads/complete/",
+        headers=headers,
+        json={"name": "presigned_album", "photo_key": photo["key"]}
+    )
+    assert response.status_code == 400
+
+    logging.info("Test 'create_album_with_presigned_upload' was successful")
+
+
+async def test_delete_album_with_presigned_upload(ac, login_user):
+    headers = {"Authorization": f"Bearer {login_user['access_token']}"}
+    response = await ac.delete(
+        url="/album/2/",
+        headers=headers
+    )
+    assert response.status_code == 204
+
+    logging.info("Test 'delete_album_with_presigned_upload' was successful")
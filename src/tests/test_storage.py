@@ -0,0 +1,319 @@
+import asyncio
+import io
+import logging
+import os
+import time
+from datetime import datetime, timezone
+
+import pytest
+from fastapi import HTTPException, UploadFile
+
+from media_cache import MediaCache
+from music.constants import IMAGES, MAX_FILE_SIZES, SUPPORTED_FILE_TYPES
+from music.service.mixins.file_action_mixin import FileActionMixin
+from storage.local import LocalStorage, _range_is_current, _resolve_range
+
+PHOTO_KEY = 'songs/images/ab/ab.jpg'
+
+with open(os.path.join(os.path.dirname(__file__), 'content', 'doberman1.jpg'), 'rb') as photo_file:
+    photo = photo_file.read()
+
+
+def upload_file(content: bytes = photo) -> UploadFile:
+    return UploadFile(file=io.BytesIO(content), filename='doberman1.jpg', size=len(content))
+
+
+class MemoryMediaRepository:
+    # Счетчики ссылок MediaObject без БД: ключ -> [ref_count, uploaded]
+    def __init__(self):
+        self.objects: dict[str, list] = {}
+
+    async def acquire_keys(self, session, keys: list[str], uploaded: bool = False) -> dict[str, tuple[int, bool]]:
+        for key in keys:
+            state = self.objects.setdefault(key, [0, uploaded])
+            state[0] += 1
+            state[1] = state[1] or uploaded
+        return {key: tuple(self.objects[key]) for key in keys}
+
+    async def mark_uploaded(self, session, keys: list[str]) -> None:
+        for key in keys:
+            self.objects[key][1] = True
+
+    async def release_keys(self, session, keys: list[str]) -> dict[str, int]:
+        for key in keys:
+            self.objects[key][0] -= 1
+        return {key: self.objects[key][0] for key in keys}
+
+
+class FailingStorage(LocalStorage):
+    # Первая загрузка падает, как оборванный PUT
+    failures = 1
+
+    async def upload_file(self, file, key, SUPPORTED_FILE_TYPES) -> None:
+        if self.failures:
+            self.failures -= 1
+            raise HTTPException(status_code=400, detail='Upload failed')
+        await super().upload_file(file, key, SUPPORTED_FILE_TYPES)
+
+
+@pytest.fixture
+def storage(tmp_path) -> LocalStorage:
+    storage = LocalStorage(str(tmp_path))
+    storage.connect()
+    return storage
+
+
+async def test_store_files_concurrent_duplicates(storage):
+    media_repository = MemoryMediaRepository()
+    await asyncio.gather(*(
+        FileActionMixin._store_files(None, storage, [(upload_file(), PHOTO_KEY, IMAGES)], media_repository)
+        for _ in range(3)
+    ))
+    assert media_repository.objects[PHOTO_KEY] == [3, True]
+    assert await storage.read_file(PHOTO_KEY) == photo
+
+    # Загруженный объект повторно не загружается
+    await FileActionMixin._store_files(None, FailingStorage(storage.directory), [(upload_file(), PHOTO_KEY, IMAGES)], media_repository)
+    assert media_repository.objects[PHOTO_KEY] == [4, True]
+
+    logging.info("Test 'store_files_concurrent_duplicates' was successful")
+
+
+async def test_store_files_after_failed_first_upload(tmp_path):
+    storage = FailingStorage(str(tmp_path))
+    storage.connect()
+    media_repository = MemoryMediaRepository()
+    with pytest.raises(HTTPException):
+        await FileActionMixin._store_files(None, storage, [(upload_file(), PHOTO_KEY, IMAGES)], media_repository)
+    assert media_repository.objects[PHOTO_KEY] == [0, False]
+
+    # Ссылку взял запрос, чья загрузка еще идет или упадет: следующий не верит счетчику и загружает сам
+    await media_repository.acquire_keys(None, [PHOTO_KEY])
+    await FileActionMixin._store_files(None, storage, [(upload_file(), PHOTO_KEY, IMAGES)], media_repository)
+    assert media_repository.objects[PHOTO_KEY] == [2, True]
+    assert await storage.read_file(PHOTO_KEY) == photo
+
+    logging.info("Test 'store_files_after_failed_first_upload' was successful")
+
+
+def counting_fetch(content: bytes = b'x' * 10, delay: float = 0.05, error: Exception | None = None):
+    calls = []
+
+    async def fetch(path):
+        calls.append(path)
+        await asyncio.sleep(delay)
+        if error:
+            raise error
+        path.write_bytes(content)
+        return '"etag"', None
+    return fetch, calls
+
+
+async def test_media_cache_single_flight(tmp_path):
+    media_cache = MediaCache(str(tmp_path), max_size=1024, ttl=60)
+    fetch, calls = counting_fetch()
+    results = await asyncio.gather(*(media_cache.get('songs/music/a.mp3', fetch) for _ in range(5)))
+    # Одновременные промахи ждут одну загрузку
+    assert len(calls) == 1
+    assert {path for path, _ in results} == {results[0][0]}
+    assert results[0][0].read_bytes() == b'x' * 10
+    assert results[0][1].etag == '"etag"'
+    await media_cache.get('songs/music/a.mp3', fetch)
+    assert len(calls) == 1
+    # Временные файлы не остаются
+    assert [path.name for path in tmp_path.iterdir()] == [results[0][0].name]
+
+    logging.info("Test 'media_cache_single_flight' was successful")
+
+
+async def test_media_cache_eviction(tmp_path):
+    media_cache = MediaCache(str(tmp_path), max_size=25, ttl=60)
+    fetch, calls = counting_fetch(delay=0)
+    first, _ = await media_cache.get('a', fetch)
+    second, _ = await media_cache.get('b', fetch)
+    # Чтение делает a самым свежим - третий объект вытесняет b
+    await media_cache.get('a', fetch)
+    third, _ = await media_cache.get('c', fetch)
+    assert first.exists() and third.exists()
+    assert not second.exists()
+    assert media_cache._size == 20
+    assert len(calls) == 3
+
+    logging.info("Test 'media_cache_eviction' was successful")
+
+
+async def test_media_cache_refetch_after_ttl(tmp_path, monkeypatch):
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now)
+    media_cache = MediaCache(str(tmp_path), max_size=1024, ttl=60)
+    fetch, calls = counting_fetch(delay=0)
+    await media_cache.get('a', fetch)
+    now += 59
+    await media_cache.get('a', fetch)
+    assert len(calls) == 1
+
+    now += 2
+    await media_cache.get('a', fetch)
+    assert len(calls) == 2
+
+    # Объект удален из хранилища: устаревшая копия больше не отдается
+    now += 61
+    missing_fetch, _ = counting_fetch(delay=0, error=FileNotFoundError('a'))
+    with pytest.raises(FileNotFoundError):
+        await media_cache.get('a', missing_fetch)
+    assert list(tmp_path.iterdir()) == []
+    assert media_cache._size == 0
+
+    logging.info("Test 'media_cache_refetch_after_ttl' was successful")
+
+
+async def test_media_cache_failed_and_cancelled_fill(tmp_path):
+    media_cache = MediaCache(str(tmp_path), max_size=1024, ttl=60)
+    failing_fetch, _ = counting_fetch(error=OSError('storage is down'))
+    results = await asyncio.gather(
+        *(media_cache.get('a', failing_fetch) for _ in range(3)),
+        return_exceptions=True
+    )
+    # Ошибку загрузки получают все ожидавшие ее запросы
+    assert all(isinstance(result, OSError) for result in results)
+
+    # Отмена загружавшего запроса не отменяет ожидающих: они скачивают сами
+    fetch, calls = counting_fetch()
+    filler = asyncio.create_task(media_cache.get('a', fetch))
+    await asyncio.sleep(0.01)
+    waiter = asyncio.create_task(media_cache.get('a', fetch))
+    await asyncio.sleep(0.01)
+    filler.cancel()
+    path, _ = await waiter
+    assert filler.cancelled()
+    assert path.read_bytes() == b'x' * 10
+    assert len(calls) == 2
+    assert [item.name for item in tmp_path.iterdir()] == [path.name]
+
+    logging.info("Test 'media_cache_failed_and_cancelled_fill' was successful")
+
+
+class BrokenFile(io.BytesIO):
+    # Соединение обрывается после первого куска
+    def read(self, size: int = -1) -> bytes:
+        if self.tell():
+            raise OSError('Connection reset')
+        return super().read()
+
+
+def stored_files(storage: LocalStorage) -> list[str]:
+    return sorted(str(path.relative_to(storage.directory)) for path in storage.directory.rglob('*') if path.is_file())
+
+
+async def test_local_storage_atomic_write(storage):
+    await storage.put_file('songs/images/a.jpg', b'first', 'image/jpeg')
+    await storage.put_file('songs/images/a.jpg', b'second', 'image/jpeg')
+    assert await storage.read_file('songs/images/a.jpg') == b'second'
+
+    await storage.upload_file(upload_file(), PHOTO_KEY, SUPPORTED_FILE_TYPES[IMAGES])
+    # Оборванная загрузка не портит уже лежащий по ключу файл
+    broken = UploadFile(file=BrokenFile(photo[:64]), filename='doberman1.jpg')
+    with pytest.raises(OSError):
+        await storage.upload_file(broken, PHOTO_KEY, SUPPORTED_FILE_TYPES[IMAGES])
+    assert await storage.read_file(PHOTO_KEY) == photo
+    # Временных файлов не остается
+    assert stored_files(storage) == ['songs/images/a.jpg', PHOTO_KEY]
+
+    logging.info("Test 'local_storage_atomic_write' was successful")
+
+
+async def test_local_storage_size_limit(storage, monkeypatch):
+    monkeypatch.setitem(MAX_FILE_SIZES, 'jpg', len(photo) - 1)
+    with pytest.raises(HTTPException) as exc:
+        await storage.upload_file(upload_file(), PHOTO_KEY, SUPPORTED_FILE_TYPES[IMAGES])
+    assert exc.value.status_code == 400
+
+    # Размер заранее не известен: лимит проверяется по мере чтения
+    streamed = upload_file()
+    streamed.size = None
+    with pytest.raises(HTTPException) as exc:
+        await storage.upload_file(streamed, PHOTO_KEY, SUPPORTED_FILE_TYPES[IMAGES])
+    assert exc.value.status_code == 400
+    assert stored_files(storage) == []
+
+    logging.info("Test 'local_storage_size_limit' was successful")
+
+
+@pytest.mark.parametrize('key', ['../outside.jpg', 'songs/../../outside.jpg', '/etc/passwd', '.', ''])
+async def test_local_storage_path_traversal(storage, key):
+    with pytest.raises(HTTPException) as exc:
+        await storage.put_file(key, b'content', 'image/jpeg')
+    assert exc.value.status_code == 400
+    with pytest.raises(HTTPException) as exc:
+        await storage.read_file(key)
+    assert exc.value.status_code == 400
+    assert not (storage.directory.parent / 'outside.jpg').exists()
+
+    logging.info("Test 'local_storage_path_traversal' was successful")
+
+
+async def test_local_storage_range_reads(storage):
+    content = bytes(range(256)) * 1024
+    await storage.put_file('songs/music/a.mp3', content, 'audio/mpeg')
+
+    for byte_range, start, end in [
+        ('bytes=0-99', 0, 99),
+        ('bytes=1000-', 1000, len(content) - 1),
+        ('bytes=-100', len(content) - 100, len(content) - 1),
+        ('bytes=100-999999999', 100, len(content) - 1),
+    ]:
+        expected = content[start:end + 1]
+        assert await storage.read_file('songs/music/a.mp3', byte_range) == expected
+        stream = await storage.stream_file('songs/music/a.mp3', byte_range)
+        # Диапазон больше куска отдается из mmap несколькими частями
+        assert b''.join([chunk async for chunk in stream.body]) == expected
+        assert stream.content_length == len(expected)
+        assert stream.content_range == f'bytes {start}-{end}/{len(content)}'
+
+    stream = await storage.stream_file('songs/music/a.mp3')
+    assert stream.body is None and stream.content_length == len(content)
+
+    # If-Range с устаревшим ETag: отдается весь файл
+    stream = await storage.stream_file('songs/music/a.mp3', 'bytes=0-99', if_range='"stale"')
+    assert stream.body is None and stream.content_range is None
+
+    for byte_range in ['bytes=262144-', 'bytes=300000-300001']:
+        with pytest.raises(HTTPException) as exc:
+            await storage.stream_file('songs/music/a.mp3', byte_range)
+        assert exc.value.status_code == 416
+        assert exc.value.headers == {'Content-Range': f'bytes */{len(content)}'}
+        with pytest.raises(HTTPException) as exc:
+            await storage.read_file('songs/music/a.mp3', byte_range)
+        assert exc.value.status_code == 416
+
+    logging.info("Test 'local_storage_range_reads' was successful")
+
+
+def test_resolve_range():
+    assert _resolve_range('bytes=0-0', 10) == (0, 0)
+    assert _resolve_range('bytes=5-', 10) == (5, 9)
+    assert _resolve_range('bytes=-3', 10) == (7, 9)
+    assert _resolve_range('bytes=-30', 10) == (0, 9)
+    assert _resolve_range('bytes=8-30', 10) == (8, 9)
+    with pytest.raises(HTTPException) as exc:
+        _resolve_range('bytes=10-', 10)
+    assert exc.value.status_code == 416
+    assert exc.value.headers['Content-Range'] == 'bytes */10'
+
+    logging.info("Test 'resolve_range' was successful")
+
+
+def test_range_is_current():
+    last_modified = datetime(2024, 1, 1, 12, 0, tzinfo=timezone.utc)
+    assert _range_is_current(None, '"a"', last_modified)
+    assert _range_is_current('"a"', '"a"', last_modified)
+    assert not _range_is_current('"b"', '"a"', last_modified)
+    assert not _range_is_current('"a"', None, last_modified)
+    # Слабый ETag не подходит для If-Range
+    assert not _range_is_current('W/"a"', 'W/"a"', last_modified)
+    assert _range_is_current('Mon, 01 Jan 2024 12:00:00 GMT', '"a"', last_modified)
+    assert not _range_is_current('Mon, 01 Jan 2024 11:59:59 GMT', '"a"', last_modified)
+    assert not _range_is_current('Mon, 01 Jan 2024 12:00:00 GMT', '"a"', None)
+    assert not _range_is_current('not a date', '"a"', last_modified)
+
+    logging.info("Test 'range_is_current' was successful")